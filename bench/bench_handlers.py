@@ -0,0 +1,202 @@
+"""Benchmark the bot's hot handlers against synthetic venue datasets.
+
+Drives handle_location, handle_live_location, show_area_venues, show_vibe_venues, show_page
+(Next/Prev), show_current_happy_hours, inline_search and format_place_details with real Update objects and a stub Bot API, and reports
+latency percentiles, throughput and peak traced memory per handler and dataset size.
+
+    python bench/bench_handlers.py --sizes 1000 10000 100000 --iterations 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+import bot  # noqa: E402
+from stub_bot import (  # noqa: E402
+    callback_update, inline_query_update, live_location_update, location_update, make_context, make_stub_bot,
+)
+from synthetic_venues import AREAS, CENTER_LAT, CENTER_LON, NAME_WORDS, STREETS, VIBES, write_venues  # noqa: E402
+from compiled_venues import write_snapshot  # noqa: E402
+from city_shards import CityManifest, ShardedVenueStore  # noqa: E402
+from venue_store import VenueStore  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return 0.0
+    rank = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples))) - 1))
+    return samples[rank]
+
+
+def make_scenarios(stub_bot, snapshot, rng):
+    """Map handler name -> zero-arg coroutine factory driving one request"""
+    counter = iter(range(1, 10 ** 9))
+
+    def nearby():
+        lat = rng.gauss(CENTER_LAT, 0.02)
+        lon = rng.gauss(CENTER_LON, 0.01)
+        update = location_update(stub_bot, next(counter), rng.randint(1, 10000), lat, lon)
+        return bot.handle_location(update, make_context(stub_bot, lang=rng.choice(['en', 'he'])))
+
+    # Users walking around with a live location shared; most updates move a few metres
+    walkers = []
+    for chat_id in range(1, 1001):
+        lat = rng.gauss(CENTER_LAT, 0.02)
+        lon = rng.gauss(CENTER_LON, 0.01)
+        bot.live_tracker.start((chat_id, chat_id), bot.LiveSession(
+            stub_bot, chat_id, chat_id, 2, 'en', float('inf'),
+            lat, lon, snapshot.spatial.cell_of(lat, lon), snapshot.version
+        ))
+        walkers.append([chat_id, lat, lon])
+
+    def live():
+        walker = rng.choice(walkers)
+        walker[1] += rng.gauss(0, 0.0001)
+        walker[2] += rng.gauss(0, 0.0001)
+        chat_id, lat, lon = walker
+        update = live_location_update(stub_bot, next(counter), chat_id, chat_id, lat, lon, live_period=3600)
+        return bot.handle_live_location(update, make_context(stub_bot))
+
+    def area():
+        data = f"area_{rng.choice(AREAS).lower().replace(' ', '_')}"
+        update = callback_update(stub_bot, next(counter), rng.randint(1, 10000), data)
+        return bot.show_area_venues(update, make_context(stub_bot, lang=rng.choice(['en', 'he'])))
+
+    def vibe():
+        data = f"vibe_{rng.choice(VIBES)[0].lower()}"
+        update = callback_update(stub_bot, next(counter), rng.randint(1, 10000), data)
+        return bot.show_vibe_venues(update, make_context(stub_bot, lang=rng.choice(['en', 'he'])))
+
+    def next_page():
+        # A later page of an area list, as sent by a Next button
+        area_key = rng.choice(AREAS).lower().replace(' ', '_')
+        data = bot.encode_cursor("area", (area_key,), snapshot.version, bot.PAGE_SIZE * rng.randint(1, 10))
+        update = callback_update(stub_bot, next(counter), rng.randint(1, 10000), data)
+        return bot.show_page(update, make_context(stub_bot, lang=rng.choice(['en', 'he'])))
+
+    def current():
+        update = callback_update(stub_bot, next(counter), rng.randint(1, 10000), "current_happy_hours")
+        return bot.show_current_happy_hours(update, make_context(stub_bot, lang=rng.choice(['en', 'he'])))
+
+    def search():
+        # Keystroke-level traffic: a random prefix of a venue name or street
+        words = rng.choice([NAME_WORDS, STREETS])
+        text = rng.choice(words)
+        text = text[:rng.randint(1, len(text))]
+        update = inline_query_update(stub_bot, next(counter), rng.randint(1, 10000), text)
+        return bot.inline_search(update, make_context(stub_bot, lang=rng.choice(['en', 'he'])))
+
+    async def details():
+        bot.format_place_details(rng.choice(snapshot.venues), None, 'en')
+
+    return {
+        'handle_location': nearby,
+        'handle_live_location': live,
+        'show_area_venues': area,
+        'show_vibe_venues': vibe,
+        'show_page': next_page,
+        'show_current_happy_hours': current,
+        'inline_search': search,
+        'format_place_details': details,
+    }
+
+
+async def run_scenario(factory, iterations, cold_cache):
+    """Run a scenario and return sorted per-call latencies in milliseconds"""
+    latencies = []
+    for _ in range(iterations):
+        if cold_cache:
+            bot.render_cache.clear()
+        coroutine = factory()
+        start = time.perf_counter()
+        await coroutine
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies
+
+
+async def peak_memory(factory, iterations, cold_cache):
+    """Peak traced allocation (KiB) while running a scenario"""
+    tracemalloc.start()
+    try:
+        await run_scenario(factory, iterations, cold_cache)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+async def bench_size(size, args, workdir):
+    path = os.path.join(workdir, f"venues_{size}.json")
+    if not os.path.exists(path):
+        write_venues(path, size, seed=args.seed)
+
+    compiled_path = None
+    if args.compiled:
+        compiled_path = os.path.join(workdir, f"venues_{size}.venues")
+        write_snapshot(VenueStore(path).load(), compiled_path, source_stat=os.stat(path))
+
+    # Point the bot at the synthetic dataset
+    bot.city_manifest = CityManifest.single(path, compiled_path)
+    bot.venue_shards = ShardedVenueStore(bot.city_manifest, check_interval=3600, on_unload=bot.forget_snapshot)
+    start = time.perf_counter()
+    snapshot = bot.venue_shards.load(bot.city_manifest.default)
+    load_ms = (time.perf_counter() - start) * 1000
+    source = "map compiled snapshot" if args.compiled else "load + index build"
+    print(f"\n== {size} venues ({source} {load_ms:.0f} ms) ==")
+    print(f"{'handler':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ops/s':>10}{'peak KiB':>10}")
+
+    stub_bot = await make_stub_bot()
+    rng = random.Random(args.seed)
+    scenarios = make_scenarios(stub_bot, snapshot, rng)
+    for name, factory in scenarios.items():
+        if args.handlers and name not in args.handlers:
+            continue
+        await run_scenario(factory, min(50, args.iterations), args.cold_cache)  # warm-up
+        started = time.perf_counter()
+        latencies = await run_scenario(factory, args.iterations, args.cold_cache)
+        elapsed = time.perf_counter() - started
+        peak = await peak_memory(factory, min(200, args.iterations), args.cold_cache)
+        print(
+            f"{name:<26}{percentile(latencies, 50):>9.3f}{percentile(latencies, 95):>9.3f}"
+            f"{percentile(latencies, 99):>9.3f}{args.iterations / elapsed:>10.0f}{peak:>10.0f}"
+        )
+    await bot.live_tracker.shutdown()
+    await stub_bot.shutdown()
+
+
+async def main_async(args):
+    workdir = args.data_dir or tempfile.mkdtemp(prefix="happyhour-bench-")
+    for size in args.sizes:
+        await bench_size(size, args, workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="dataset sizes to benchmark (up to 1000000)")
+    parser.add_argument("--iterations", type=int, default=1000, help="calls per handler")
+    parser.add_argument("--handlers", nargs="+", help="only run these handlers")
+    parser.add_argument("--cold-cache", action="store_true", help="drop rendered pages before every call")
+    parser.add_argument("--compiled", action="store_true", help="serve from compiled snapshots instead of JSON")
+    parser.add_argument("--data-dir", help="where to keep generated datasets (reused between runs)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
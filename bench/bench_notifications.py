@@ -0,0 +1,98 @@
+"""Benchmark happy hour start notifications at scale.
+
+Builds a synthetic dataset and a population of subscribers (areas, vibes and
+points around Tel Aviv), then times filling the event heap, matching the busiest
+start minute of the week against the subscriptions, and fanning it out through a
+stub Bot API with no send pacing.
+
+    python bench/bench_notifications.py --venues 100000 --subscribers 100000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from collections import Counter
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+import bot  # noqa: E402
+from area_index import area_key  # noqa: E402
+from notifications import StartNotifier  # noqa: E402
+from schedule import TIMEZONE  # noqa: E402
+from stub_bot import make_stub_bot  # noqa: E402
+from synthetic_venues import AREAS, CENTER_LAT, CENTER_LON, VIBES, write_venues  # noqa: E402
+from venue_store import VenueStore  # noqa: E402
+
+
+def make_subscriptions(notifier, count, rng):
+    """Subscribe `count` users to a random area, vibe or point each"""
+    for user_id in range(1, count + 1):
+        user_data = {'lang': rng.choice(['en', 'he'])}
+        roll = rng.random()
+        if roll < 0.4:
+            kind, params = "area", (area_key(rng.choice(AREAS)),)
+        elif roll < 0.6:
+            kind, params = "vibe", (rng.choice(VIBES)[0].lower(),)
+        else:
+            lat = rng.gauss(CENTER_LAT, 0.02)
+            lon = rng.gauss(CENTER_LON, 0.01)
+            kind, params = "near", (f"{lat:.3f}", f"{lon:.3f}", str(rng.choice([1, 2, 5])))
+        notifier.subscribe(user_data, user_id, kind, params)
+        notifier._application.user_data[user_id] = user_data
+
+
+async def main_async(args):
+    path = os.path.join(args.data_dir or tempfile.mkdtemp(prefix="happyhour-bench-"), f"venues_{args.venues}.json")
+    if not os.path.exists(path):
+        write_venues(path, args.venues, seed=args.seed)
+    snapshot = VenueStore(path).load()
+    rng = random.Random(args.seed)
+
+    notifier = StartNotifier(lambda: snapshot, bot.render_start_notification, send_rate=10 ** 9)
+    notifier._application = types.SimpleNamespace(user_data={}, mark_data_for_update_persistence=lambda **kw: None)
+    started = time.perf_counter()
+    make_subscriptions(notifier, args.subscribers, rng)
+    print(f"{args.subscribers} subscriptions indexed in {(time.perf_counter() - started) * 1000:.0f} ms "
+          f"({len(notifier.subscriptions._points)} distinct points)")
+
+    now = datetime(2026, 1, 4, 9, 0, tzinfo=TIMEZONE).timestamp()  # a Sunday morning
+    started = time.perf_counter()
+    notifier._fill(snapshot, now)
+    print(f"event heap filled with {len(notifier._heap)} starts in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    # The busiest start minute is the worst case for one wake-up
+    busiest, _ = Counter(when for when, _ in notifier._heap).most_common(1)[0]
+    due = [venue_id for when, venue_id in notifier._heap if when == busiest]
+    started = time.perf_counter()
+    targets = notifier.subscriptions.match(snapshot, due)
+    match_ms = (time.perf_counter() - started) * 1000
+    print(f"busiest minute: {len(due)} venues start, {len(targets)} chats matched in {match_ms:.0f} ms")
+
+    stub_bot = await make_stub_bot()
+    started = time.perf_counter()
+    await notifier._notify(stub_bot, snapshot, due, time.time())
+    elapsed = time.perf_counter() - started
+    print(f"fan-out to {len(targets)} chats in {elapsed:.2f} s ({len(targets) / elapsed:.0f} messages/s before pacing)")
+    await stub_bot.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--venues', type=int, default=100000)
+    parser.add_argument('--subscribers', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--data-dir', help="reuse/keep generated datasets here")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
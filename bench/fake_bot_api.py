@@ -0,0 +1,311 @@
+"""Local stand-in for the Telegram Bot API server, for end-to-end load tests.
+
+Speaks enough of the Bot API over HTTP for the bot to run unmodified against it
+(point TELEGRAM_API_URL at it): getMe, getUpdates long polling, setWebhook /
+deleteWebhook with updates POSTed to the webhook, sendMessage, editMessageText,
+answerCallbackQuery and answerInlineQuery. Every call can be delayed by a fixed
+latency plus jitter, and every Nth outgoing message call can be refused with a
+429 to exercise flood-control handling. Updates are fed in with push() by
+bench/load_test.py, which also waits on the bot's replies per chat.
+
+    python bench/fake_bot_api.py --port 8081 --latency 0.05 --flood-every 200
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import random
+import time
+import urllib.parse
+
+import httpx
+
+from stub_bot import BOT_USER
+
+logger = logging.getLogger(__name__)
+
+# Form fields the bot sends as plain strings; everything else is JSON-encoded
+TEXT_FIELDS = {'text', 'url', 'secret_token', 'callback_query_id', 'inline_query_id', 'next_offset'}
+# Calls that answer a user and count towards 429 injection and reply tracking
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'answerCallbackQuery', 'answerInlineQuery'}
+# Longest getUpdates long poll accepted, in seconds
+MAX_POLL_TIMEOUT = 50
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests'}
+
+
+def decode_params(body, content_type):
+    """Bot API call parameters from a form-encoded or JSON request body"""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    params = {}
+    for name, value in urllib.parse.parse_qsl(body.decode('utf-8'), keep_blank_values=True):
+        if name not in TEXT_FIELDS:
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[name] = value
+    return params
+
+
+class FakeBotAPI:
+    """In-memory Bot API: queues updates for the bot and records what it sends back"""
+
+    def __init__(self, latency=0.0, jitter=0.0, flood_every=0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.calls = collections.Counter()
+        self.floods = 0
+        self.webhook_url = None
+        self.webhook_deliveries = 0
+        self._rng = random.Random(seed)
+        self._server = None
+        self._connections = set()
+        self._handlers = set()
+        self._message_ids = itertools.count(1)
+        self._message_calls = 0
+        self._updates = collections.deque()
+        self._new_update = asyncio.Event()
+        self._replies = {}
+        self._webhook_task = None
+        self._webhook_secret = None
+        self._webhook_connections = 40
+        self.ready = asyncio.Event()
+
+    @property
+    def url(self):
+        """Base URL for TELEGRAM_API_URL"""
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._serve, host, port, limit=2 ** 20)
+        return self
+
+    async def stop(self):
+        if self._webhook_task is not None:
+            self._webhook_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            # Wake long polls whose client is gone so their handlers finish instead of
+            # being cancelled at exit
+            self._new_update.set()
+            for writer in list(self._connections):
+                writer.close()
+            if self._handlers:
+                await asyncio.wait(list(self._handlers), timeout=1)
+            await self._server.wait_closed()
+
+    # -- feeding updates and collecting replies --------------------------------
+
+    def push(self, update):
+        """Queue an update (a JSON-ready dict) for the bot"""
+        self._updates.append(update)
+        self._new_update.set()
+
+    def replies(self, chat_id):
+        """Queue of (method, params) for messages the bot sent or edited in a chat"""
+        queue = self._replies.get(chat_id)
+        if queue is None:
+            queue = self._replies[chat_id] = asyncio.Queue()
+        return queue
+
+    # -- HTTP ------------------------------------------------------------------
+
+    async def _serve(self, reader, writer):
+        """Handle HTTP/1.1 requests on one keep-alive connection"""
+        self._connections.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self._call(target, headers, body)
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1')
+                    + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _call(self, target, headers, body):
+        """Dispatch /bot<token>/<method> and return (status, JSON body)"""
+        path = urllib.parse.urlsplit(target).path
+        prefix, _, method = path.rpartition('/')
+        if not prefix.startswith('/bot'):
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        try:
+            params = decode_params(body, headers.get('content-type', ''))
+        except ValueError as e:
+            return 400, {'ok': False, 'error_code': 400, 'description': f"Bad Request: {str(e)}"}
+        self.calls[method] += 1
+
+        if method != 'getUpdates' and (self.latency or self.jitter):
+            await asyncio.sleep(self.latency + self._rng.random() * self.jitter)
+        if method in MESSAGE_METHODS and self.flood_every:
+            self._message_calls += 1
+            if self._message_calls % self.flood_every == 0:
+                self.floods += 1
+                return 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after},
+                }
+
+        handler = getattr(self, f"_api_{method}", None)
+        result = await handler(params) if handler is not None else True
+        return 200, {'ok': True, 'result': result}
+
+    # -- Bot API methods -------------------------------------------------------
+
+    async def _api_getMe(self, params):
+        return BOT_USER
+
+    async def _api_getUpdates(self, params):
+        offset = params.get('offset') or 0
+        # A confirmed offset drops everything before it, as Telegram does
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        self.ready.set()
+        if not self._updates and params.get('timeout'):
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), min(params['timeout'], MAX_POLL_TIMEOUT))
+            except asyncio.TimeoutError:
+                pass
+        limit = params.get('limit') or 100
+        return list(itertools.islice(self._updates, limit))
+
+    async def _api_setWebhook(self, params):
+        self.webhook_url = params['url']
+        self._webhook_secret = params.get('secret_token')
+        self._webhook_connections = params.get('max_connections') or 40
+        if params.get('drop_pending_updates'):
+            self._updates.clear()
+        if self._webhook_task is None or self._webhook_task.done():
+            self._webhook_task = asyncio.create_task(self._deliver_webhooks())
+        self.ready.set()
+        return True
+
+    async def _api_deleteWebhook(self, params):
+        self.webhook_url = None
+        if params.get('drop_pending_updates'):
+            self._updates.clear()
+        return True
+
+    async def _api_getWebhookInfo(self, params):
+        return {
+            'url': self.webhook_url or '',
+            'has_custom_certificate': False,
+            'pending_update_count': len(self._updates),
+        }
+
+    def _message(self, params, message_id=None):
+        chat_id = params.get('chat_id', 0)
+        message = {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+        if isinstance(params.get('reply_markup'), dict) and 'inline_keyboard' in params['reply_markup']:
+            message['reply_markup'] = params['reply_markup']
+        self.replies(chat_id).put_nowait(('sendMessage' if message_id is None else 'editMessageText', message))
+        return message
+
+    async def _api_sendMessage(self, params):
+        return self._message(params)
+
+    async def _api_editMessageText(self, params):
+        if 'inline_message_id' in params:
+            return True
+        message = self._message(params, params['message_id'])
+        message['edit_date'] = message['date']
+        return message
+
+    # -- webhook delivery ------------------------------------------------------
+
+    async def _deliver_webhooks(self):
+        """POST queued updates to the webhook, at most max_connections at a time"""
+        headers = {'Content-Type': 'application/json'}
+        if self._webhook_secret:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self._webhook_secret
+        limits = httpx.Limits(max_connections=self._webhook_connections)
+        slots = asyncio.Semaphore(self._webhook_connections)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            async def deliver(update):
+                try:
+                    response = await client.post(self.webhook_url, content=json.dumps(update), headers=headers)
+                    if response.status_code != 200:
+                        logger.warning(f"Webhook answered {response.status_code} to update {update['update_id']}")
+                    self.webhook_deliveries += 1
+                except httpx.HTTPError as e:
+                    logger.warning(f"Webhook delivery failed: {str(e)}")
+                finally:
+                    slots.release()
+
+            while self.webhook_url:
+                if not self._updates:
+                    self._new_update.clear()
+                    await self._new_update.wait()
+                    continue
+                await slots.acquire()
+                asyncio.create_task(deliver(self._updates.popleft()))
+
+
+async def serve_forever(args):
+    api = await FakeBotAPI(args.latency, args.jitter, args.flood_every, args.retry_after).start(args.host, args.port)
+    print(f"Fake Bot API listening on {api.url}; set TELEGRAM_API_URL={api.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many extra seconds, uniformly")
+    parser.add_argument('--flood-every', type=int, default=0, help="answer every Nth message call with a 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Local HTTP stand-in for the listing site and geocoder used by src/ingest.py.
+
+Serves bench/fixtures/ingest with ETag/Last-Modified revalidation and answers
+Nominatim-style /search?q=... requests from geocode.json, so the ingestion
+pipeline can be exercised end to end without the network:
+
+    python bench/fixture_server.py --port 8765 &
+    python src/ingest.py http://127.0.0.1:8765/listing.html \
+        --geocoder-url http://127.0.0.1:8765/search --rate 0 --geocoder-rate 0 -o /tmp/venues.json
+
+--fail-every N answers every Nth request with 503 + Retry-After to exercise retries.
+"""
+import argparse
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ingest')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Static fixture files plus a canned geocoder"""
+
+    server_version = "HappyHourFixtures/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+            count = self.server.requests
+        if self.server.fail_every and count % self.server.fail_every == 0:
+            self._send(503, b'try again\n', {'Retry-After': '0', 'Content-Type': 'text/plain'})
+            return
+
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/search':
+            query = urllib.parse.parse_qs(url.query).get('q', [''])[0]
+            match = self.server.geocodes.get(query)
+            body = json.dumps([match] if match else []).encode('utf-8')
+            self._send(200, body, {'Content-Type': 'application/json'})
+            return
+
+        path = os.path.normpath(os.path.join(self.server.root, url.path.lstrip('/')))
+        if not path.startswith(self.server.root + os.sep) or not os.path.isfile(path):
+            self._send(404, b'not found\n', {'Content-Type': 'text/plain'})
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        headers = {
+            'ETag': etag,
+            'Last-Modified': email.utils.formatdate(os.path.getmtime(path), usegmt=True),
+            'Content-Type': 'text/html; charset=utf-8',
+        }
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, headers={'ETag': etag})
+            return
+        self._send(200, body, headers)
+
+
+def make_server(host='127.0.0.1', port=0, root=FIXTURES_DIR, fail_every=0, verbose=False):
+    """Create (but don't start) a fixture server; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), FixtureHandler)
+    server.root = os.path.abspath(root)
+    server.fail_every = fail_every
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.requests = 0
+    try:
+        with open(os.path.join(server.root, 'geocode.json'), 'r', encoding='utf-8') as f:
+            server.geocodes = json.load(f)
+    except FileNotFoundError:
+        server.geocodes = {}
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve ingestion fixtures over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--root", default=FIXTURES_DIR, help="directory of fixture pages")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every Nth request with 503")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.root, args.fail_every, args.verbose)
+    print(f"Serving {server.root} on http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""End-to-end load test of the bot process against a fake Bot API server.
+
+Starts bench/fake_bot_api.py in-process, runs `python src/bot.py` against it
+(long polling, webhook, or both in turn) on a synthetic dataset, and simulates
+users walking /start -> language -> area, vibe or nearby results -> next page.
+Each step waits for the bot's reply in that chat. The report gives end-to-end
+latency per step, plus update throughput and the Bot API calls seen, including
+injected 429s.
+
+    python bench/load_test.py --users 2000 --venues 10000 --mode both --latency 0.02 --flood-every 500
+    python bench/load_test.py --mode webhook --workers 4   # ingress plus 4 worker processes
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from stub_bot import callback_payload, command_payload, location_payload  # noqa: E402
+from synthetic_venues import CENTER_LAT, CENTER_LON, write_venues  # noqa: E402
+
+BOT_TOKEN = "123456:LOADTEST"
+# Seconds to wait for the bot to load its data and start polling or set its webhook
+STARTUP_TIMEOUT = 120
+
+
+class StepFailed(Exception):
+    """The bot didn't reply to a step in time, or replied with something unexpected"""
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return 0.0
+    rank = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples))) - 1))
+    return samples[rank]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def buttons(message, prefix):
+    """callback_data of the message's inline buttons starting with prefix"""
+    rows = message.get('reply_markup', {}).get('inline_keyboard', [])
+    return [button['callback_data'] for row in rows for button in row
+            if button.get('callback_data', '').startswith(prefix)]
+
+
+class LoadTest:
+    """Simulated users driving the bot through the fake Bot API"""
+
+    def __init__(self, api, args):
+        self.api = api
+        self.args = args
+        self.latencies = collections.defaultdict(list)
+        self.failures = collections.Counter()
+        self._update_ids = itertools.count(1)
+
+    async def step(self, name, chat_id, make_payload, replies=1):
+        """Send one update and wait for the bot's replies; returns the last one"""
+        queue = self.api.replies(chat_id)
+        started = time.perf_counter()
+        self.api.push(make_payload(next(self._update_ids)))
+        message = None
+        try:
+            for _ in range(replies):
+                _, message = await asyncio.wait_for(queue.get(), self.args.timeout)
+        except asyncio.TimeoutError:
+            raise StepFailed(f"{name}: no reply within {self.args.timeout}s") from None
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+        return message
+
+    async def think(self, rng):
+        if self.args.think:
+            await asyncio.sleep(rng.random() * self.args.think)
+
+    async def walk(self, chat_id, rng):
+        """One user's session: start, pick a language, browse one kind of results"""
+        menu = await self.step('start', chat_id, lambda uid: command_payload(uid, chat_id, "/start"))
+        await self.think(rng)
+        lang = rng.choice(buttons(menu, 'lang_'))
+        menu = await self.step('language', chat_id, lambda uid: callback_payload(uid, chat_id, lang, menu['message_id']))
+        message_id = menu['message_id']
+        await self.think(rng)
+
+        flow = rng.choice(self.args.flows)
+        if flow == 'area':
+            choices = await self.step('area_menu', chat_id, lambda uid: callback_payload(uid, chat_id, "find_happy_hour", message_id))
+            choice = rng.choice(buttons(choices, 'area_'))
+            await self.think(rng)
+            results = await self.step('area_results', chat_id, lambda uid: callback_payload(uid, chat_id, choice, message_id))
+        elif flow == 'vibe':
+            choices = await self.step('vibe_menu', chat_id, lambda uid: callback_payload(uid, chat_id, "find_by_vibe", message_id))
+            choice = rng.choice(buttons(choices, 'vibe_'))
+            await self.think(rng)
+            results = await self.step('vibe_results', chat_id, lambda uid: callback_payload(uid, chat_id, choice, message_id))
+        else:
+            # The menu is edited into radius buttons and a reply keyboard message follows
+            await self.step('nearby_menu', chat_id, lambda uid: callback_payload(uid, chat_id, "find_nearby", message_id), replies=2)
+            lat = rng.gauss(CENTER_LAT, 0.02)
+            lon = rng.gauss(CENTER_LON, 0.01)
+            await self.think(rng)
+            results = await self.step('nearby_results', chat_id, lambda uid: location_payload(uid, chat_id, lat, lon))
+
+        cursors = buttons(results, 'pg|')
+        if len(cursors) > 1:
+            # Next comes first when there's no Prev; the last cursor is Refresh
+            await self.think(rng)
+            await self.step('next_page', chat_id, lambda uid: callback_payload(uid, chat_id, cursors[0], results['message_id']))
+
+    async def user(self, chat_id, slots):
+        rng = random.Random(self.args.seed * 1000003 + chat_id)
+        async with slots:
+            try:
+                await self.walk(chat_id, rng)
+            except StepFailed as e:
+                self.failures[str(e).split(':')[0]] += 1
+
+    async def run(self):
+        slots = asyncio.Semaphore(self.args.concurrency or self.args.users)
+        users = [self.user(chat_id, slots) for chat_id in range(1, self.args.users + 1)]
+        started = time.perf_counter()
+        await asyncio.gather(*users)
+        return time.perf_counter() - started
+
+
+def bot_environment(args, api, workdir, mode):
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN=BOT_TOKEN,
+        TELEGRAM_API_URL=api.url,
+        VENUES_FILE=args.venues_file,
+        VENUES_MANIFEST='',
+        VENUES_COMPILED_FILE=os.path.join(workdir, 'missing.venues'),
+        PERSISTENCE_FILE='',
+        POPULARITY_FILE='',
+        METRICS_PORT='',
+        OUTBOUND_GLOBAL_RATE=str(args.global_rate),
+        OUTBOUND_CHAT_RATE=str(args.chat_rate),
+        WEBHOOK_URL='',
+    )
+    if mode == 'webhook':
+        port = free_port()
+        env.update(
+            WEBHOOK_URL=f"http://127.0.0.1:{port}",
+            WEBHOOK_LISTEN='127.0.0.1',
+            WEBHOOK_PORT=str(port),
+            WEBHOOK_SECRET='loadtest',
+            WORKERS=str(args.workers),
+            WORKER_BASE_PORT=str(free_port()),
+        )
+    return env
+
+
+async def run_mode(args, mode, workdir):
+    api = await FakeBotAPI(args.latency, args.jitter, args.flood_every, args.retry_after, seed=args.seed).start()
+    log_path = os.path.join(workdir, f"bot-{mode}.log")
+    with open(log_path, 'wb') as log:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(PROJECT_ROOT, 'src', 'bot.py'),
+            env=bot_environment(args, api, workdir, mode), stdout=log, stderr=log,
+        )
+        try:
+            ready = asyncio.ensure_future(api.ready.wait())
+            exited = asyncio.ensure_future(process.wait())
+            await asyncio.wait({ready, exited}, timeout=STARTUP_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+            exited.cancel()
+            if not ready.done():
+                ready.cancel()
+                print(f"{mode}: the bot didn't start, see {log_path}")
+                return
+            test = LoadTest(api, args)
+            elapsed = await test.run()
+            report(mode, test, api, elapsed)
+        finally:
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+                try:
+                    await asyncio.wait_for(process.wait(), 30)
+                except asyncio.TimeoutError:
+                    process.kill()
+            await api.stop()
+    print(f"bot log: {log_path}")
+
+
+def report(mode, test, api, elapsed):
+    steps = sum(len(samples) for samples in test.latencies.values())
+    print(f"\n== {mode}: {test.args.users} users, {steps} steps in {elapsed:.1f} s "
+          f"({steps / elapsed:.0f} updates/s answered) ==")
+    print(f"{'step':<16}{'count':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, samples in test.latencies.items():
+        samples.sort()
+        print(f"{name:<16}{len(samples):>8}{percentile(samples, 50):>9.1f}{percentile(samples, 95):>9.1f}"
+              f"{percentile(samples, 99):>9.1f}{samples[-1]:>9.1f}")
+    if test.failures:
+        print("timed out: " + ", ".join(f"{name} {count}" for name, count in test.failures.most_common()))
+    calls = ", ".join(f"{method} {count}" for method, count in api.calls.most_common())
+    print(f"Bot API calls: {calls}; 429s injected: {api.floods}")
+
+
+async def main_async(args):
+    workdir = args.data_dir or tempfile.mkdtemp(prefix="happyhour-load-")
+    os.makedirs(workdir, exist_ok=True)
+    if not args.venues_file:
+        args.venues_file = os.path.join(workdir, f"venues_{args.venues}.json")
+        if not os.path.exists(args.venues_file):
+            write_venues(args.venues_file, args.venues, seed=args.seed)
+    modes = ['polling', 'webhook'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        await run_mode(args, mode, workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['polling', 'webhook', 'both'], default='both')
+    parser.add_argument('--users', type=int, default=1000, help="simulated users, one chat each")
+    parser.add_argument('--concurrency', type=int, default=0, help="users active at once (default: all)")
+    parser.add_argument('--flows', nargs='+', choices=['area', 'vibe', 'nearby'], default=['area', 'vibe', 'nearby'])
+    parser.add_argument('--think', type=float, default=0.0, help="up to this many seconds between a user's steps")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds to wait for each reply")
+    parser.add_argument('--venues', type=int, default=10000, help="synthetic dataset size")
+    parser.add_argument('--venues-file', help="use this venues JSON instead of a synthetic one")
+    parser.add_argument('--workers', type=int, default=1, help="bot processes behind the webhook ingress (webhook mode)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the fake API adds to every call")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--flood-every', type=int, default=0, help="answer every Nth message call with a 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    # Telegram's real budgets would make the bot, not the code, the bottleneck
+    parser.add_argument('--global-rate', type=float, default=100000)
+    parser.add_argument('--chat-rate', type=float, default=1000)
+    parser.add_argument('--data-dir', help="where to keep generated datasets and bot logs")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""In-process stand-in for the Telegram Bot API, so handlers run without network I/O."""
+import itertools
+import json
+import time
+import types
+
+from telegram import Bot, Update
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Happy Hour Bench", "username": "happyhour_bench_bot"}
+
+
+class StubRequest(BaseRequest):
+    """BaseRequest that answers every Bot API call locally and counts them"""
+
+    def __init__(self):
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _result(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'sendMessage':
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data is not None else {}
+        body = {"ok": True, "result": self._result(api_method, params)}
+        return 200, json.dumps(body).encode('utf-8')
+
+
+async def make_stub_bot():
+    """Return an initialized Bot wired to a StubRequest"""
+    request = StubRequest()
+    bot = Bot("123456:BENCHMARK", request=request, get_updates_request=StubRequest())
+    await bot.initialize()
+    return bot
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "en"}
+
+
+def _message(message_id, chat_id, **fields):
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": _user(chat_id),
+    }
+    message.update(fields)
+    return message
+
+
+def command_payload(update_id, chat_id, text):
+    """Update JSON for a text message such as a /command"""
+    entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else []
+    return {"update_id": update_id, "message": _message(update_id, chat_id, text=text, entities=entities)}
+
+
+def callback_payload(update_id, chat_id, data, message_id=None):
+    """Update JSON for a tap on an inline button of one of the bot's messages"""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": _message(update_id if message_id is None else message_id, chat_id, text="menu"),
+        },
+    }
+
+
+def location_payload(update_id, chat_id, latitude, longitude, live_period=None):
+    """Update JSON for a location message, live if live_period is given"""
+    location = {"latitude": latitude, "longitude": longitude}
+    if live_period is not None:
+        location["live_period"] = live_period
+    return {"update_id": update_id, "message": _message(update_id, chat_id, location=location)}
+
+
+def callback_update(bot, update_id, chat_id, data):
+    """Build a real Update carrying a callback query, as Telegram would send it"""
+    return Update.de_json(callback_payload(update_id, chat_id, data), bot)
+
+
+def location_update(bot, update_id, chat_id, latitude, longitude, live_period=None):
+    """Build a real Update carrying a location message, live if live_period is given"""
+    return Update.de_json(location_payload(update_id, chat_id, latitude, longitude, live_period), bot)
+
+
+def live_location_update(bot, update_id, chat_id, message_id, latitude, longitude, live_period=None):
+    """Build a real Update moving a live location; without live_period sharing has stopped"""
+    location = {"latitude": latitude, "longitude": longitude}
+    if live_period is not None:
+        location["live_period"] = live_period
+    message = _message(message_id, chat_id, location=location, edit_date=int(time.time()))
+    return Update.de_json({"update_id": update_id, "edited_message": message}, bot)
+
+
+def inline_query_update(bot, update_id, user_id, query, offset=""):
+    """Build a real Update carrying an inline query"""
+    payload = {
+        "update_id": update_id,
+        "inline_query": {"id": str(update_id), "from": _user(user_id), "query": query, "offset": offset},
+    }
+    return Update.de_json(payload, bot)
+
+
+def make_context(bot, **user_data):
+    """Minimal stand-in for CallbackContext exposing what the handlers use"""
+    return types.SimpleNamespace(bot=bot, user_data=dict(user_data), chat_data={}, bot_data={})
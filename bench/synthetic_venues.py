@@ -0,0 +1,88 @@
+"""Generate synthetic venue datasets shaped like data/happyhourstlv_enriched.json."""
+import argparse
+import json
+import random
+
+# Tel Aviv city centre, roughly Dizengoff Square
+CENTER_LAT = 32.0780
+CENTER_LON = 34.7740
+
+AREAS = ["Dizengoff", "Florentin", "Rothschild", "Carmel Market", "Neve Tzedek", "Jaffa", "Sarona"]
+STREETS = ["Dizengoff St", "Florentin St", "Rothschild Blvd", "Allenby St", "Ibn Gabirol St",
+           "King George St", "Ben Yehuda St", "Herzl St", "Shenkin St", "HaYarkon St"]
+NAME_WORDS = ["Bar", "Pub", "Garden", "Lounge", "Corner", "Beer", "Wine", "Social", "Club", "Kitchen",
+              "Port", "Said", "Rooftop", "Cellar", "Tavern", "Brew", "Night", "Moon", "Sun", "Sea"]
+VIBES = [
+    ("Chill", "רגוע"), ("Trendy", "טרנדי"), ("Upscale", "יוקרתי"), ("Casual", "יומיומי"),
+    ("Cozy", "אינטימי"), ("Lively", "תוסס"),
+]
+HOURS_TEMPLATES = [
+    "Sun-Thu, {a}-{b}",
+    "Sun-Thu, {a}-{b}, Fri {c}-{d}",
+    "Daily {a}-{b}",
+    "Sun, 12:00-23:00",
+    "Mon-Wed {a}-{b}, Thu-Sat {c}-{d}",
+    "Fri-Sat 22:00-02:00",
+]
+DEALS = ["1+1 on draft beer", "20% off cocktails", "All day happy hour Sunday",
+         "Half price wine", "Chaser with every beer"]
+
+
+def _time(hour):
+    return f"{hour % 24:02d}:00"
+
+
+def make_venue(rng, idx):
+    """Build one random venue dict"""
+    lat = rng.gauss(CENTER_LAT, 0.025)
+    lon = rng.gauss(CENTER_LON, 0.012)
+    start = rng.randint(16, 20)
+    hours = rng.choice(HOURS_TEMPLATES).format(
+        a=_time(start), b=_time(start + rng.randint(1, 3)),
+        c=_time(start + 1), d=_time(start + rng.randint(2, 4)),
+    )
+    area = rng.choice(AREAS)
+    street = rng.choice(STREETS)
+    vibes = rng.sample(VIBES, rng.randint(1, 2))
+    venue = {
+        "name": f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {idx}",
+        "address": f"{street} {rng.randint(1, 250)}, {area}" if rng.random() < 0.6 else f"{street} {rng.randint(1, 250)}",
+        "latitude": round(lat, 7),
+        "longitude": round(lon, 7),
+        "deal": hours if rng.random() < 0.7 else rng.choice(DEALS),
+        "hours": hours,
+        "phone": f"03-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+        "vibe": {
+            "en": ", ".join(en for en, _ in vibes),
+            "he": ", ".join(he for _, he in vibes),
+        },
+    }
+    if rng.random() < 0.5:
+        venue["website"] = f"https://venue{idx}.example.co.il/"
+    return venue
+
+
+def generate_venues(count, seed=0):
+    """Return a list of `count` synthetic venues"""
+    rng = random.Random(seed)
+    return [make_venue(rng, idx) for idx in range(count)]
+
+
+def write_venues(path, count, seed=0):
+    """Write a synthetic dataset to path"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(generate_venues(count, seed), f, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("count", type=int, help="number of venues to generate")
+    parser.add_argument("output", help="path of the JSON file to write")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_venues(args.output, args.count, args.seed)
+    print(f"Wrote {args.count} venues to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
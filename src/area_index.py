@@ -0,0 +1,314 @@
+import bisect
+import copy
+import re
+import unicodedata
+from array import array
+
+# Approximate neighbourhood outlines as (latitude, longitude) polygons, keyed by the
+# canonical English names used in the area keyboard
+NEIGHBORHOODS = {
+    "Dizengoff": [
+        (32.0735, 34.7700), (32.0990, 34.7762), (32.0990, 34.7800), (32.0735, 34.7738),
+    ],
+    "Florentin": [
+        (32.0540, 34.7635), (32.0605, 34.7635), (32.0605, 34.7745), (32.0540, 34.7745),
+    ],
+    "Rothschild": [
+        (32.0612, 34.7695), (32.0632, 34.7735), (32.0738, 34.7808), (32.0724, 34.7768),
+    ],
+    "Carmel Market": [
+        (32.0658, 34.7668), (32.0708, 34.7668), (32.0708, 34.7712), (32.0658, 34.7712),
+    ],
+}
+
+# Other spellings that refer to the same neighbourhood, in English and Hebrew
+AREA_ALIASES = {
+    "Dizengoff": ("dizengoff", "דיזנגוף"),
+    "Florentin": ("florentin", "florentine", "פלורנטין"),
+    "Rothschild": ("rothschild", "rothschild blvd", "שדרות רוטשילד", "רוטשילד"),
+    "Carmel Market": ("carmel market", "shuk hacarmel", "carmel", "שוק הכרמל", "הכרמל"),
+}
+
+# Hebrew names of the vibes offered in the vibe keyboard
+VIBE_ALIASES = {
+    "chill": ("רגוע",),
+    "trendy": ("טרנדי",),
+    "upscale": ("יוקרתי",),
+    "casual": ("יומיומי",),
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(text):
+    """Case-fold text and strip accents/niqqud so lookups are spelling-tolerant"""
+    text = str(text).casefold()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(_TOKEN_RE.findall(text.replace('_', ' ')))
+
+
+def area_key(area_name):
+    """Callback key of a canonical area name, e.g. Carmel Market -> carmel_market"""
+    return area_name.lower().replace(' ', '_')
+
+
+def tokenize(text):
+    """Split text into normalized word tokens"""
+    return normalize(text).split()
+
+
+def point_in_polygon(lat, lon, polygon):
+    """Ray-casting test for a point inside a (lat, lon) polygon"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lon_i > lon) != (lon_j > lon):
+            crossing = lat_i + (lon - lon_i) * (lat_j - lat_i) / (lon_j - lon_i)
+            if lat < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+def _bounding_box(polygon):
+    lats = [lat for lat, _ in polygon]
+    lons = [lon for _, lon in polygon]
+    return min(lats), max(lats), min(lons), max(lons)
+
+
+class _PostingIndex:
+    """Inverted index from normalized keys to sorted tuples of venue ids.
+
+    An index rebuilt by from_arrays() keeps its keys and ids in the given (possibly
+    mapped) arrays and only turns a key's ids into a tuple the first time it's read.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._compiled = None
+
+    def add(self, key, venue_id):
+        self._postings.setdefault(key, set()).add(venue_id)
+
+    def freeze(self):
+        self._postings = {key: tuple(sorted(ids)) for key, ids in self._postings.items()}
+
+    def get(self, key):
+        ids = self._postings.get(key)
+        if ids is None:
+            if self._compiled is None:
+                return ()
+            keys, offsets, all_ids = self._compiled
+            # Keys are stored sorted
+            pos = bisect.bisect_left(keys, key)
+            if pos == len(keys) or keys[pos] != key:
+                return ()
+            ids = self._postings[key] = tuple(all_ids[offsets[pos]:offsets[pos + 1]])
+        return ids
+
+    def updated(self, removals, additions):
+        """A copy with ids dropped from and added to some keys: {key: set of ids} each"""
+        index = _PostingIndex()
+        index._postings = dict(self._postings)
+        index._compiled = self._compiled
+        for key in removals.keys() | additions.keys():
+            ids = set(self.get(key))
+            ids.difference_update(removals.get(key, ()))
+            ids.update(additions.get(key, ()))
+            index._postings[key] = tuple(sorted(ids))
+        return index
+
+    def to_arrays(self, prefix):
+        """Flatten the frozen postings into sorted keys, offsets and ids"""
+        if self._compiled is not None:
+            keys, offsets, ids = self._compiled
+            return {f'{prefix}_keys': list(keys), f'{prefix}_offsets': array('q', offsets), f'{prefix}_ids': array('i', ids)}
+        keys = sorted(self._postings)
+        offsets = array('q', [0])
+        ids = array('i')
+        for key in keys:
+            ids.extend(self._postings[key])
+            offsets.append(len(ids))
+        return {f'{prefix}_keys': keys, f'{prefix}_offsets': offsets, f'{prefix}_ids': ids}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        index = cls()
+        index._compiled = (arrays[f'{prefix}_keys'], arrays[f'{prefix}_offsets'], arrays[f'{prefix}_ids'])
+        return index
+
+    def intersect(self, keys):
+        """Venue ids present under every key, in id order"""
+        if not keys:
+            return ()
+        if len(keys) == 1:
+            return self.get(keys[0])
+        postings = sorted((self.get(key) for key in keys), key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result.intersection_update(ids)
+        return tuple(sorted(result))
+
+
+class AreaIndex:
+    """Maps neighbourhood names (English or Hebrew) to the venues in them.
+
+    Venues are assigned to a neighbourhood when their coordinates fall inside its
+    polygon or their address/name mentions one of its aliases. Names that aren't
+    known neighbourhoods fall back to a word index over addresses and names.
+    """
+
+    def __init__(self, venues, neighborhoods=NEIGHBORHOODS, aliases=AREA_ALIASES):
+        self._setup(neighborhoods, aliases)
+        self._areas = _PostingIndex()
+        self._words = _PostingIndex()
+        for idx, venue in enumerate(venues):
+            self._add_venue(idx, venue)
+        self._areas.freeze()
+        self._words.freeze()
+
+    def _setup(self, neighborhoods, aliases):
+        self._polygons = {name: (polygon, _bounding_box(polygon)) for name, polygon in neighborhoods.items()}
+        self._alias_to_area = {normalize(name): name for name in neighborhoods}
+        # First token of each alias -> [(alias tokens, neighbourhood)]
+        self._alias_phrases = {}
+        for name, names in aliases.items():
+            for alias in names:
+                self._alias_to_area[normalize(alias)] = name
+                phrase = tokenize(alias)
+                self._alias_phrases.setdefault(phrase[0], []).append((phrase, name))
+
+    def to_arrays(self):
+        """Flatten the area and word postings into typed arrays (see from_arrays)"""
+        arrays = self._areas.to_arrays('areas')
+        arrays.update(self._words.to_arrays('words'))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, neighborhoods=NEIGHBORHOODS, aliases=AREA_ALIASES):
+        """Rebuild an index from to_arrays() output without rescanning the venues"""
+        index = cls.__new__(cls)
+        index._setup(neighborhoods, aliases)
+        index._areas = _PostingIndex.from_arrays(arrays, 'areas')
+        index._words = _PostingIndex.from_arrays(arrays, 'words')
+        return index
+
+    def areas_of(self, venue, tokens=None):
+        """Return the neighbourhood names a venue belongs to"""
+        found = set()
+        lat, lon = venue.get('latitude'), venue.get('longitude')
+        if lat and lon:
+            for name, (polygon, (min_lat, max_lat, min_lon, max_lon)) in self._polygons.items():
+                if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon and point_in_polygon(lat, lon, polygon):
+                    found.add(name)
+        if tokens is None:
+            tokens = tokenize(f"{venue.get('address', '')} {venue.get('name', '')}")
+        for pos, token in enumerate(tokens):
+            for phrase, name in self._alias_phrases.get(token, ()):
+                if tokens[pos:pos + len(phrase)] == phrase:
+                    found.add(name)
+        return found
+
+    def _add_venue(self, idx, venue):
+        tokens = tokenize(f"{venue.get('address', '')} {venue.get('name', '')}")
+        for name in self.areas_of(venue, tokens):
+            self._areas.add(name, idx)
+        for token in tokens:
+            self._words.add(token, idx)
+
+    def _keys_by_venue(self, venues):
+        """({area: ids}, {word: ids}) for a {venue_id: venue} mapping"""
+        areas = {}
+        words = {}
+        for idx, venue in venues.items():
+            tokens = tokenize(f"{venue.get('address', '')} {venue.get('name', '')}")
+            for name in self.areas_of(venue, tokens):
+                areas.setdefault(name, set()).add(idx)
+            for token in tokens:
+                words.setdefault(token, set()).add(idx)
+        return areas, words
+
+    def updated(self, removed, added):
+        """A copy without the `removed` and with the `added` venues, both {venue_id: venue}"""
+        index = copy.copy(self)
+        old_areas, old_words = self._keys_by_venue(removed)
+        new_areas, new_words = self._keys_by_venue(added)
+        index._areas = self._areas.updated(old_areas, new_areas)
+        index._words = self._words.updated(old_words, new_words)
+        return index
+
+    def lookup(self, area):
+        """Return the ids of venues in an area, in dataset order"""
+        key = normalize(area)
+        name = self._alias_to_area.get(key)
+        if name is not None:
+            return self._areas.get(name)
+        return self._words.intersect(key.split())
+
+
+class VibeIndex:
+    """Maps vibe tags in any language to the venues that have them"""
+
+    def __init__(self, venues, aliases=VIBE_ALIASES):
+        self._setup(aliases)
+        self._tags = _PostingIndex()
+        # Vibe texts repeat across venues, so canonicalize each distinct one once
+        tags_of = {}
+        for idx, venue in enumerate(venues):
+            for tag in self.tags_of(venue, tags_of):
+                self._tags.add(tag, idx)
+        self._tags.freeze()
+
+    def tags_of(self, venue, memo=None):
+        """Canonical vibe tags of a venue, in every language its vibe is given in"""
+        vibe = venue.get('vibe') or {}
+        texts = vibe.values() if hasattr(vibe, 'values') else [vibe]
+        found = []
+        for text in texts:
+            tags = memo.get(text) if memo is not None else None
+            if tags is None:
+                tags = [self._canonical.get(token, token) for token in tokenize(text)]
+                if memo is not None:
+                    memo[text] = tags
+            found.extend(tags)
+        return found
+
+    def updated(self, removed, added):
+        """A copy without the `removed` and with the `added` venues, both {venue_id: venue}"""
+        changes = []
+        for venues in (removed, added):
+            tags = {}
+            for idx, venue in venues.items():
+                for tag in self.tags_of(venue):
+                    tags.setdefault(tag, set()).add(idx)
+            changes.append(tags)
+        index = copy.copy(self)
+        index._tags = self._tags.updated(*changes)
+        return index
+
+    def _setup(self, aliases):
+        self._canonical = {}
+        for name, names in aliases.items():
+            for alias in (name,) + tuple(names):
+                self._canonical[normalize(alias)] = name
+
+    def to_arrays(self):
+        """Flatten the tag postings into typed arrays (see from_arrays)"""
+        return self._tags.to_arrays('tags')
+
+    @classmethod
+    def from_arrays(cls, arrays, aliases=VIBE_ALIASES):
+        """Rebuild an index from to_arrays() output without rescanning the venues"""
+        index = cls.__new__(cls)
+        index._setup(aliases)
+        index._tags = _PostingIndex.from_arrays(arrays, 'tags')
+        return index
+
+    def lookup(self, vibe):
+        """Return the ids of venues with a vibe, in dataset order"""
+        tokens = [self._canonical.get(token, token) for token in tokenize(vibe)]
+        return self._tags.intersect(tokens)
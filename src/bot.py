@@ -1,22 +1,70 @@
 import os
 import logging
 import asyncio
-from datetime import datetime
+import functools
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+from telegram import (
+    Bot,
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+)
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    ChosenInlineResultHandler,
     ContextTypes,
     ConversationHandler,
+    InlineQueryHandler,
     MessageHandler,
     filters,
 )
-import urllib.parse
-import json
-import math
 import os.path
+import secrets
+import signal
+import sys
+
+import httpx
+
+from area_index import area_key, normalize
+from city_shards import DEFAULT_CITY, CityManifest, ShardedVenueStore
+from compiled_venues import compile_venues
+from crawl_planner import CrawlPlanner, walk_minutes
+from ingress import HashRing, Ingress, UpdateReceiver
+from live_location import LiveLocationTracker, LiveSession
+from loop_guard import BlockingPool, LoopWatchdog, OffloadRejected, OffloadTimeout
+from metrics import (
+    REGISTRY,
+    RENDER_CACHE_ENTRIES,
+    RENDER_CACHE_HITS,
+    RENDER_CACHE_MISSES,
+    MetricsServer,
+    instrumented,
+    monitor_loop_lag,
+)
+from notifications import (
+    MAX_SUBSCRIPTIONS,
+    SUBSCRIBE_PREFIX,
+    UNSUBSCRIBE_PREFIX,
+    StartNotifier,
+    decode_subscription,
+    encode_subscription,
+)
+from pagination import CURSOR_PREFIX, PAGE_SIZE, clamp_offset, decode_cursor, encode_cursor, is_current
+from persistence import SQLitePersistence
+from popularity import CLICK_WEIGHT, VIEW_WEIGHT, PopularityTracker, venue_key
+from rate_limiter import OutboundRateLimiter
+from render_cache import RenderCache
+from schedule import TIMEZONE, format_minute, minute_of_week
+from spatial_index import calculate_distance
+from update_processor import ChatOrderedUpdateProcessor
 
 # Load environment variables
 load_dotenv()
@@ -26,7 +74,100 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Go up one level to the project root
 PROJECT_ROOT = os.path.dirname(BASE_DIR)
 # Define the path to the data file
-VENUES_FILE = os.path.join(PROJECT_ROOT, 'data', 'happyhourstlv_enriched.json')
+VENUES_FILE = os.getenv("VENUES_FILE", os.path.join(PROJECT_ROOT, 'data', 'happyhourstlv_enriched.json'))
+# Binary snapshot produced by `python src/compiled_venues.py`; mapped at startup
+# instead of parsing the JSON whenever it was compiled from the current file
+VENUES_COMPILED_FILE = os.getenv("VENUES_COMPILED_FILE", os.path.join(PROJECT_ROOT, 'data', 'happyhourstlv_enriched.venues'))
+# Manifest of per-city venue shards (see city_shards.py); without one the bot
+# serves VENUES_FILE alone as Tel Aviv
+VENUES_MANIFEST = os.getenv("VENUES_MANIFEST", os.path.join(PROJECT_ROOT, 'data', 'cities.json'))
+# Estimated memory (MiB) the loaded city shards may hold before cold ones are dropped
+VENUES_MEMORY_MB = float(os.getenv("VENUES_MEMORY_MB", "512"))
+# How often (in seconds) to check the data file for changes
+VENUES_CHECK_INTERVAL = float(os.getenv("VENUES_CHECK_INTERVAL", "5"))
+# Maximum number of rendered venue cards and result pages kept in memory
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "2048"))
+
+# Setting WEBHOOK_URL (the public base URL Telegram should post to) switches from
+# long polling to a local webhook server
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Maximum number of updates handled at once; updates from one chat stay in order
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# Setting WORKERS above 1 (webhook mode only) runs that many bot processes behind
+# an ingress that answers the webhook and routes each chat to the same worker by
+# consistent hashing (see ingress.py); worker i takes updates on
+# 127.0.0.1:WORKER_BASE_PORT+i, and INGRESS_QUEUE updates wait per worker at most
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8600"))
+INGRESS_QUEUE = int(os.getenv("INGRESS_QUEUE", "10000"))
+# Set by the ingress for each worker it starts
+WORKER_INDEX = os.getenv("WORKER_INDEX")
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_SECRET = os.getenv("WORKER_SECRET")
+
+# Bot API server to talk to, e.g. a self-hosted one or bench/fake_bot_api.py
+# for load tests; Telegram's when unset
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Open connections to the Bot API; each carries one request at a time
+BOT_API_CONNECTIONS = int(os.getenv("BOT_API_CONNECTIONS", "8"))
+
+# SQLite file for user settings and conversation state (empty to disable)
+PERSISTENCE_FILE = os.getenv("PERSISTENCE_FILE", os.path.join(PROJECT_ROOT, 'data', 'bot_state.sqlite3'))
+# Seconds between batched persistence writes
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "30"))
+
+# Venue popularity counts are kept in memory and written here every
+# POPULARITY_FLUSH_INTERVAL seconds (set POPULARITY_FILE to empty to disable);
+# counts halve every POPULARITY_HALF_LIFE hours. Other processes' files listed in
+# POPULARITY_PEERS (os.pathsep-separated) count towards the rankings too
+POPULARITY_FILE = os.getenv("POPULARITY_FILE", os.path.join(PROJECT_ROOT, 'data', 'popularity.json'))
+POPULARITY_PEERS = os.getenv("POPULARITY_PEERS", "")
+POPULARITY_FLUSH_INTERVAL = float(os.getenv("POPULARITY_FLUSH_INTERVAL", "60"))
+POPULARITY_HALF_LIFE = float(os.getenv("POPULARITY_HALF_LIFE", "72"))
+
+# Prometheus-text metrics are served on http://METRICS_HOST:METRICS_PORT/metrics
+# (set METRICS_PORT to empty to disable)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT", "9090")
+
+# Outgoing Bot API budgets: requests per second overall and per private chat, and
+# how often a request is retried after Telegram's flood control
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# How long Telegram may reuse an inline search answer for the same text (seconds)
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+
+# A shared live location refreshes its nearby venues after moving this far (km)
+# or entering another grid cell, at most once per interval (seconds)
+LIVE_LOCATION_MIN_MOVE = float(os.getenv("LIVE_LOCATION_MIN_MOVE", "0.05"))
+LIVE_LOCATION_INTERVAL = float(os.getenv("LIVE_LOCATION_INTERVAL", "10"))
+
+# Happy hour start notifications sent per second, leaving the rest of
+# OUTBOUND_GLOBAL_RATE for answering users
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", "20"))
+
+# Result lists and searches not yet cached are computed in a pool of
+# BLOCKING_WORKERS threads; at most BLOCKING_QUEUE run or wait at once and a
+# handler gives up after BLOCKING_TIMEOUT seconds
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "4"))
+BLOCKING_QUEUE = int(os.getenv("BLOCKING_QUEUE", "64"))
+BLOCKING_TIMEOUT = float(os.getenv("BLOCKING_TIMEOUT", "5"))
+# Happy hour crawls: stops per crawl, minutes spent at each, and how long (seconds)
+# the planner searches before settling for the best crawl found so far
+CRAWL_STOPS = int(os.getenv("CRAWL_STOPS", "3"))
+CRAWL_DWELL = int(os.getenv("CRAWL_DWELL", "45"))
+CRAWL_SEARCH_BUDGET = float(os.getenv("CRAWL_SEARCH_BUDGET", "0.25"))
+
+# Log the stack and handler blocking the event loop for longer than this many
+# seconds (set to empty to disable)
+LOOP_STALL_THRESHOLD = os.getenv("LOOP_STALL_THRESHOLD", "0.5")
 
 # Enable logging
 logging.basicConfig(
@@ -34,9 +175,150 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def load_city_manifest():
+    """The cities to serve: VENUES_MANIFEST if there is one, else VENUES_FILE as Tel Aviv"""
+    if VENUES_MANIFEST and os.path.exists(VENUES_MANIFEST):
+        return CityManifest.load(VENUES_MANIFEST)
+    return CityManifest.single(VENUES_FILE, VENUES_COMPILED_FILE)
+
+def forget_snapshot(version):
+    """Let go of everything cached for a snapshot that was reloaded or unloaded"""
+    render_cache.retire(version)
+    crawl_planner.forget(version)
+    venue_ids_by_key.cache_clear()
+
+def carry_snapshot(snapshot):
+    """Keep what was cached for a patched snapshot's previous version, except what its diff touches"""
+    base = snapshot.diff.base_version
+    render_cache.carry(base, snapshot.version, stale_renderings(snapshot, render_cache.entries(base)))
+    crawl_planner.carry(snapshot)
+    venue_ids_by_key.cache_clear()
+
+def stale_renderings(snapshot, entries):
+    """Keys of the cached (key, value) renderings that a patched snapshot's diff affects"""
+    diff = snapshot.diff
+    touched = diff.touched
+    points = diff.points()
+    # Searches only look at names and addresses
+    names_touched = diff.names_touched()
+    schedules_touched = diff.schedules_touched()
+    old_results = {key[1:]: value for key, value in entries if key[0] == 'results'}
+    stale_lists = {}
+    stale = set()
+    for key, _ in entries:
+        if key[0] == 'card':
+            affected = key[1] in touched
+        elif key[0] in ('results', 'page'):
+            # A page only shows cards of its list's venues
+            kind, params = key[1], key[2]
+            if (kind, params) not in stale_lists:
+                stale_lists[(kind, params)] = results_stale(
+                    snapshot, kind, params, old_results.get((kind, params)), touched, points
+                )
+            affected = stale_lists[(kind, params)]
+        elif key[0] == 'current':
+            affected = schedules_touched
+        elif key[0] == 'search':
+            affected = names_touched
+        else:
+            affected = True
+        if affected:
+            stale.add(key)
+    return stale
+
+def results_stale(snapshot, kind, params, old, touched, points):
+    """True if a cached result list may differ, or list a changed venue, under a patched snapshot"""
+    if old is None:
+        # Without the old list there's nothing to compare its pages with
+        return True
+    if kind == "near":
+        # Any touched venue within the radius, before or after the change, may reorder the list
+        lat, lon, radius = (float(value) for value in params)
+        return any(calculate_distance(lat, lon, point_lat, point_lon) <= radius for point_lat, point_lon in points)
+    # Area and vibe lists are plain index lookups, cheap to redo
+    return not touched.isdisjoint(old) or compute_results(snapshot, kind, params) != old
+
+city_manifest = load_city_manifest()
+# Per-city venue stores, each parsed on first use and hot-reloaded on change; the
+# default city feeds notifications, so it always stays loaded
+venue_shards = ShardedVenueStore(
+    city_manifest,
+    check_interval=VENUES_CHECK_INTERVAL,
+    max_bytes=int(VENUES_MEMORY_MB * 2 ** 20),
+    pinned=(city_manifest.default,),
+    on_unload=forget_snapshot,
+    on_patch=carry_snapshot
+)
+# Rendered cards/pages, keyed per dataset version, query and language
+render_cache = RenderCache(maxsize=RENDER_CACHE_SIZE)
+# Worker threads for the CPU-heavy steps of handlers
+blocking_pool = BlockingPool("blocking", workers=BLOCKING_WORKERS, max_pending=BLOCKING_QUEUE, timeout=BLOCKING_TIMEOUT)
+# Walking routes between venues in happy hour, over a per-version neighbour matrix
+crawl_planner = CrawlPlanner(stops=CRAWL_STOPS, dwell=CRAWL_DWELL, budget=CRAWL_SEARCH_BUDGET)
+# Recent views and clicks per venue, ranked per area and language
+popularity = PopularityTracker(
+    POPULARITY_FILE or None,
+    half_life=POPULARITY_HALF_LIFE * 3600,
+    peers=[path for path in POPULARITY_PEERS.split(os.pathsep) if path],
+)
+
+# Background services started with the Application (metrics server, monitors)
+metrics_server = MetricsServer(METRICS_HOST, int(METRICS_PORT)) if METRICS_PORT else None
+loop_watchdog = LoopWatchdog(float(LOOP_STALL_THRESHOLD)) if LOOP_STALL_THRESHOLD else None
+background_tasks = []
+
+def collect_render_cache_metrics():
+    """Publish render cache counters at scrape time"""
+    hits, misses, size = render_cache.stats
+    RENDER_CACHE_HITS.set_total(hits)
+    RENDER_CACHE_MISSES.set_total(misses)
+    RENDER_CACHE_ENTRIES.set(size)
+
+REGISTRY.add_collector(collect_render_cache_metrics)
+
 # States for conversation handler
 CHOOSING_LANGUAGE, CHOOSING_ACTION, CHOOSING_LOCATION, CHOOSING_VIBE, WAITING_FOR_LOCATION = range(5)
 
+# How far ahead (in minutes) the current happy hours page looks for upcoming starts
+STARTING_SOON_MINUTES = 30
+
+# Most venues a "near me" search keeps for paging
+MAX_NEARBY_RESULTS = 50
+
+# Venues listed on the popular places page
+POPULAR_COUNT = 5
+
+# Inline results sent per answer; more are fetched through next_offset as the user scrolls
+INLINE_PAGE_SIZE = 20
+# The empty query lists what's in happy hour now, which goes stale within minutes
+INLINE_NOW_CACHE_TIME = 60
+
+# Main menu buttons, used to label handle_action metrics without unbounded values
+ACTION_BRANCHES = {
+    "find_happy_hour", "find_nearby", "find_by_vibe", "radius", "refresh",
+    "current_happy_hours", "popular_places", "about", "main_menu", "change_lang",
+    "notifications", "plan_crawl", "change_city", "city",
+}
+
+# Crawl buttons carry their start point and delay: crawl|lat|lon|minutes from now
+CRAWL_PREFIX = "crawl"
+# Minutes each "later" tap pushes a crawl's start, and the furthest it can go
+CRAWL_DELAY_STEP = 60
+MAX_CRAWL_DELAY = 12 * 60
+
+def action_branch(update):
+    """Return the main menu branch a callback query selects"""
+    data = update.callback_query.data or ''
+    if data.startswith("radius_"):
+        branch = "radius"
+    elif data.startswith("popular_"):
+        branch = "popular_places"
+    elif data.startswith("city_"):
+        branch = "city"
+    else:
+        branch = data
+    return branch if branch in ACTION_BRANCHES else "other"
+
 # Translations dictionary
 TRANSLATIONS = {
     'en': {
@@ -56,17 +338,49 @@ TRANSLATIONS = {
         'current_happy_hours': "⏰ Current Happy Hours",
         'popular_places': "🌟 Popular Places",
         'about': "ℹ️ About",
-        'choose_area': "📍 Choose an area in Tel Aviv to explore happy hours:",
+        'choose_area': "📍 Choose an area in {} to explore happy hours:",
         'share_location': "📍 Share your location to find nearby venues",
+        'share_live_location': "Tap the button below to send your location, or share a live location from the 📎 menu and the list will follow you as you walk.",
         'no_current_hours': "😔 No happy hours currently running!\n\nWould you like to see all available happy hours instead?",
         'current_hours_header': "🎉 Current happy hours (at {})",
-        'popular_header': "🌟 Most Popular Happy Hours in Tel Aviv:",
+        'starting_soon_header': "⏳ Starting in the next {} minutes:",
+        'happy_hour_until': "🔥 Happy hour until {}",
+        'happy_hour_starts_in': "⏳ Starts in {} min",
+        'popular_header': "🌟 Most Popular Happy Hours in {}:",
+        'popular_area_header': "🌟 Most Popular in {}:",
+        'no_popular': "Nothing is trending yet. Explore a few venues and check back soon! 🍻",
         'area_header': "🎉 Happy Hours in {}:",
         'nearby_header': "📍 Venues near you:",
         'more_options': "\nWant to see more options? Use the buttons below!",
         'refresh': "🔄 Refresh",
         'new_search': "🔍 New Search",
         'main_menu': "🏠 Main Menu",
+        'next_page': "Next ▶",
+        'prev_page': "◀ Prev",
+        'page_position': "Showing {}–{} of {}",
+        'results_updated': "Venue data was updated, showing fresh results",
+        'notify_me': "🔔 Notify me",
+        'notifications': "🔔 Notifications",
+        'notifications_header': "🔔 I'll message you when a happy hour starts:",
+        'no_subscriptions': "You have no notifications yet. Tap 🔔 Notify me under any list of venues to add one.",
+        'subscribed': "🔔 I'll let you know when a happy hour starts {}",
+        'already_subscribed': "You already get these notifications",
+        'too_many_subscriptions': "You can keep up to {} notifications. Remove one in 🔔 Notifications first.",
+        'unsubscribed': "Notification removed",
+        'subscription_area': "in {}",
+        'subscription_vibe': "at {} venues",
+        'subscription_near': "within {}km of {}, {}",
+        'starting_now_header': "🔔 Happy hour starting now:",
+        'starting_now_more': "…and more. See ⏰ Current Happy Hours for all of them.",
+        'plan_crawl': "🍻 Plan a Crawl",
+        'crawl_share_location': "🍻 Share your location and I'll plan a walk between happy hours, starting from there.",
+        'crawl_header': "🍻 Your happy hour crawl from {}:",
+        'crawl_stop': "{}. *{}* {}–{}",
+        'crawl_leg': "🚶 {} min walk · 🔥 happy hour until {}",
+        'crawl_total': "🚶 {:.1f} km of walking in total",
+        'crawl_route': "🗺 [Walking route]({})",
+        'no_crawl': "😔 No happy hours within walking distance from {}. Try starting later or from another spot.",
+        'crawl_later': "⏩ An hour later",
         'about_text': (
             "🍻 *Happy Hour TLV Bot*\n\n"
             "Your ultimate guide to the best drink deals in Tel Aviv!\n\n"
@@ -82,6 +396,8 @@ TRANSLATIONS = {
         ),
         'welcome_back': "Welcome back! What would you like to do?",
         'change_language': "🌐 Change Language",
+        'change_city': "🏙 City: {}",
+        'choose_city': "🏙 Which city are you in?",
         'locations': {
             "Dizengoff": "Dizengoff",
             "Florentin": "Florentin",
@@ -121,17 +437,49 @@ TRANSLATIONS = {
         'current_happy_hours': "⏰ הפי אוור עכשיו",
         'popular_places': "🌟 מקומות פופולריים",
         'about': "ℹ️ אודות",
-        'choose_area': "📍 בחר אזור בתל אביב לחיפוש הפי אוור:",
+        'choose_area': "📍 בחר אזור ב{} לחיפוש הפי אוור:",
         'share_location': "📍 שתף את המיקום שלך למציאת מקומות קרובים",
+        'share_live_location': "לחץ על הכפתור למטה לשליחת המיקום, או שתף מיקום חי מתפריט 📎 והרשימה תתעדכן בזמן שאתה הולך.",
         'no_current_hours': "😔 אין הפי אוור פעיל כרגע!\n\nהאם תרצה לראות את כל ההפי אוורס הזמינים?",
         'current_hours_header': "🎉 הפי אוור פעיל כרגע ({})",
-        'popular_header': "🌟 ההפי אוורס הפופולריים בתל אביב:",
+        'starting_soon_header': "⏳ מתחיל ב-{} הדקות הקרובות:",
+        'happy_hour_until': "🔥 הפי אוור עד {}",
+        'happy_hour_starts_in': "⏳ מתחיל בעוד {} דק'",
+        'popular_header': "🌟 ההפי אוורס הפופולריים ב{}:",
+        'popular_area_header': "🌟 הכי פופולרי ב{}:",
+        'no_popular': "עוד אין מקומות פופולריים. גלה כמה מקומות וחזור בקרוב! 🍻",
         'area_header': "🎉 הפי אוור ב{}:",
         'nearby_header': "📍 מקומות קרובים אליך:",
         'more_options': "\nרוצה לראות עוד אפשרויות? השתמש בכפתורים למטה!",
         'refresh': "🔄 רענן",
         'new_search': "🔍 חיפוש חדש",
         'main_menu': "🏠 תפריט ראשי",
+        'next_page': "הבא ◀",
+        'prev_page': "▶ הקודם",
+        'page_position': "מציג {}–{} מתוך {}",
+        'results_updated': "המידע עודכן, מוצגות תוצאות מעודכנות",
+        'notify_me': "🔔 עדכן אותי",
+        'notifications': "🔔 התראות",
+        'notifications_header': "🔔 אשלח לך הודעה כשמתחיל הפי אוור:",
+        'no_subscriptions': "אין לך התראות עדיין. לחץ על 🔔 עדכן אותי מתחת לכל רשימת מקומות כדי להוסיף.",
+        'subscribed': "🔔 אעדכן אותך כשמתחיל הפי אוור {}",
+        'already_subscribed': "אתה כבר מקבל את ההתראות האלה",
+        'too_many_subscriptions': "אפשר לשמור עד {} התראות. הסר אחת ב-🔔 התראות קודם.",
+        'unsubscribed': "ההתראה הוסרה",
+        'subscription_area': "ב{}",
+        'subscription_vibe': "במקומות עם אווירה {}",
+        'subscription_near': "עד {} ק\"מ מ-{}, {}",
+        'starting_now_header': "🔔 הפי אוור מתחיל עכשיו:",
+        'starting_now_more': "…ועוד. כל המקומות ב-⏰ הפי אוור עכשיו.",
+        'plan_crawl': "🍻 תכנון סיבוב ברים",
+        'crawl_share_location': "🍻 שתף את המיקום שלך ואתכנן מסלול הליכה בין הפי אוורס שמתחיל משם.",
+        'crawl_header': "🍻 סיבוב ההפי אוור שלך מ-{}:",
+        'crawl_stop': "{}. *{}* {}–{}",
+        'crawl_leg': "🚶 {} דק' הליכה · 🔥 הפי אוור עד {}",
+        'crawl_total': "🚶 {:.1f} ק\"מ הליכה בסך הכל",
+        'crawl_route': "🗺 [מסלול הליכה]({})",
+        'no_crawl': "😔 אין הפי אוורס במרחק הליכה החל מ-{}. נסה להתחיל מאוחר יותר או ממקום אחר.",
+        'crawl_later': "⏩ שעה אחר כך",
         'about_text': (
             "🍻 *Happy Hour TLV Bot*\n\n"
             "המדריך האולטימטיבי למבצעי שתייה בתל אביב!\n\n"
@@ -147,6 +495,8 @@ TRANSLATIONS = {
         ),
         'welcome_back': "ברוך שובך! מה תרצה לעשות?",
         'change_language': "🌐 שנה שפה",
+        'change_city': "🏙 עיר: {}",
+        'choose_city': "🏙 באיזו עיר אתה?",
         'locations': {
             "Dizengoff": "דיזנגוף",
             "Florentin": "פלורנטין",
@@ -171,38 +521,41 @@ TRANSLATIONS = {
     }
 }
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate the distance between two points in kilometers"""
-    R = 6371  # Earth's radius in kilometers
-    
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    return R * c
-
 def get_google_maps_link(coords):
     """Generate Google Maps link for navigation"""
     return f"https://www.google.com/maps/dir/?api=1&destination={coords}"
 
+def get_google_maps_route_link(origin, stops):
+    """Generate a Google Maps walking route from origin through a list of stops"""
+    link = f"https://www.google.com/maps/dir/?api=1&origin={origin}&destination={stops[-1]}&travelmode=walking"
+    if len(stops) > 1:
+        link += "&waypoints=" + "%7C".join(stops[:-1])
+    return link
+
 def get_text(key, lang, *args):
     """Get translated text"""
     return TRANSLATIONS[lang][key].format(*args) if args else TRANSLATIONS[lang][key]
 
+@functools.lru_cache(maxsize=None)
 def create_location_keyboard(lang):
-    """Create keyboard with location sharing button and options"""
-    keyboard = [
-        [KeyboardButton(get_text('share_location', lang), request_location=True)],
+    """Create keyboard with search radius options"""
+    return InlineKeyboardMarkup([
         [
             InlineKeyboardButton("📍 1km", callback_data="radius_1"),
             InlineKeyboardButton("📍 2km", callback_data="radius_2"),
             InlineKeyboardButton("📍 5km", callback_data="radius_5")
         ],
         [InlineKeyboardButton(get_text('main_menu', lang), callback_data='main_menu')]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    ])
+
+@functools.lru_cache(maxsize=None)
+def create_share_location_keyboard(lang):
+    """Create reply keyboard with a location sharing button"""
+    return ReplyKeyboardMarkup(
+        [[KeyboardButton(get_text('share_location', lang), request_location=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
 
 def format_place_details(place, area, lang):
     """Format place details with navigation link"""
@@ -218,84 +571,309 @@ def format_place_details(place, area, lang):
     coords = f"{latitude},{longitude}" if latitude and longitude else ''
     maps_link = get_google_maps_link(coords) if coords else None
     
-    details = f"*{name}*\n"
-    details += f"📍 {address}\n"
+    lines = [f"*{name}*", f"📍 {address}"]
     if hours:
-        details += f"⏰ Hours: {hours}\n"
+        lines.append(f"⏰ Hours: {hours}")
     if deal:
-        details += f"🎉 Deal: {deal}\n"
+        lines.append(f"🎉 Deal: {deal}")
     if phone:
-        details += f"📞 Phone: {phone}\n"
+        lines.append(f"📞 Phone: {phone}")
     if website:
-        details += f"🌐 Website: {website}\n"
+        lines.append(f"🌐 Website: {website}")
+    
+    details = "".join(f"{line}\n" for line in lines)
     if maps_link:
         details += f"\n🗺 [Open in Maps]({maps_link})"
     
     return details
 
-async def load_venues():
-    """Load venues from JSON file with error handling"""
+def render_venue_card(snapshot, idx, lang):
+    """Return the formatted details of a snapshot venue, rendered once per language"""
+    return render_cache.get_or_render(
+        snapshot.version,
+        ('card', idx, lang),
+        lambda: format_place_details(snapshot.venues[idx], None, lang)
+    )
+
+async def get_venue_snapshot(city):
+    """Return the current venue snapshot of a city, loading its shard on first use"""
+    snapshot = await venue_shards.get(city)
+    if snapshot is None:
+        logger.error(f"No venues available for: {city}")
+    return snapshot
+
+def user_city(context):
+    """The city a user is browsing: the one they picked or were last located in"""
+    city = context.user_data.get('city') if context.user_data is not None else None
+    return city if city in city_manifest else city_manifest.default
+
+def city_at(lat, lon, fallback):
+    """The city a location belongs to, or `fallback` if it's far from every city"""
+    return city_manifest.locate(lat, lon) or fallback
+
+def city_label(city, lang):
+    """Display name of a city"""
+    return city_manifest[city].name(lang)
+
+def area_label(city, name, lang):
+    """Display name of one of a city's areas"""
+    return city_manifest[city].area_label(name, lang) or TRANSLATIONS[lang]['locations'].get(name, name)
+
+def popularity_city(city):
+    """City part of popularity scopes; Tel Aviv keeps the unprefixed scopes it always had"""
+    return None if city in (None, DEFAULT_CITY) else city
+
+def area_name(area_key, city=None):
+    """Display name of an area from its callback key, e.g. carmel_market -> Carmel Market"""
+    name = city_manifest[city].area_by_key(area_key) if city in city_manifest else None
+    return name or area_key.replace('_', ' ').title()
+
+def nearby_params(lat, lon, radius):
+    """Cursor parameters of a nearby search; coordinates are rounded to ~10m to fit in buttons"""
+    return (f"{lat:.4f}", f"{lon:.4f}", str(radius))
+
+def compute_results(snapshot, kind, params):
+    """Ordered results of a paged query: venue ids, or (distance, id) pairs for nearby"""
+    if kind == "area":
+        # Neighbourhood membership is precomputed from coordinates and addresses
+        return tuple(snapshot.areas.lookup(area_name(params[0], snapshot.city)))
+    if kind == "vibe":
+        # Vibe tags in either language are resolved through the vibe index
+        return tuple(snapshot.vibes.lookup(params[0]))
+    lat, lon, radius = (float(value) for value in params)
+    # Closest venues within the search radius, straight from the spatial index
+    return tuple(snapshot.spatial.nearest(lat, lon, MAX_NEARBY_RESULTS, max_km=radius))
+
+def get_results(snapshot, kind, params):
+    """Ordered results of a paged query, computed once per dataset version"""
+    return render_cache.get_or_render(
+        snapshot.version,
+        ('results', kind, params),
+        lambda: compute_results(snapshot, kind, params)
+    )
+
+async def load_results(snapshot, kind, params):
+    """Ordered results of a paged query, computed in the blocking pool unless cached"""
+    key = ('results', kind, params)
+    results = render_cache.get(snapshot.version, key)
+    if results is None:
+        results = await blocking_pool.run(compute_results, snapshot, kind, params)
+        render_cache.put(snapshot.version, key, results)
+    return results
+
+def render_results_page(snapshot, kind, params, results, offset, active_flags, lang):
+    """Render one page of an ordered result list"""
+    page = results[offset:offset + PAGE_SIZE]
+    if kind == "area":
+        parts = [get_text('area_header', lang, area_name(params[0], snapshot.city)) + "\n\n"]
+    elif kind == "vibe":
+        parts = [f"🌟 Venues with {params[0].title()} vibe:\n\n"]
+    else:
+        parts = [get_text('nearby_header', lang) + "\n\n"]
+    
+    for pos, entry in enumerate(page):
+        if kind == "near":
+            distance, idx = entry
+            parts.append(render_venue_card(snapshot, idx, lang))
+            parts.append(f"\n📍 {distance:.1f}km away")
+        else:
+            parts.append(render_venue_card(snapshot, entry, lang))
+            if active_flags and active_flags[pos]:
+                parts.append(f"\n{get_text('current_happy_hour', lang)}")
+        parts.append("\n\n")
+    
+    if len(results) > PAGE_SIZE:
+        parts.append(get_text('page_position', lang, offset + 1, offset + len(page), len(results)))
+    return "".join(parts)
+
+@functools.lru_cache(maxsize=1024)
+def create_results_keyboard(kind, params, version, offset, total, lang, notify=True):
+    """Create Prev/Next/Refresh buttons whose cursors describe the page to show."""
+    keyboard = []
+    nav = []
+    if offset > 0:
+        nav.append(InlineKeyboardButton(
+            get_text('prev_page', lang),
+            callback_data=encode_cursor(kind, params, version, offset - PAGE_SIZE)
+        ))
+    if offset + PAGE_SIZE < total:
+        nav.append(InlineKeyboardButton(
+            get_text('next_page', lang),
+            callback_data=encode_cursor(kind, params, version, offset + PAGE_SIZE)
+        ))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton(get_text('refresh', lang), callback_data=encode_cursor(kind, params, version, offset)),
+        InlineKeyboardButton(get_text('find_happy_hour', lang), callback_data="find_happy_hour"),
+    ])
+    if notify:
+        keyboard.append([
+            InlineKeyboardButton(get_text('notify_me', lang), callback_data=encode_subscription(SUBSCRIBE_PREFIX, kind, params)),
+            InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu"),
+        ])
+    else:
+        keyboard.append([InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def render_results(snapshot, kind, params, offset, lang):
+    """Return (text, keyboard) for a page of a result list, or ('', None) if it's empty"""
+    results = await load_results(snapshot, kind, params)
+    if not results:
+        return '', None
+    offset = clamp_offset(offset, len(results))
+    
+    active_flags = ()
+    if kind == "vibe":
+        # Happy hour status comes from the compiled schedule index
+        active = snapshot.schedule.active_at()
+        active_flags = tuple(idx in active for idx in results[offset:offset + PAGE_SIZE])
+    
+    message = render_cache.get_or_render(
+        snapshot.version,
+        ('page', kind, params, offset, lang, active_flags),
+        lambda: render_results_page(snapshot, kind, params, results, offset, active_flags, lang)
+    )
+    # Notifications only follow the default city's venues
+    notify = snapshot.city in (None, city_manifest.default)
+    keyboard = create_results_keyboard(kind, params, snapshot.version, offset, len(results), lang, notify)
+    return message, keyboard
+
+def empty_results_text(kind, params, lang, city):
+    """Message for a result list with nothing in it"""
+    if kind == "area":
+        return f"No venues found in {area_name(params[0], city)}"
+    if kind == "vibe":
+        return f"No venues found with {params[0].title()} vibe"
+    return get_text('no_nearby_venues', lang)
+
+@functools.lru_cache(maxsize=1024)
+def mask_scopes(city, area_names, mask, lang):
+    """Popularity scopes for the areas set in an area bitmask, plus the whole city"""
+    city = popularity_city(city)
+    scopes = [popularity.scope(None, lang, city)]
+    scopes.extend(
+        popularity.scope(area_key(name), lang, city)
+        for bit, name in enumerate(area_names)
+        if mask >> bit & 1
+    )
+    return tuple(scopes)
+
+def venue_scopes(snapshot, idx, lang):
+    """Popularity rankings a venue counts in: the whole city and each of its areas"""
+    columns = snapshot.columns
+    return mask_scopes(snapshot.city, columns.area_names, columns.area_mask[idx], lang)
+
+def record_views(snapshot, venue_ids, lang, weight=VIEW_WEIGHT):
+    """Count venues the user was shown (or picked, with a higher weight)"""
+    for idx in venue_ids:
+        popularity.record(venue_key(snapshot.venues[idx]), venue_scopes(snapshot, idx, lang), weight)
+
+def record_page_views(snapshot, kind, params, offset, lang):
+    """Count the venues on a result page the user just opened"""
+    results = get_results(snapshot, kind, params)
+    offset = clamp_offset(offset, len(results))
+    page = results[offset:offset + PAGE_SIZE]
+    record_views(snapshot, [idx for _, idx in page] if kind == "near" else page, lang)
+
+def page_branch(update):
+    """Return the kind of result list a page cursor belongs to"""
     try:
-        logger.info(f"Attempting to load venues from: {VENUES_FILE}")
-        with open(VENUES_FILE, 'r', encoding='utf-8') as f:
-            venues = json.load(f)
-            logger.info(f"Successfully loaded {len(venues)} venues")
-            return venues
-    except FileNotFoundError:
-        logger.error(f"Venues file not found at: {VENUES_FILE}")
-        return None
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON: {str(e)}")
-        return None
+        return decode_cursor(update.callback_query.data or '')[0]
+    except ValueError:
+        return "other"
+
+@instrumented('show_page', branch=page_branch)
+async def show_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show another page of a result list, rebuilt from the cursor in the button."""
+    query = update.callback_query
+    lang = context.user_data.get('lang', 'en')
+    
+    try:
+        kind, params, version, offset = decode_cursor(query.data)
+        if kind == "near":
+            city = city_at(float(params[0]), float(params[1]), user_city(context))
+        else:
+            # The shard the buttons came from, if it's still loaded and unchanged
+            city = venue_shards.find(version) or user_city(context)
+        snapshot = await get_venue_snapshot(city)
+        if not snapshot:
+            raise RuntimeError("venue data unavailable")
+        
+        if is_current(version, snapshot.version):
+            await query.answer()
+        else:
+            # The data was reloaded since these buttons were sent: page through the new list
+            await query.answer(get_text('results_updated', lang))
+        
+        message, keyboard = await render_results(snapshot, kind, params, offset, lang)
+        if not message:
+            await query.edit_message_text(
+                text=empty_results_text(kind, params, lang, snapshot.city),
+                reply_markup=create_refresh_keyboard(lang)
+            )
+            return CHOOSING_ACTION
+        
+        await query.edit_message_text(
+            text=message,
+            reply_markup=keyboard,
+            parse_mode='Markdown'
+        )
+        record_page_views(snapshot, kind, params, offset, lang)
+        
     except Exception as e:
-        logger.error(f"Unexpected error loading venues: {str(e)}")
-        return None
+        logger.error(f"Error showing results page: {str(e)}")
+        await query.edit_message_text(
+            text=get_text('error_loading_venues', lang),
+            reply_markup=create_main_menu_keyboard(lang)
+        )
+    
+    return CHOOSING_ACTION
 
+@instrumented('handle_location')
 async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle received location and find nearby venues"""
+    if context.user_data.pop('location_purpose', None) == "crawl":
+        return await start_crawl(update, context)
     try:
         user_location = update.message.location
         lang = context.user_data.get('lang', 'en')
         radius = context.user_data.get('search_radius', 2)  # Default 2km radius
         
-        venues = await load_venues()
-        if not venues:
+        # Searching from a location switches the user to the city it's in
+        city = city_at(user_location.latitude, user_location.longitude, user_city(context))
+        context.user_data['city'] = city
+        snapshot = await get_venue_snapshot(city)
+        if not snapshot:
             await update.message.reply_text(get_text('error_loading_venues', lang))
             return CHOOSING_ACTION
         
-        # Calculate distances and sort venues
-        nearby_venues = []
-        for venue in venues:
-            if venue.get('latitude') and venue.get('longitude'):
-                distance = calculate_distance(
-                    user_location.latitude,
-                    user_location.longitude,
-                    venue['latitude'],
-                    venue['longitude']
-                )
-                if distance <= radius:  # Within specified radius
-                    venue['distance'] = distance
-                    nearby_venues.append(venue)
-        
-        # Sort by distance
-        nearby_venues.sort(key=lambda x: x['distance'])
-        
-        if not nearby_venues:
-            await update.message.reply_text(get_text('no_nearby_venues', lang))
-            return CHOOSING_ACTION
+        params = nearby_params(user_location.latitude, user_location.longitude, radius)
+        message, keyboard = await render_results(snapshot, "near", params, 0, lang)
         
-        # Format and send nearby venues
-        message = get_text('nearby_header', lang) + "\n\n"
-        for venue in nearby_venues[:5]:  # Show top 5 closest venues
-            message += format_place_details(venue, None, lang)
-            message += f"\n📍 {venue['distance']:.1f}km away\n\n"
+        if not message:
+            reply = await update.message.reply_text(get_text('no_nearby_venues', lang))
+        else:
+            reply = await update.message.reply_text(
+                message,
+                reply_markup=keyboard,
+                parse_mode='Markdown'
+            )
+            record_page_views(snapshot, "near", params, 0, lang)
         
-        keyboard = create_refresh_keyboard(lang)
-        await update.message.reply_text(
-            message,
-            reply_markup=keyboard,
-            parse_mode='Markdown'
-        )
+        if user_location.live_period:
+            # Telegram keeps editing this location message as the user moves;
+            # handle_live_location follows the edits and updates our reply
+            live_tracker.start(
+                (update.message.chat_id, update.message.message_id),
+                LiveSession(
+                    context.bot, reply.chat_id, reply.message_id, radius, lang,
+                    LiveLocationTracker.expiry(update.message.date.timestamp(), user_location.live_period),
+                    user_location.latitude, user_location.longitude,
+                    snapshot.spatial.cell_of(user_location.latitude, user_location.longitude),
+                    snapshot.version
+                )
+            )
         
         return CHOOSING_ACTION
         
@@ -304,19 +882,61 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(get_text('error_processing_location', lang))
         return CHOOSING_ACTION
 
-def create_location_keyboard(lang):
-    """Create keyboard with all locations in the selected language."""
-    keyboard = []
-    row = []
-    for idx, location in enumerate(SAMPLE_HAPPY_HOURS.keys()):
-        translated_location = TRANSLATIONS[lang]['locations'][location]
-        row.append(InlineKeyboardButton(translated_location, callback_data=f"loc_{location.lower()}"))
-        if (idx + 1) % 2 == 0 or idx == len(SAMPLE_HAPPY_HOURS.keys()) - 1:
-            keyboard.append(row)
-            row = []
-    keyboard.append([InlineKeyboardButton(get_text('main_menu', lang), callback_data="start")])
-    return keyboard
+async def refresh_live_location(session):
+    """Recompute a live location's nearby venues and edit its message in place"""
+    snapshot = await get_venue_snapshot(city_at(session.lat, session.lon, city_manifest.default))
+    if not snapshot:
+        return
+    params = nearby_params(session.lat, session.lon, session.radius)
+    message, keyboard = await render_results(snapshot, "near", params, 0, session.lang)
+    if not message:
+        await session.bot.edit_message_text(
+            chat_id=session.chat_id,
+            message_id=session.message_id,
+            text=get_text('no_nearby_venues', session.lang)
+        )
+        return
+    # The rate limiter skips this call when the venues and distances didn't change
+    await session.bot.edit_message_text(
+        chat_id=session.chat_id,
+        message_id=session.message_id,
+        text=message,
+        reply_markup=keyboard,
+        parse_mode='Markdown'
+    )
+
+# Live locations being followed, keyed by (chat id, location message id)
+live_tracker = LiveLocationTracker(
+    refresh_live_location,
+    min_move_km=LIVE_LOCATION_MIN_MOVE,
+    min_interval=LIVE_LOCATION_INTERVAL
+)
 
+@instrumented('handle_live_location')
+async def handle_live_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Follow a moving live location and keep its nearby venues message current"""
+    message = update.edited_message
+    location = message.location
+    key = (message.chat_id, message.message_id)
+    
+    if not location.live_period:
+        # The user stopped sharing; this edit only carries the final position
+        live_tracker.stop(key)
+        return
+    
+    snapshot = await get_venue_snapshot(city_at(location.latitude, location.longitude, user_city(context)))
+    if not snapshot:
+        return
+    # Cheap check against the last refreshed position; the search itself is debounced
+    live_tracker.move(
+        key,
+        location.latitude,
+        location.longitude,
+        snapshot.spatial.cell_of(location.latitude, location.longitude),
+        snapshot.version
+    )
+
+@instrumented('start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the conversation and ask user to choose a language."""
     keyboard = [
@@ -329,6 +949,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Choose your language / בחר את השפה שלך", reply_markup=reply_markup)
     return CHOOSING_LANGUAGE
 
+@functools.lru_cache(maxsize=None)
 def create_main_menu_keyboard(lang):
     """Create the main menu keyboard with translated buttons."""
     return InlineKeyboardMarkup([
@@ -340,13 +961,45 @@ def create_main_menu_keyboard(lang):
             InlineKeyboardButton(get_text('current_happy_hours', lang), callback_data="current_happy_hours"),
             InlineKeyboardButton(get_text('popular_places', lang), callback_data="popular_places"),
         ],
+        [InlineKeyboardButton(get_text('plan_crawl', lang), callback_data="plan_crawl")],
         [
             InlineKeyboardButton("🌟 Find by Vibe", callback_data="find_by_vibe"),
             InlineKeyboardButton(get_text('about', lang), callback_data="about"),
         ],
-        [InlineKeyboardButton(get_text('change_language', lang), callback_data="change_lang")]
+        [
+            InlineKeyboardButton(get_text('notifications', lang), callback_data="notifications"),
+            InlineKeyboardButton(get_text('change_language', lang), callback_data="change_lang"),
+        ]
     ])
 
+def main_menu_keyboard(context, lang):
+    """The main menu, with a city switch when more than one city is served"""
+    if len(city_manifest) < 2:
+        return create_main_menu_keyboard(lang)
+    return create_city_menu_keyboard(user_city(context), lang)
+
+@functools.lru_cache(maxsize=None)
+def create_city_menu_keyboard(city, lang):
+    """Create the main menu keyboard with a button naming the current city."""
+    rows = list(create_main_menu_keyboard(lang).inline_keyboard)
+    rows.append([InlineKeyboardButton(get_text('change_city', lang, city_label(city, lang)), callback_data="change_city")])
+    return InlineKeyboardMarkup(rows)
+
+@functools.lru_cache(maxsize=None)
+def create_city_keyboard(lang):
+    """Create keyboard with a button per served city."""
+    keyboard = []
+    row = []
+    cities = list(city_manifest)
+    for idx, city in enumerate(cities):
+        row.append(InlineKeyboardButton(city.name(lang), callback_data=f"city_{city.id}"))
+        if (idx + 1) % 2 == 0 or idx == len(cities) - 1:
+            keyboard.append(row)
+            row = []
+    keyboard.append([InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu")])
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.lru_cache(maxsize=None)
 def create_refresh_keyboard(lang):
     """Create keyboard with refresh and new search options."""
     return InlineKeyboardMarkup([
@@ -357,6 +1010,7 @@ def create_refresh_keyboard(lang):
         [InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu")]
     ])
 
+@instrumented('choose_language')
 async def choose_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle language selection and show main menu."""
     query = update.callback_query
@@ -365,10 +1019,11 @@ async def choose_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = query.data.split("_")[1]
     context.user_data["lang"] = lang
     
-    keyboard = create_main_menu_keyboard(lang)
+    keyboard = main_menu_keyboard(context, lang)
     await query.edit_message_text(text=get_text("welcome", lang), reply_markup=keyboard)
     return CHOOSING_ACTION
 
+@instrumented('handle_action', branch=action_branch)
 async def handle_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle main menu actions."""
     query = update.callback_query
@@ -377,18 +1032,37 @@ async def handle_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = context.user_data.get("lang", "en")
     
     if query.data == "find_happy_hour":
-        keyboard = create_area_keyboard(lang)
+        city = user_city(context)
+        keyboard = create_area_keyboard(city, lang)
         await query.edit_message_text(
-            text=get_text("choose_area", lang),
+            text=get_text("choose_area", lang, city_label(city, lang)),
             reply_markup=keyboard
         )
         return CHOOSING_LOCATION
     elif query.data == "find_nearby":
+        context.user_data.pop("location_purpose", None)
         keyboard = create_location_keyboard(lang)
         await query.edit_message_text(
             text=get_text("share_location", lang),
             reply_markup=keyboard
         )
+        # Location buttons only exist on reply keyboards, which need a message of their own
+        await query.message.reply_text(
+            get_text("share_live_location", lang),
+            reply_markup=create_share_location_keyboard(lang)
+        )
+        return WAITING_FOR_LOCATION
+    elif query.data == "plan_crawl":
+        # The next location the user sends is where the crawl starts
+        context.user_data["location_purpose"] = "crawl"
+        await query.edit_message_text(
+            text=get_text("crawl_share_location", lang),
+            reply_markup=create_back_keyboard(lang)
+        )
+        await query.message.reply_text(
+            get_text("share_location", lang),
+            reply_markup=create_share_location_keyboard(lang)
+        )
         return WAITING_FOR_LOCATION
     elif query.data == "find_by_vibe":
         keyboard = create_vibe_keyboard(lang)
@@ -407,93 +1081,107 @@ async def handle_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return WAITING_FOR_LOCATION
     elif query.data == "refresh":
-        # Re-run the last action based on the current state
+        # Result lists refresh through their page cursors; this button is on the
+        # current happy hours page, or on a message sent before cursors existed
         state = context.user_data.get("last_state")
         if state == "area":
             area = context.user_data.get("last_area")
             if area:
-                query.data = f"area_{area.lower()}"
+                query.data = f"area_{area.lower().replace(' ', '_')}"
                 return await show_area_venues(update, context)
-        return await handle_action(update, context)
+        elif state == "current":
+            return await show_current_happy_hours(update, context)
+        keyboard = main_menu_keyboard(context, lang)
+        await query.edit_message_text(
+            text=get_text("welcome_back", lang),
+            reply_markup=keyboard
+        )
+        return CHOOSING_ACTION
     elif query.data == "current_happy_hours":
         return await show_current_happy_hours(update, context)
-    elif query.data == "popular_places":
+    elif query.data.startswith("popular_"):
         return await show_popular_places(update, context)
+    elif query.data == "notifications":
+        text, keyboard = render_subscriptions(context.user_data, lang)
+        await query.edit_message_text(text=text, reply_markup=keyboard)
+        return CHOOSING_ACTION
     elif query.data == "about":
-        keyboard = create_main_menu_keyboard(lang)
+        keyboard = main_menu_keyboard(context, lang)
         await query.edit_message_text(
             text=get_text("about_text", lang),
             reply_markup=keyboard
         )
         return CHOOSING_ACTION
+    elif query.data == "change_city":
+        await query.edit_message_text(
+            text=get_text("choose_city", lang),
+            reply_markup=create_city_keyboard(lang)
+        )
+        return CHOOSING_ACTION
+    elif query.data.startswith("city_"):
+        city = query.data[len("city_"):]
+        if city in city_manifest:
+            context.user_data["city"] = city
+        await query.edit_message_text(
+            text=get_text("welcome_back", lang),
+            reply_markup=main_menu_keyboard(context, lang)
+        )
+        return CHOOSING_ACTION
     elif query.data == "main_menu":
-        keyboard = create_main_menu_keyboard(lang)
+        keyboard = main_menu_keyboard(context, lang)
         await query.edit_message_text(
             text=get_text("welcome_back", lang),
             reply_markup=keyboard
         )
         return CHOOSING_ACTION
 
+@instrumented('show_area_venues')
 async def show_area_venues(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show venues in the selected area."""
     query = update.callback_query
     await query.answer()
     
     lang = context.user_data.get('lang', 'en')
-    area = query.data.replace('area_', '').replace('_', ' ').title()
+    area_key = query.data.replace('area_', '')
     
-    # Store the last state and area for refresh functionality
-    context.user_data["last_state"] = "area"
-    context.user_data["last_area"] = area
-    
-    venues = await load_venues()
-    if not venues:
+    snapshot = await get_venue_snapshot(user_city(context))
+    if not snapshot:
         await query.edit_message_text(
             text=get_text('error_loading_venues', lang),
             reply_markup=create_main_menu_keyboard(lang)
         )
         return CHOOSING_ACTION
     
-    # Filter venues by area (more flexible matching)
-    area_venues = [
-        venue for venue in venues 
-        if area.lower() in venue.get('address', '').lower() or 
-           area.lower() in venue.get('name', '').lower()
-    ]
+    # First page; Prev/Next/Refresh carry cursors back to show_page
+    message, keyboard = await render_results(snapshot, "area", (area_key,), 0, lang)
     
-    if not area_venues:
+    if not message:
         await query.edit_message_text(
-            text=f"No venues found in {area}",
+            text=empty_results_text("area", (area_key,), lang, snapshot.city),
             reply_markup=create_refresh_keyboard(lang)
         )
         return CHOOSING_ACTION
     
-    # Format message with venues
-    message = get_text('area_header', lang, area) + "\n\n"
-    for venue in area_venues[:5]:  # Show top 5 venues
-        message += format_place_details(venue, area, lang)
-        message += "\n\n"
-    
-    keyboard = create_refresh_keyboard(lang)
     await query.edit_message_text(
         text=message,
         reply_markup=keyboard,
         parse_mode='Markdown'
     )
+    record_page_views(snapshot, "area", (area_key,), 0, lang)
     
     return CHOOSING_ACTION
 
-def create_area_keyboard(lang):
-    """Create keyboard with area selection buttons."""
-    areas = ["Dizengoff", "Florentin", "Rothschild", "Carmel_Market"]
+@functools.lru_cache(maxsize=None)
+def create_area_keyboard(city, lang):
+    """Create keyboard with a city's area selection buttons."""
+    areas = list(city_manifest[city].neighborhoods)
     keyboard = []
     row = []
     
     for idx, area in enumerate(areas):
-        translated_area = TRANSLATIONS[lang]['locations'][area.replace('_', ' ')]
         row.append(InlineKeyboardButton(
-            translated_area,
-            callback_data=f"area_{area.lower()}"
+            area_label(city, area, lang),
+            callback_data=f"area_{area_key(area)}"
         ))
         if (idx + 1) % 2 == 0 or idx == len(areas) - 1:
             keyboard.append(row)
@@ -502,48 +1190,35 @@ def create_area_keyboard(lang):
     keyboard.append([InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu")])
     return InlineKeyboardMarkup(keyboard)
 
+@instrumented('show_vibe_venues')
 async def show_vibe_venues(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show venues with the selected vibe."""
     query = update.callback_query
     await query.answer()
     
     lang = context.user_data.get('lang', 'en')
-    vibe = query.data.replace('vibe_', '').replace('_', ' ').title()
+    vibe = query.data.replace('vibe_', '').replace('_', ' ').lower()
     
     try:
-        # Load venues from JSON file
-        with open('data/happyhourstlv_enriched.json', 'r', encoding='utf-8') as f:
-            venues = json.load(f)
+        snapshot = await get_venue_snapshot(user_city(context))
+        if not snapshot:
+            raise RuntimeError("venue data unavailable")
         
-        # Filter venues by vibe
-        vibe_venues = [venue for venue in venues if vibe.lower() in venue.get('vibe', {}).get(lang, '').lower()]
+        message, keyboard = await render_results(snapshot, "vibe", (vibe,), 0, lang)
         
-        if not vibe_venues:
+        if not message:
             await query.edit_message_text(
-                text=f"No venues found with {vibe} vibe",
+                text=empty_results_text("vibe", (vibe,), lang, snapshot.city),
                 reply_markup=create_refresh_keyboard(lang)
             )
             return CHOOSING_ACTION
         
-        # Check current time for happy hour status
-        current_time = datetime.now().strftime("%H:%M")
-        
-        # Format message with venues
-        message = f"🌟 Venues with {vibe} vibe:\n\n"
-        for venue in vibe_venues[:5]:  # Show top 5 venues
-            message += format_place_details(venue, None, lang)
-            if venue.get('happy_hour'):
-                start_time, end_time = venue['happy_hour'].split("-")
-                if start_time <= current_time <= end_time:
-                    message += f"\n🔥 {get_text('current_happy_hour', lang)}"
-            message += "\n\n"
-        
-        keyboard = create_refresh_keyboard(lang)
         await query.edit_message_text(
             text=message,
             reply_markup=keyboard,
             parse_mode='Markdown'
         )
+        record_page_views(snapshot, "vibe", (vibe,), 0, lang)
         
     except Exception as e:
         logger.error(f"Error showing vibe venues: {str(e)}")
@@ -554,6 +1229,236 @@ async def show_vibe_venues(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return CHOOSING_ACTION
 
+def render_current_page(snapshot, now, lang):
+    """Render venues in happy hour at `now` and those starting soon, or '' if none"""
+    # Both lists are index lookups; nothing is re-parsed per request
+    active = sorted(snapshot.schedule.active_at(now).items(), key=lambda item: item[1])
+    upcoming = [
+        (minutes, idx)
+        for minutes, idx in snapshot.schedule.starting_within(STARTING_SOON_MINUTES, now)
+        if minutes > 0
+    ]
+    if not active and not upcoming:
+        return ''
+    
+    parts = [get_text('current_hours_header', lang, now.strftime("%H:%M")) + "\n\n"]
+    for idx, minutes_left in active[:5]:
+        parts.append(render_venue_card(snapshot, idx, lang))
+        parts.append(f"\n{get_text('happy_hour_until', lang, format_minute(now.hour * 60 + now.minute + minutes_left))}\n\n")
+    
+    if upcoming:
+        parts.append(get_text('starting_soon_header', lang, STARTING_SOON_MINUTES) + "\n\n")
+        for minutes, idx in upcoming[:5]:
+            parts.append(render_venue_card(snapshot, idx, lang))
+            parts.append(f"\n{get_text('happy_hour_starts_in', lang, minutes)}\n\n")
+    return "".join(parts)
+
+@instrumented('show_current_happy_hours')
+async def show_current_happy_hours(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show venues in happy hour right now and those starting soon."""
+    query = update.callback_query
+    lang = context.user_data.get('lang', 'en')
+    context.user_data["last_state"] = "current"
+    
+    snapshot = await get_venue_snapshot(user_city(context))
+    if not snapshot:
+        await query.edit_message_text(
+            text=get_text('error_loading_venues', lang),
+            reply_markup=create_main_menu_keyboard(lang)
+        )
+        return CHOOSING_ACTION
+    
+    now = datetime.now(TIMEZONE)
+    message = render_cache.get_or_render(
+        snapshot.version,
+        ('current', lang, now.strftime("%a %H:%M")),
+        lambda: render_current_page(snapshot, now, lang)
+    )
+    
+    if not message:
+        await query.edit_message_text(
+            text=get_text('no_current_hours', lang),
+            reply_markup=create_refresh_keyboard(lang)
+        )
+        return CHOOSING_ACTION
+    
+    await query.edit_message_text(
+        text=message,
+        reply_markup=create_refresh_keyboard(lang),
+        parse_mode='Markdown'
+    )
+    return CHOOSING_ACTION
+
+@functools.lru_cache(maxsize=4)
+def venue_ids_by_key(snapshot):
+    """Map popularity keys to venue ids, once per snapshot"""
+    return {venue_key(venue): idx for idx, venue in enumerate(snapshot.venues) if venue is not None}
+
+def render_popular_page(snapshot, area, lang):
+    """Render the most popular venues of an area (None for the whole city), or '' if none"""
+    ids_by_key = venue_ids_by_key(snapshot)
+    # Venues dropped from the data since they were counted are skipped
+    city = snapshot.city or city_manifest.default
+    ranked = popularity.top(popularity.scope(area, lang, popularity_city(city)), popularity.k)
+    venue_ids = [ids_by_key[key] for key in ranked if key in ids_by_key][:POPULAR_COUNT]
+    if not venue_ids:
+        return ''
+    
+    if area:
+        parts = [get_text('popular_area_header', lang, area_label(city, area_name(area, city), lang)) + "\n\n"]
+    else:
+        parts = [get_text('popular_header', lang, city_label(city, lang)) + "\n\n"]
+    for rank, idx in enumerate(venue_ids, 1):
+        parts.append(f"{rank}. ")
+        parts.append(render_venue_card(snapshot, idx, lang))
+        parts.append("\n\n")
+    return "".join(parts)
+
+@functools.lru_cache(maxsize=None)
+def create_popular_keyboard(city, lang):
+    """Create keyboard switching the popular list between a city's areas."""
+    areas = list(city_manifest[city].neighborhoods)
+    keyboard = []
+    row = []
+    for idx, name in enumerate(areas):
+        row.append(InlineKeyboardButton(
+            f"🌟 {area_label(city, name, lang)}",
+            callback_data=f"popular_{area_key(name)}"
+        ))
+        if (idx + 1) % 2 == 0 or idx == len(areas) - 1:
+            keyboard.append(row)
+            row = []
+    keyboard.append([
+        InlineKeyboardButton(get_text('popular_places', lang), callback_data="popular_places"),
+        InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu"),
+    ])
+    return InlineKeyboardMarkup(keyboard)
+
+@instrumented('show_popular_places')
+async def show_popular_places(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the venues users opened most recently, citywide or in one area."""
+    query = update.callback_query
+    lang = context.user_data.get('lang', 'en')
+    area = None if query.data == "popular_places" else query.data[len("popular_"):]
+    city = user_city(context)
+    
+    snapshot = await get_venue_snapshot(city)
+    if not snapshot:
+        await query.edit_message_text(
+            text=get_text('error_loading_venues', lang),
+            reply_markup=create_main_menu_keyboard(lang)
+        )
+        return CHOOSING_ACTION
+    
+    # Reading a ranking only sorts its top entries; the counting happened as users browsed
+    message = render_popular_page(snapshot, area, lang)
+    if not message:
+        await query.edit_message_text(
+            text=get_text('no_popular', lang),
+            reply_markup=create_popular_keyboard(city, lang)
+        )
+        return CHOOSING_ACTION
+    
+    await query.edit_message_text(
+        text=message,
+        reply_markup=create_popular_keyboard(city, lang),
+        parse_mode='Markdown'
+    )
+    return CHOOSING_ACTION
+
+@functools.lru_cache(maxsize=None)
+def create_back_keyboard(lang):
+    """Create a keyboard with just the main menu button"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu")]])
+
+def render_crawl(snapshot, crawl, lat, lon, start, lang):
+    """Format a planned crawl with each stop's times and a walking route through all of them"""
+    if not crawl.stops:
+        return get_text('no_crawl', lang, format_minute(start))
+    columns = snapshot.columns
+    parts = [get_text('crawl_header', lang, format_minute(start)) + "\n\n"]
+    for number, stop in enumerate(crawl.stops, 1):
+        venue = snapshot.venues[stop.venue_id]
+        parts.append(get_text(
+            'crawl_stop', lang, number, venue.get('name', ''), format_minute(stop.start), format_minute(stop.leave)
+        ) + "\n")
+        parts.append(f"📍 {venue.get('address', '')}\n")
+        if venue.get('deal'):
+            parts.append(f"🎉 {venue.get('deal')}\n")
+        parts.append(get_text('crawl_leg', lang, walk_minutes(stop.leg_km), format_minute(stop.ends)) + "\n\n")
+    parts.append(get_text('crawl_total', lang, crawl.total_km) + "\n")
+    stops = [f"{columns.latitude[stop.venue_id]},{columns.longitude[stop.venue_id]}" for stop in crawl.stops]
+    parts.append(get_text('crawl_route', lang, get_google_maps_route_link(f"{lat},{lon}", stops)))
+    return "".join(parts)
+
+def create_crawl_keyboard(lat, lon, delay, lang):
+    """Create Replan / An hour later buttons for a crawl starting at a point"""
+    point = f"{lat:.4f}|{lon:.4f}"
+    row = [InlineKeyboardButton(get_text('refresh', lang), callback_data=f"{CRAWL_PREFIX}|{point}|{delay}")]
+    if delay + CRAWL_DELAY_STEP <= MAX_CRAWL_DELAY:
+        row.append(InlineKeyboardButton(
+            get_text('crawl_later', lang),
+            callback_data=f"{CRAWL_PREFIX}|{point}|{delay + CRAWL_DELAY_STEP}"
+        ))
+    return InlineKeyboardMarkup([row, [InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu")]])
+
+async def plan_crawl(lat, lon, delay, city, lang):
+    """Plan a crawl from a point starting `delay` minutes from now; returns (text, keyboard)"""
+    snapshot = await get_venue_snapshot(city_at(lat, lon, city))
+    if not snapshot:
+        return get_text('error_loading_venues', lang), create_main_menu_keyboard(lang)
+    when = datetime.now(TIMEZONE) + timedelta(minutes=delay)
+    # The search is CPU-bound, so it runs in the blocking pool with its own time budget
+    crawl = await blocking_pool.run(crawl_planner.plan, snapshot, lat, lon, when)
+    text = render_crawl(snapshot, crawl, lat, lon, minute_of_week(when), lang)
+    return text, create_crawl_keyboard(lat, lon, delay, lang)
+
+@instrumented('start_crawl')
+async def start_crawl(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Plan a crawl from the location the user just shared."""
+    lang = context.user_data.get('lang', 'en')
+    location = update.message.location
+    
+    try:
+        text, keyboard = await plan_crawl(location.latitude, location.longitude, 0, user_city(context), lang)
+        await update.message.reply_text(
+            text,
+            reply_markup=keyboard,
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+    except Exception as e:
+        logger.error(f"Error planning crawl: {str(e)}")
+        await update.message.reply_text(get_text('error_processing_location', lang))
+    
+    return CHOOSING_ACTION
+
+@instrumented('replan_crawl')
+async def replan_crawl(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Plan a crawl again from its buttons, now or later."""
+    query = update.callback_query
+    await query.answer()
+    lang = context.user_data.get('lang', 'en')
+    
+    try:
+        _, lat, lon, delay = query.data.split("|")
+        text, keyboard = await plan_crawl(float(lat), float(lon), min(int(delay), MAX_CRAWL_DELAY), user_city(context), lang)
+        await query.edit_message_text(
+            text=text,
+            reply_markup=keyboard,
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+    except Exception as e:
+        logger.error(f"Error planning crawl: {str(e)}")
+        await query.edit_message_text(
+            text=get_text('error_processing_location', lang),
+            reply_markup=create_main_menu_keyboard(lang)
+        )
+    
+    return CHOOSING_ACTION
+
+@functools.lru_cache(maxsize=None)
 def create_vibe_keyboard(lang):
     """Create keyboard with vibe selection buttons."""
     vibes = ["Chill", "Trendy", "Upscale", "Casual"]
@@ -572,10 +1477,229 @@ def create_vibe_keyboard(lang):
     keyboard.append([InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu")])
     return InlineKeyboardMarkup(keyboard)
 
-def main():
-    """Start the bot."""
-    # Create the Application and pass it your bot's token.
-    application = Application.builder().token(os.getenv("TELEGRAM_TOKEN")).build()
+def rank_venues(snapshot, key):
+    """Ranked venue ids matching a normalized search text"""
+    return tuple(snapshot.search.search(key))
+
+async def search_venues(snapshot, text):
+    """Ranked venue ids for an inline search, searched in the blocking pool and cached per dataset version"""
+    key = normalize(text)
+    venue_ids = render_cache.get(snapshot.version, ('search', key))
+    if venue_ids is None:
+        venue_ids = await blocking_pool.run(rank_venues, snapshot, key)
+        render_cache.put(snapshot.version, ('search', key), venue_ids)
+    return venue_ids
+
+def create_inline_result(snapshot, idx, lang):
+    """Inline result posting a venue's card into the chat"""
+    venue = snapshot.venues[idx]
+    description = " · ".join(part for part in (venue.get('address'), venue.get('deal')) if part)
+    return InlineQueryResultArticle(
+        id=f"{snapshot.version}:{idx}",
+        title=venue.get('name', ''),
+        description=description,
+        input_message_content=InputTextMessageContent(
+            render_venue_card(snapshot, idx, lang),
+            parse_mode='Markdown'
+        ),
+    )
+
+@instrumented('inline_search')
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer `@bot <text>` inline queries with matching venues."""
+    query = update.inline_query
+    lang = context.user_data.get('lang', 'en') if context.user_data is not None else 'en'
+    city = user_city(context)
+    if query.location:
+        # Sent by clients that share their location with inline bots
+        city = city_at(query.location.latitude, query.location.longitude, city)
+    
+    snapshot = await get_venue_snapshot(city)
+    if not snapshot:
+        await query.answer([], cache_time=5)
+        return
+    
+    text = query.query.strip()
+    if text:
+        try:
+            venue_ids = await search_venues(snapshot, text)
+        except (OffloadRejected, OffloadTimeout) as e:
+            # Let this query lapse; the next keystroke sends a new one
+            logger.warning(f"Inline search skipped: {str(e)}")
+            return
+        cache_time = INLINE_CACHE_TIME
+    else:
+        # Nothing typed yet: suggest what's in happy hour, ending soonest first
+        active = snapshot.schedule.active_at(datetime.now(TIMEZONE))
+        venue_ids = [idx for idx, _ in sorted(active.items(), key=lambda item: item[1])]
+        cache_time = INLINE_NOW_CACHE_TIME
+    
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    page = venue_ids[offset:offset + INLINE_PAGE_SIZE]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(venue_ids) else ''
+    try:
+        await query.answer(
+            [create_inline_result(snapshot, idx, lang) for idx in page],
+            cache_time=cache_time,
+            next_offset=next_offset
+        )
+    except BadRequest as e:
+        # The user kept typing and Telegram has already expired this query
+        logger.debug(f"Inline query answer rejected: {str(e)}")
+
+@instrumented('inline_result_chosen')
+async def inline_result_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Count a venue posted from inline search as a click"""
+    result = update.chosen_inline_result
+    version, _, idx = result.result_id.partition(':')
+    city = venue_shards.find(version)
+    snapshot = venue_shards.snapshot(city) if city else None
+    # Results sent before a data reload point at the old venue ids
+    if not snapshot or version != snapshot.version or not idx.isdigit() or int(idx) >= len(snapshot):
+        return
+    lang = context.user_data.get('lang', 'en') if context.user_data is not None else 'en'
+    record_views(snapshot, [int(idx)], lang, CLICK_WEIGHT)
+
+def subscription_description(kind, params, lang):
+    """Describe what a subscription matches, e.g. "in Florentin" """
+    if kind == "area":
+        return get_text('subscription_area', lang, area_label(city_manifest.default, area_name(params[0], city_manifest.default), lang))
+    if kind == "vibe":
+        name = params[0].title()
+        return get_text('subscription_vibe', lang, TRANSLATIONS[lang]['vibes'].get(name, name))
+    lat, lon, radius = params
+    return get_text('subscription_near', lang, radius, lat, lon)
+
+def render_subscriptions(user_data, lang):
+    """Return (text, keyboard) listing a user's subscriptions with remove buttons"""
+    subscriptions = user_data.get('subscriptions', [])
+    keyboard = []
+    if subscriptions:
+        lines = [get_text('notifications_header', lang), ""]
+        for kind, *params in subscriptions:
+            description = subscription_description(kind, params, lang)
+            lines.append(f"• {description}")
+            keyboard.append([InlineKeyboardButton(
+                f"❌ {description}",
+                callback_data=encode_subscription(UNSUBSCRIBE_PREFIX, kind, params)
+            )])
+        text = "\n".join(lines)
+    else:
+        text = get_text('no_subscriptions', lang)
+    keyboard.append([InlineKeyboardButton(get_text('main_menu', lang), callback_data="main_menu")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+@instrumented('subscribe')
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Subscribe to happy hour starts matching the result list the button was under"""
+    query = update.callback_query
+    lang = context.user_data.get('lang', 'en')
+    
+    try:
+        kind, params = decode_subscription(query.data)
+    except ValueError as e:
+        logger.error(f"Error decoding subscription: {str(e)}")
+        await query.answer(get_text('error_loading_venues', lang))
+        return None
+    
+    result = notifier.subscribe(context.user_data, update.effective_user.id, kind, params)
+    if result == 'added':
+        await query.answer(get_text('subscribed', lang, subscription_description(kind, params, lang)), show_alert=True)
+    elif result == 'exists':
+        await query.answer(get_text('already_subscribed', lang))
+    else:
+        await query.answer(get_text('too_many_subscriptions', lang, MAX_SUBSCRIPTIONS), show_alert=True)
+    # The results stay on screen, so the conversation state doesn't change
+    return None
+
+@instrumented('unsubscribe')
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove a subscription from the notifications list"""
+    query = update.callback_query
+    lang = context.user_data.get('lang', 'en')
+    
+    try:
+        kind, params = decode_subscription(query.data)
+    except ValueError as e:
+        logger.error(f"Error decoding subscription: {str(e)}")
+        kind, params = None, ()
+    if kind is not None and notifier.unsubscribe(context.user_data, update.effective_user.id, kind, params):
+        await query.answer(get_text('unsubscribed', lang))
+    else:
+        await query.answer()
+    
+    text, keyboard = render_subscriptions(context.user_data, lang)
+    await query.edit_message_text(text=text, reply_markup=keyboard)
+    return CHOOSING_ACTION
+
+def render_start_notification(snapshot, venue_ids, more, lang):
+    """Render the message telling a subscriber that happy hours have started"""
+    parts = [get_text('starting_now_header', lang) + "\n\n"]
+    for idx in venue_ids:
+        parts.append(render_venue_card(snapshot, idx, lang))
+        parts.append("\n\n")
+    if more:
+        parts.append(get_text('starting_now_more', lang))
+    return "".join(parts)
+
+# Sends happy hour start notifications for the default city from one event heap on the job queue
+notifier = StartNotifier(lambda: venue_shards.snapshot(city_manifest.default), render_start_notification, send_rate=NOTIFY_RATE)
+
+async def post_init(application: Application):
+    """Start background services once the Application is initialized."""
+    if metrics_server is not None:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.error(f"Could not start metrics server: {str(e)}")
+    background_tasks.append(asyncio.create_task(monitor_loop_lag()))
+    if loop_watchdog is not None:
+        loop_watchdog.start()
+    await popularity.load_peers()
+    background_tasks.append(asyncio.create_task(popularity.run_flusher(POPULARITY_FLUSH_INTERVAL)))
+    notifier.start(application)
+
+async def post_shutdown(application: Application):
+    """Stop background services."""
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await live_tracker.shutdown()
+    await notifier.shutdown()
+    # Keep the counts gathered since the last periodic write
+    await popularity.flush()
+    if loop_watchdog is not None:
+        await loop_watchdog.stop()
+    blocking_pool.shutdown()
+    if metrics_server is not None:
+        await metrics_server.stop()
+
+def build_application():
+    """Create the Application and register all handlers."""
+    # Updates from different chats run concurrently, each chat's updates in order
+    builder = (
+        Application.builder()
+        .token(os.getenv("TELEGRAM_TOKEN"))
+        .connection_pool_size(BOT_API_CONNECTIONS)
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        # Outgoing calls stay under Telegram's limits; repeated refreshes collapse into one edit
+        .rate_limiter(OutboundRateLimiter(
+            global_rate=OUTBOUND_GLOBAL_RATE,
+            chat_rate=OUTBOUND_CHAT_RATE,
+            max_retries=OUTBOUND_MAX_RETRIES,
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        api_url = TELEGRAM_API_URL.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    if PERSISTENCE_FILE:
+        # user_data and conversation state survive restarts, written in batches
+        builder = builder.persistence(
+            SQLitePersistence(PERSISTENCE_FILE, update_interval=PERSISTENCE_INTERVAL, owns=worker_owns())
+        )
+    application = builder.build()
 
     # Add conversation handler with the states
     conv_handler = ConversationHandler(
@@ -585,8 +1709,12 @@ def main():
                 CallbackQueryHandler(choose_language, pattern="^lang_")
             ],
             CHOOSING_ACTION: [
+                CallbackQueryHandler(show_page, pattern=f"^{CURSOR_PREFIX}\\|"),
+                CallbackQueryHandler(subscribe, pattern=f"^{SUBSCRIBE_PREFIX}\\|"),
+                CallbackQueryHandler(unsubscribe, pattern=f"^{UNSUBSCRIBE_PREFIX}\\|"),
+                CallbackQueryHandler(replan_crawl, pattern=f"^{CRAWL_PREFIX}\\|"),
                 CallbackQueryHandler(handle_action),
-                MessageHandler(filters.LOCATION, handle_location)
+                MessageHandler(filters.LOCATION & filters.UpdateType.MESSAGE, handle_location)
             ],
             CHOOSING_LOCATION: [
                 CallbackQueryHandler(show_area_venues, pattern="^area_")
@@ -595,17 +1723,200 @@ def main():
                 CallbackQueryHandler(show_vibe_venues, pattern="^vibe_")
             ],
             WAITING_FOR_LOCATION: [
-                MessageHandler(filters.LOCATION, handle_location),
-                CallbackQueryHandler(handle_action, pattern="^radius_")
+                MessageHandler(filters.LOCATION & filters.UpdateType.MESSAGE, handle_location),
+                CallbackQueryHandler(handle_action, pattern="^(radius_|main_menu$)")
             ]
         },
-        fallbacks=[CommandHandler("start", start)],
+        fallbacks=[
+            CommandHandler("start", start),
+            # Page buttons keep working from older messages whatever the current state
+            CallbackQueryHandler(show_page, pattern=f"^{CURSOR_PREFIX}\\|"),
+            CallbackQueryHandler(subscribe, pattern=f"^{SUBSCRIBE_PREFIX}\\|"),
+            CallbackQueryHandler(unsubscribe, pattern=f"^{UNSUBSCRIBE_PREFIX}\\|"),
+            CallbackQueryHandler(replan_crawl, pattern=f"^{CRAWL_PREFIX}\\|"),
+        ],
+        name="main_conversation",
+        persistent=bool(PERSISTENCE_FILE),
     )
 
     application.add_handler(conv_handler)
+    # Live location updates are edits of an earlier message, whatever the conversation state
+    application.add_handler(MessageHandler(
+        filters.UpdateType.EDITED_MESSAGE & filters.LOCATION, handle_live_location
+    ))
+    # Inline queries arrive outside any chat, so they bypass the conversation
+    application.add_handler(InlineQueryHandler(inline_search))
+    # Sent when a user picks an inline result (needs /setinlinefeedback in BotFather)
+    application.add_handler(ChosenInlineResultHandler(inline_result_chosen))
+    return application
+
+def webhook_secret():
+    """The token Telegram echoes back in X-Telegram-Bot-Api-Secret-Token on every call"""
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    logger.warning("WEBHOOK_SECRET not set, using a random secret token for this run")
+    return secrets.token_urlsafe(32)
+
+def run_webhook(application):
+    """Serve updates from a local webhook server instead of long polling."""
+    secret_token = webhook_secret()
+    url_path = WEBHOOK_PATH.strip('/')
+    logger.info(f"Starting webhook server on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{url_path}")
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=url_path,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+        secret_token=secret_token,
+        allowed_updates=Update.ALL_TYPES,
+    )
+
+def worker_owns():
+    """In a worker, whether a chat (or user) id is routed to it; None outside multi-worker mode"""
+    if WORKER_INDEX is None:
+        return None
+    ring = HashRing(range(WORKER_COUNT))
+    index = int(WORKER_INDEX)
+    return lambda chat_id: ring.node(chat_id) == index
+
+def worker_file(path, index):
+    """A worker's own variant of a per-process file, e.g. data/popularity.worker1.json"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{index}{ext}"
+
+def worker_environment(index):
+    """Settings of worker `index`, on top of the ingress' own environment"""
+    env = {
+        'WORKER_INDEX': str(index),
+        'WORKER_COUNT': str(WORKERS),
+        # The bot-wide outgoing budgets are split between the workers
+        'OUTBOUND_GLOBAL_RATE': str(OUTBOUND_GLOBAL_RATE / WORKERS),
+        'NOTIFY_RATE': str(NOTIFY_RATE / WORKERS),
+    }
+    if METRICS_PORT:
+        # The ingress keeps METRICS_PORT, the workers take the ports after it
+        env['METRICS_PORT'] = str(int(METRICS_PORT) + 1 + index)
+    if POPULARITY_FILE:
+        # Each worker writes its own counts and ranks by all of them, the
+        # single-process file included until its counts have decayed
+        others = [worker_file(POPULARITY_FILE, other) for other in range(WORKERS) if other != index]
+        env['POPULARITY_FILE'] = worker_file(POPULARITY_FILE, index)
+        env['POPULARITY_PEERS'] = os.pathsep.join([POPULARITY_FILE] + others)
+    return env
+
+def compile_shared_snapshots():
+    """Compile every city's venues once, so the workers map the same read-only snapshots"""
+    for city in city_manifest:
+        if not city.compiled_file:
+            continue
+        try:
+            compile_venues(city.venues_file, city.compiled_file, city.neighborhoods, city.aliases, only_stale=True)
+        except (OSError, ValueError) as e:
+            # The workers fall back to parsing the JSON themselves
+            logger.error(f"Could not compile venues of {city.id}: {str(e)}")
+
+async def serve_ingress():
+    """Run the workers behind one webhook until SIGINT or SIGTERM."""
+    secret_token = webhook_secret()
+    url_path = WEBHOOK_PATH.strip('/')
+    compile_shared_snapshots()
+    ingress = Ingress(
+        WORKERS, [sys.executable, os.path.abspath(__file__)], worker_environment, WORKER_BASE_PORT,
+        secrets.token_urlsafe(32), WEBHOOK_LISTEN, WEBHOOK_PORT, url_path, secret_token, INGRESS_QUEUE,
+    )
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    if metrics_server is not None:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.error(f"Could not start metrics server: {str(e)}")
+    bot_urls = {}
+    if TELEGRAM_API_URL:
+        api_url = TELEGRAM_API_URL.rstrip('/')
+        bot_urls = {'base_url': f"{api_url}/bot", 'base_file_url': f"{api_url}/file/bot"}
+    bot = Bot(os.getenv("TELEGRAM_TOKEN"), **bot_urls)
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            try:
+                # Telegram only starts posting once every worker is up
+                await ingress.start(client)
+                async with bot:
+                    await bot.set_webhook(
+                        url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+                        secret_token=secret_token,
+                        allowed_updates=Update.ALL_TYPES,
+                    )
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                logger.info("Stopping the ingress")
+            finally:
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.remove_signal_handler(sig)
+                await ingress.stop()
+    finally:
+        if metrics_server is not None:
+            await metrics_server.stop()
+
+async def serve_worker(application):
+    """Handle the updates the ingress forwards to this worker until SIGINT or SIGTERM.
+
+    Runs the Application like run_webhook does, with the ingress' link in place
+    of the webhook server and without touching the webhook itself.
+    """
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+
+    def deliver(updates):
+        for data in updates:
+            try:
+                update = Update.de_json(data, application.bot)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"Dropping malformed update from the ingress: {str(e)}")
+                continue
+            application.update_queue.put_nowait(update)
+
+    receiver = UpdateReceiver('127.0.0.1', WORKER_BASE_PORT + int(WORKER_INDEX), WORKER_SECRET, deliver)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await receiver.start()
+        await stopped.wait()
+    finally:
+        await receiver.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def main():
+    """Start the bot."""
+    if WORKERS > 1 and WORKER_INDEX is None:
+        if WEBHOOK_URL:
+            asyncio.run(serve_ingress())
+            return
+        logger.warning("WORKERS needs WEBHOOK_URL, running a single process with long polling")
+
+    # Parse the default city's venues at startup; other cities load on first use
+    venue_shards.load(city_manifest.default)
+    popularity.load()
+
+    application = build_application()
 
     # Start the Bot
-    application.run_polling()
+    if WORKER_INDEX is not None:
+        asyncio.run(serve_worker(application))
+    elif WEBHOOK_URL:
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
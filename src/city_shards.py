@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from area_index import AREA_ALIASES, NEIGHBORHOODS, area_key
+from compiled_venues import default_output_path
+from metrics import VENUE_COUNT, VENUE_SHARD_BYTES, VENUE_SHARD_EVICTIONS, VENUE_SHARDS_LOADED
+from spatial_index import calculate_distance
+from venue_model import MAX_TRACKED_NAMES
+from venue_store import DEFAULT_CHECK_INTERVAL, VenueStore
+
+logger = logging.getLogger(__name__)
+
+# Estimated memory the loaded shards may hold before cold ones are dropped
+DEFAULT_MAX_BYTES = 512 * 2 ** 20
+# A location outside every city's bounds still belongs to the nearest city within this many km
+MAX_CITY_DISTANCE = 25.0
+
+# The city served when there is no manifest, from the single venues file
+DEFAULT_CITY = "tel_aviv"
+DEFAULT_CITY_NAMES = {'en': "Tel Aviv", 'he': "תל אביב"}
+
+MANIFEST_VERSION = 1
+
+
+class City:
+    """One shard of the venue data: a city or region with its own venues file and areas"""
+
+    __slots__ = ('id', 'names', 'venues_file', 'compiled_file', 'bounds',
+                 'neighborhoods', 'aliases', 'area_names')
+
+    def __init__(self, city_id, names, venues_file, compiled_file=None, bounds=None,
+                 neighborhoods=NEIGHBORHOODS, aliases=AREA_ALIASES, area_names=None):
+        self.id = city_id
+        # Display name per language
+        self.names = names
+        self.venues_file = venues_file
+        self.compiled_file = compiled_file
+        # (south, west, north, east), or None for a city that claims no locations
+        self.bounds = bounds
+        self.neighborhoods = neighborhoods
+        self.aliases = aliases
+        # Area display names per language: {area: {lang: name}}
+        self.area_names = area_names or {}
+
+    def name(self, lang):
+        return self.names.get(lang) or self.names.get('en') or self.id
+
+    def area_label(self, area, lang):
+        """An area's name in a language, or None if the manifest doesn't give one"""
+        return self.area_names.get(area, {}).get(lang)
+
+    def area_by_key(self, key):
+        """Canonical name of the area with a callback key, or None"""
+        for name in self.neighborhoods:
+            if area_key(name) == key:
+                return name
+        return None
+
+    def contains(self, lat, lon):
+        if self.bounds is None:
+            return False
+        south, west, north, east = self.bounds
+        return south <= lat <= north and west <= lon <= east
+
+    def distance(self, lat, lon):
+        """km from a point to the centre of the city's bounds"""
+        south, west, north, east = self.bounds
+        return calculate_distance(lat, lon, (south + north) / 2, (west + east) / 2)
+
+    def store(self, check_interval=DEFAULT_CHECK_INTERVAL):
+        """A venue store for this city's shard"""
+        return VenueStore(
+            self.venues_file, check_interval=check_interval, compiled_path=self.compiled_file,
+            city=self.id, neighborhoods=self.neighborhoods, aliases=self.aliases
+        )
+
+
+def _parse_city(entry, base_dir):
+    """Build a City from one manifest entry; raises ValueError if it's malformed"""
+    try:
+        city_id = entry['id']
+        venues_file = os.path.join(base_dir, entry['venues'])
+        compiled = entry.get('compiled')
+        bounds = entry.get('bounds')
+        if bounds is not None:
+            bounds = tuple(float(value) for value in bounds)
+            if len(bounds) != 4:
+                raise ValueError(f"city {city_id}: bounds must be [south, west, north, east]")
+        neighborhoods = {}
+        aliases = {}
+        area_names = {}
+        for area in entry.get('areas', []):
+            name = area['name']
+            neighborhoods[name] = [(float(lat), float(lon)) for lat, lon in area.get('polygon', [])]
+            aliases[name] = tuple(area.get('aliases', ()))
+            area_names[name] = dict(area.get('names', {}))
+        if len(neighborhoods) > MAX_TRACKED_NAMES:
+            raise ValueError(f"city {city_id}: at most {MAX_TRACKED_NAMES} areas are supported, got {len(neighborhoods)}")
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"bad city entry {entry!r}: {str(e)}") from None
+    return City(
+        city_id,
+        dict(entry.get('names', {})),
+        venues_file,
+        os.path.join(base_dir, compiled) if compiled else default_output_path(venues_file),
+        bounds,
+        neighborhoods,
+        aliases,
+        area_names,
+    )
+
+
+class CityManifest:
+    """The cities the bot serves, read from a JSON manifest next to their shards.
+
+        {"version": 1, "default": "tel_aviv", "cities": [{
+            "id": "tel_aviv", "names": {"en": "Tel Aviv", "he": "תל אביב"},
+            "venues": "tel_aviv.json", "bounds": [32.02, 34.74, 32.15, 34.85],
+            "areas": [{"name": "Florentin", "names": {"he": "פלורנטין"},
+                       "polygon": [[32.054, 34.7635], ...], "aliases": ["florentine"]}]
+        }]}
+
+    Paths are relative to the manifest; "compiled" defaults to the venues file
+    with a .venues extension.
+    """
+
+    def __init__(self, cities, default):
+        self.cities = OrderedDict((city.id, city) for city in cities)
+        if default not in self.cities:
+            raise ValueError(f"default city {default!r} is not in the manifest")
+        self.default = default
+
+    @classmethod
+    def load(cls, path):
+        """Read a manifest file; raises ValueError if it's malformed"""
+        with open(path, 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"unsupported manifest version {manifest.get('version')}")
+        base_dir = os.path.dirname(os.path.abspath(path))
+        cities = [_parse_city(entry, base_dir) for entry in manifest.get('cities', [])]
+        if not cities:
+            raise ValueError("manifest lists no cities")
+        return cls(cities, manifest.get('default', cities[0].id))
+
+    @classmethod
+    def single(cls, venues_file, compiled_file=None):
+        """A manifest of just one venues file, served as Tel Aviv with its built-in areas"""
+        return cls([City(DEFAULT_CITY, DEFAULT_CITY_NAMES, venues_file, compiled_file)], DEFAULT_CITY)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def __iter__(self):
+        return iter(self.cities.values())
+
+    def __contains__(self, city_id):
+        return city_id in self.cities
+
+    def __getitem__(self, city_id):
+        return self.cities[city_id]
+
+    def locate(self, lat, lon, max_km=MAX_CITY_DISTANCE):
+        """Id of the city a location is in or nearest to, or None if it's far from all of them"""
+        best = None
+        best_km = max_km
+        for city in self.cities.values():
+            if city.bounds is None:
+                continue
+            if city.contains(lat, lon):
+                return city.id
+            km = city.distance(lat, lon)
+            if km <= best_km:
+                best, best_km = city.id, km
+        return best
+
+
+class ShardedVenueStore:
+    """Venue stores for every city of a manifest, loaded on first use.
+
+    Each city is a VenueStore of its own, so it hot-reloads and maps its compiled
+    snapshot independently. A city's shard is loaded the first time a handler asks
+    for it. After each load, the least recently used shards are dropped until the
+    estimated size of the loaded ones fits in `max_bytes`. Pinned cities and the
+    one just used are never dropped. A dropped city is loaded again on its next
+    request. `on_unload(version)` is called when a snapshot is replaced by a reload
+    or dropped, so caches keyed by its version can let go of it. When the new
+    snapshot was patched from the previous one instead, `on_patch(snapshot)` is
+    called so those caches can keep what its diff doesn't touch.
+    """
+
+    def __init__(self, manifest, check_interval=DEFAULT_CHECK_INTERVAL, max_bytes=DEFAULT_MAX_BYTES,
+                 pinned=(), on_unload=None, on_patch=None):
+        self.manifest = manifest
+        self.check_interval = check_interval
+        self.max_bytes = max_bytes
+        self.pinned = set(pinned)
+        self.on_unload = on_unload
+        self.on_patch = on_patch
+        # city id -> VenueStore, least recently used first
+        self._stores = OrderedDict()
+        # city id -> version of the snapshot handed out last
+        self._versions = {}
+
+    def __len__(self):
+        return len(self._stores)
+
+    def _store(self, city_id):
+        store = self._stores.get(city_id)
+        if store is None:
+            store = self._stores[city_id] = self.manifest[city_id].store(self.check_interval)
+        else:
+            self._stores.move_to_end(city_id)
+        return store
+
+    def load(self, city_id):
+        """Synchronously load a city's shard (at startup), returning its snapshot"""
+        snapshot = self._store(city_id).load()
+        self._track(city_id, snapshot)
+        return snapshot
+
+    async def get(self, city_id):
+        """Current snapshot of a city, loading its shard if needed; None if it can't be loaded"""
+        snapshot = await self._store(city_id).get()
+        self._track(city_id, snapshot)
+        return snapshot
+
+    def snapshot(self, city_id):
+        """The city's snapshot if its shard is in memory, without loading anything"""
+        store = self._stores.get(city_id)
+        return store.snapshot if store is not None else None
+
+    def find(self, version_prefix):
+        """Id of the loaded city whose snapshot version starts with a prefix, or None"""
+        for city_id, store in self._stores.items():
+            snapshot = store.snapshot
+            if snapshot is not None and snapshot.version.startswith(version_prefix):
+                return city_id
+        return None
+
+    def _track(self, city_id, snapshot):
+        """Notice new snapshots and drop cold shards once one was loaded"""
+        if snapshot is None:
+            return
+        old = self._versions.get(city_id)
+        if old == snapshot.version:
+            return
+        self._versions[city_id] = snapshot.version
+        if old is not None:
+            # Several reloads may have happened since the last request; only a diff
+            # from the version handed out last says what the caches can keep
+            if snapshot.diff is not None and snapshot.diff.base_version == old and self.on_patch is not None:
+                self.on_patch(snapshot)
+            elif self.on_unload is not None:
+                self.on_unload(old)
+        self._trim(city_id)
+
+    def footprint(self):
+        """Estimated bytes held by the loaded snapshots"""
+        return sum(store.snapshot.footprint for store in self._stores.values() if store.snapshot is not None)
+
+    def _trim(self, keep):
+        total = self.footprint()
+        for city_id in list(self._stores):
+            if total <= self.max_bytes:
+                break
+            snapshot = self._stores[city_id].snapshot
+            # A store still loading holds nothing yet and has a handler waiting on it
+            if city_id == keep or city_id in self.pinned or snapshot is None:
+                continue
+            del self._stores[city_id]
+            version = self._versions.pop(city_id, None)
+            total -= snapshot.footprint
+            VENUE_COUNT.set(0, city=city_id)
+            VENUE_SHARD_EVICTIONS.inc()
+            logger.info(f"Dropped venues of {city_id} ({snapshot.footprint // 2 ** 20} MiB estimated) to stay under the memory cap")
+            if version is not None and self.on_unload is not None:
+                self.on_unload(version)
+        VENUE_SHARDS_LOADED.set(len(self._stores))
+        VENUE_SHARD_BYTES.set(total)
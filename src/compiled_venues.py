@@ -0,0 +1,335 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from types import MappingProxyType
+
+from venue_model import VENUE_FIELDS, Venue
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'HHVENUES'
+# Bump whenever the layout or any index's to_arrays() output changes
+FORMAT_VERSION = 3
+# magic, format version, reserved, metadata offset, metadata length
+_HEADER = struct.Struct('<8sIIQQ')
+_ALIGNMENT = 8
+
+# Record fields kept in the string table; coordinates come from the columns
+_TEXT_FIELDS = tuple(key for key in VENUE_FIELDS if key not in ('latitude', 'longitude')) + ('extra',)
+_LAT_POS = VENUE_FIELDS.index('latitude')
+
+
+def _encode_value(value):
+    """Tag plain strings with 's' and anything else with 'j' + JSON"""
+    if isinstance(value, str):
+        return 's' + value
+    if isinstance(value, MappingProxyType):
+        value = dict(value)
+    return 'j' + json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _decode_value(text):
+    if text[0] == 's':
+        return text[1:]
+    value = json.loads(text[1:])
+    return MappingProxyType(value) if isinstance(value, dict) else value
+
+
+class StringTable:
+    """Sequence of strings stored as one UTF-8 blob plus offsets, decoded on access"""
+
+    __slots__ = ('_blob', '_offsets')
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, pos):
+        return str(self._blob[self._offsets[pos]:self._offsets[pos + 1]], 'utf-8')
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self[pos]
+
+
+class CompiledVenues:
+    """Read-only sequence of Venue records backed by a mapped snapshot file.
+
+    Records are decoded from the string table when accessed, so opening a
+    snapshot costs nothing per venue.
+    """
+
+    __slots__ = ('_fields', '_strings', '_latitude', '_longitude')
+
+    def __init__(self, fields, strings, latitude, longitude):
+        self._fields = fields
+        self._strings = strings
+        self._latitude = latitude
+        self._longitude = longitude
+
+    def __len__(self):
+        return len(self._latitude)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return tuple(self[pos] for pos in range(*idx.indices(len(self))))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("venue index out of range")
+        width = len(_TEXT_FIELDS)
+        values = [
+            None if string_id < 0 else _decode_value(self._strings[string_id])
+            for string_id in self._fields[idx * width:(idx + 1) * width]
+        ]
+        lat, lon = self._latitude[idx], self._longitude[idx]
+        # NaN marks a missing coordinate
+        values[_LAT_POS:_LAT_POS] = [None if lat != lat else lat, None if lon != lon else lon]
+        return Venue(*values)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class CompiledSnapshot:
+    """Sections of a mapped snapshot file, ready for the indexes' from_arrays()"""
+
+    def __init__(self, path, meta, sections):
+        self.path = path
+        self.meta = meta
+        self.sections = sections
+
+    @property
+    def source_version(self):
+        return self.meta['source_version']
+
+    def group(self, prefix):
+        """Sections belonging to one index, keyed without the prefix"""
+        start = len(prefix) + 1
+        return {name[start:]: value for name, value in self.sections.items() if name.startswith(prefix + '.')}
+
+    def venues(self):
+        columns = self.group('columns')
+        return CompiledVenues(
+            self.sections['venues.fields'], self.sections['venues.strings'],
+            columns['latitude'], columns['longitude'],
+        )
+
+
+def _venue_sections(venues):
+    """Field string ids per venue plus the de-duplicated string table"""
+    ids = {}
+    strings = []
+    fields = array('i')
+    for venue in venues:
+        for key in _TEXT_FIELDS:
+            value = getattr(venue, key)
+            if value is None:
+                fields.append(-1)
+                continue
+            text = _encode_value(value)
+            string_id = ids.get(text)
+            if string_id is None:
+                string_id = ids[text] = len(strings)
+                strings.append(text)
+            fields.append(string_id)
+    return {'venues.fields': fields, 'venues.strings': strings}
+
+
+def _pack_strings(strings):
+    blob = bytearray()
+    offsets = array('q', [0])
+    for text in strings:
+        blob += text.encode('utf-8')
+        offsets.append(len(blob))
+    return blob, offsets
+
+
+def write_snapshot(snapshot, path, source_stat=None):
+    """Write a VenueSnapshot and its indexes to `path` atomically"""
+    sections = _venue_sections(snapshot.venues)
+    for prefix, index in (('spatial', snapshot.spatial), ('schedule', snapshot.schedule),
+                          ('areas', snapshot.areas), ('vibes', snapshot.vibes),
+                          ('columns', snapshot.columns), ('search', snapshot.search)):
+        for name, values in index.to_arrays().items():
+            sections[f'{prefix}.{name}'] = values
+
+    meta = {
+        'source_version': snapshot.version,
+        'source_size': source_stat.st_size if source_stat else None,
+        'source_mtime_ns': source_stat.st_mtime_ns if source_stat else None,
+        'byteorder': sys.byteorder,
+        'count': len(snapshot.venues),
+        'cell_size': snapshot.spatial.cell_size,
+        'area_names': list(snapshot.columns.area_names),
+        'vibe_names': list(snapshot.columns.vibe_names),
+        'sections': {},
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.venues-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\0' * _HEADER.size)
+
+            def write_aligned(data):
+                f.write(b'\0' * (-f.tell() % _ALIGNMENT))
+                offset = f.tell()
+                f.write(data)
+                return offset
+
+            for name, values in sections.items():
+                if isinstance(values, list):
+                    blob, offsets = _pack_strings(values)
+                    meta['sections'][name] = {
+                        'kind': 'strings',
+                        'blob': [write_aligned(blob), len(blob)],
+                        'offsets': [write_aligned(offsets.tobytes()), len(offsets)],
+                    }
+                else:
+                    meta['sections'][name] = {
+                        'kind': 'array',
+                        'typecode': values.typecode if isinstance(values, array) else values.format,
+                        'data': [write_aligned(values.tobytes()), len(values)],
+                    }
+            meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+            meta_offset = write_aligned(meta_bytes)
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, meta_offset, len(meta_bytes)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _read_meta(f):
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError("file too short")
+    magic, version, _, meta_offset, meta_length = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("not a compiled venues file")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"format version {version}, expected {FORMAT_VERSION}")
+    f.seek(meta_offset)
+    meta = json.loads(f.read(meta_length).decode('utf-8'))
+    if meta.get('byteorder') != sys.byteorder:
+        raise ValueError("compiled on a machine with a different byte order")
+    return meta
+
+
+def _is_current(meta, source_stat, source_version):
+    if source_version is not None and meta['source_version'] == source_version:
+        return True
+    return (
+        source_stat is not None
+        and meta.get('source_size') == source_stat.st_size
+        and meta.get('source_mtime_ns') == source_stat.st_mtime_ns
+    )
+
+
+def read_snapshot(path, source_stat=None, source_version=None):
+    """Map a compiled snapshot if it was built from the given source file.
+
+    The source matches when its sha256 version is equal or, without a version,
+    when its size and mtime are the ones recorded at compile time. Returns None
+    when the snapshot is missing or stale; raises ValueError if it is unusable.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        meta = _read_meta(f)
+        if not _is_current(meta, source_stat, source_version):
+            return None
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Every section is a view into the mapping; nothing is copied here
+    view = memoryview(mapped)
+
+    def section(offset, length, typecode='B'):
+        if offset < 0 or offset + length > len(view):
+            raise ValueError("section outside the file, snapshot is truncated")
+        return view[offset:offset + length].cast(typecode)
+
+    sections = {}
+    for name, spec in meta['sections'].items():
+        if spec['kind'] == 'strings':
+            offsets_offset, count = spec['offsets']
+            sections[name] = StringTable(section(*spec['blob']), section(offsets_offset, count * 8, 'q'))
+        else:
+            offset, count = spec['data']
+            typecode = spec['typecode']
+            sections[name] = section(offset, count * array(typecode).itemsize, typecode)
+    return CompiledSnapshot(path, meta, sections)
+
+
+def default_output_path(source_path):
+    """Where the compiled snapshot of a venues file is looked up by default"""
+    return os.path.splitext(source_path)[0] + '.venues'
+
+
+def compile_venues(source, output, neighborhoods=None, aliases=None, only_stale=False):
+    """Compile a venues JSON file into a snapshot at `output`, indexing areas with the given ones.
+
+    With `only_stale`, a snapshot already compiled from the current file is kept.
+    Returns the number of venues compiled, or None if the snapshot was kept.
+    """
+    from venue_store import VenueSnapshot, _parse_venues, _read_file, source_version
+
+    if only_stale:
+        try:
+            current = read_snapshot(output, source_stat=os.stat(source))
+        except ValueError:
+            current = None
+        if current is not None and (neighborhoods is None or list(current.meta['area_names']) == list(neighborhoods)):
+            return None
+    stat, raw = _read_file(source)
+    if neighborhoods is None:
+        snapshot = VenueSnapshot(_parse_venues(raw), source_version(raw), stat.st_mtime)
+    else:
+        snapshot = VenueSnapshot(_parse_venues(raw), source_version(raw), stat.st_mtime, neighborhoods, aliases)
+    write_snapshot(snapshot, output, source_stat=stat)
+    logger.info(f"Compiled {len(snapshot)} venues into {output} ({os.path.getsize(output) // 1024} KiB)")
+    return len(snapshot)
+
+
+def main():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    default_source = os.path.join(project_root, 'data', 'happyhourstlv_enriched.json')
+    parser = argparse.ArgumentParser(
+        description="Compile the venues JSON into a binary snapshot the bot maps at startup")
+    parser.add_argument("source", nargs="?", default=default_source, help="venues JSON file")
+    parser.add_argument("-o", "--output", help="snapshot path (default: next to the JSON, .venues)")
+    parser.add_argument("--manifest", help="compile every city shard of this manifest instead, with its areas")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    if args.manifest:
+        from city_shards import CityManifest
+        # Each shard is indexed with its own city's areas
+        jobs = [(city.venues_file, city.compiled_file, city.neighborhoods, city.aliases)
+                for city in CityManifest.load(args.manifest)]
+    else:
+        jobs = [(args.source, args.output or default_output_path(args.source), None, None)]
+
+    for source, output, neighborhoods, aliases in jobs:
+        compile_venues(source, output, neighborhoods, aliases)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import logging
+import math
+import threading
+import time
+from array import array
+
+from metrics import CRAWL_PLANS, CRAWL_SEARCH_SECONDS
+from render_cache import LRUCache
+from schedule import MINUTES_PER_WEEK, minute_of_week
+from spatial_index import KM_PER_DEGREE, calculate_distance
+
+logger = logging.getLogger(__name__)
+
+# Stops in a crawl
+DEFAULT_STOPS = 3
+# Minutes spent at each stop
+DEFAULT_DWELL = 45
+# Walking speed in km/h
+WALK_KMH = 4.5
+# Longest walk between two stops, in km; also the neighbour radius of the distance matrix
+MAX_LEG_KM = 1.0
+# Minutes a crawl may wait outside for a happy hour to start
+MAX_WAIT = 15
+# A stop needs at least this many minutes of happy hour left on arrival
+MIN_STAY = 20
+# Nearest venues kept per matrix row, and feasible ones tried per stop
+NEIGHBOURS = 48
+BRANCHING = 6
+# Seconds the search may take before it returns the best crawl found so far
+SEARCH_BUDGET = 0.25
+# Matrix rows kept in memory
+MATRIX_ROWS = 20000
+# Matrices kept at once, one per dataset version (city shard)
+MATRICES = 4
+
+
+class CrawlStop:
+    """One venue of a crawl; times are minutes of the week (past the week's end when it wraps)"""
+
+    __slots__ = ('venue_id', 'leg_km', 'arrive', 'start', 'leave', 'ends')
+
+    def __init__(self, venue_id, leg_km, arrive, start, leave, ends):
+        self.venue_id = venue_id
+        self.leg_km = leg_km
+        self.arrive = arrive
+        self.start = start
+        self.leave = leave
+        # When the venue's happy hour ends
+        self.ends = ends
+
+
+def walk_minutes(km):
+    """Whole minutes to walk a distance"""
+    return math.ceil(km / WALK_KMH * 60)
+
+
+class Crawl:
+    """A planned crawl: its stops in order, total walk, and whether the search finished"""
+
+    __slots__ = ('stops', 'total_km', 'exhaustive')
+
+    def __init__(self, stops, total_km, exhaustive):
+        self.stops = stops
+        self.total_km = total_km
+        self.exhaustive = exhaustive
+
+    def __len__(self):
+        return len(self.stops)
+
+
+class NeighbourMatrix:
+    """Sparse venue-to-venue walking distances for one dataset version.
+
+    Row i holds the NEIGHBOURS venues closest to venue i within MAX_LEG_KM, nearest
+    first, as flat id and distance arrays. A row is computed on first use with one
+    batched spatial query (vectorized with NumPy when installed) and kept in an
+    LRU, so dense neighbourhoods pay for their rows once per dataset version.
+    Rows are shared by the planner's worker threads.
+    """
+
+    def __init__(self, snapshot, neighbours=NEIGHBOURS, max_km=MAX_LEG_KM, maxsize=MATRIX_ROWS):
+        self.version = snapshot.version
+        self.neighbours = neighbours
+        self.max_km = max_km
+        self._spatial = snapshot.spatial
+        self._lats = snapshot.columns.latitude
+        self._lons = snapshot.columns.longitude
+        self._rows = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def around(self, lat, lon):
+        """(ids, distances) of the venues nearest a point, nearest first"""
+        ids = array('i')
+        distances = array('f')
+        for distance, venue_id in self._spatial.nearest(lat, lon, self.neighbours, max_km=self.max_km):
+            ids.append(venue_id)
+            distances.append(distance)
+        return ids, distances
+
+    def carried(self, snapshot, points):
+        """This matrix for a patched snapshot, keeping the rows no moved venue can be in.
+
+        `points` are the old and new positions of venues added, removed or moved. A
+        row is kept if its venue stayed put and is over max_km from all of them.
+        """
+        matrix = NeighbourMatrix(snapshot, self.neighbours, self.max_km, self._rows.maxsize)
+        with self._lock:
+            rows = self._rows.items()
+        max_degrees = self.max_km / KM_PER_DEGREE
+        for venue_id, row in rows:
+            lat, lon = self._lats[venue_id], self._lons[venue_id]
+            if (lat, lon) != (matrix._lats[venue_id], matrix._lons[venue_id]):
+                continue
+            if any(abs(lat - point_lat) <= max_degrees
+                   and calculate_distance(lat, lon, point_lat, point_lon) <= self.max_km
+                   for point_lat, point_lon in points):
+                continue
+            matrix._rows.put(venue_id, row)
+        return matrix
+
+    def row(self, venue_id):
+        """(ids, distances) of a venue's neighbours, itself excluded"""
+        with self._lock:
+            row = self._rows.get(venue_id)
+        if row is None:
+            ids, distances = self.around(self._lats[venue_id], self._lons[venue_id])
+            keep = [pos for pos, other in enumerate(ids) if other != venue_id]
+            row = (array('i', (ids[pos] for pos in keep)), array('f', (distances[pos] for pos in keep)))
+            with self._lock:
+                self._rows.put(venue_id, row)
+        return row
+
+
+def happy_hour_window(intervals, minute, max_wait=MAX_WAIT, min_stay=MIN_STAY):
+    """(start, end) of the happy hour a visit arriving at `minute` can catch, or None.
+
+    The visit can wait up to max_wait minutes for it to start and needs at least
+    min_stay minutes of it left. Minutes keep counting past the end of the week.
+    """
+    offset = minute - minute % MINUTES_PER_WEEK
+    in_week = minute % MINUTES_PER_WEEK
+    for start, end in intervals:
+        for shift in (-MINUTES_PER_WEEK, 0, MINUTES_PER_WEEK):
+            if start + shift - max_wait <= in_week < end + shift - min_stay:
+                return offset + max(in_week, start + shift), offset + end + shift
+    return None
+
+
+class CrawlPlanner:
+    """Plans walks between venues that each reach a venue while its happy hour is on.
+
+    The search is a depth-first branch and bound over the neighbour matrix: from
+    each stop it tries the closest venues whose happy hour is still catchable on
+    arrival, keeps the crawl with the most stops and, among those, the shortest
+    walk, and cuts any branch that can no longer walk less than the best full
+    crawl. Once the time budget runs out it returns the best crawl found so far.
+    """
+
+    def __init__(self, stops=DEFAULT_STOPS, dwell=DEFAULT_DWELL, budget=SEARCH_BUDGET,
+                 branching=BRANCHING, neighbours=NEIGHBOURS, max_leg_km=MAX_LEG_KM):
+        self.stops = stops
+        self.dwell = dwell
+        self.budget = budget
+        self.branching = branching
+        self.neighbours = neighbours
+        self.max_leg_km = max_leg_km
+        self._matrices = LRUCache(MATRICES)
+        self._lock = threading.Lock()
+
+    def matrix(self, snapshot):
+        """The neighbour matrix of a snapshot, built on first use of each dataset version"""
+        with self._lock:
+            matrix = self._matrices.get(snapshot.version)
+            if matrix is None:
+                matrix = NeighbourMatrix(snapshot, self.neighbours, self.max_leg_km)
+                self._matrices.put(snapshot.version, matrix)
+        return matrix
+
+    def forget(self, version):
+        """Drop the matrix of a dataset version that is no longer served"""
+        with self._lock:
+            self._matrices.pop(version)
+
+    def carry(self, snapshot):
+        """Move the matrix of a patched snapshot's previous version over, minus the rows its diff affects"""
+        with self._lock:
+            matrix = self._matrices.pop(snapshot.diff.base_version)
+        if matrix is None:
+            return
+        matrix = matrix.carried(snapshot, snapshot.diff.points(moved_only=True))
+        with self._lock:
+            self._matrices.put(snapshot.version, matrix)
+
+    def plan(self, snapshot, lat, lon, when=None):
+        """Plan a crawl starting at a point at datetime `when` (now by default)"""
+        started = time.perf_counter()
+        matrix = self.matrix(snapshot)
+        intervals = snapshot.schedule.intervals
+        search = _Search(self, intervals, started + self.budget)
+        search.extend(matrix.around(lat, lon), minute_of_week(when), 0.0, matrix)
+
+        stops = [CrawlStop(*stop) for stop in search.best]
+        crawl = Crawl(stops, search.best_km, not search.out_of_time)
+        elapsed = time.perf_counter() - started
+        CRAWL_SEARCH_SECONDS.observe(elapsed)
+        CRAWL_PLANS.inc(stops=str(len(stops)), exhaustive=str(crawl.exhaustive).lower())
+        if search.out_of_time:
+            logger.info(f"Crawl search stopped after {elapsed * 1000:.0f} ms with {len(stops)} stops")
+        return crawl
+
+
+class _Search:
+    """State of one crawl search"""
+
+    def __init__(self, planner, intervals, deadline):
+        self.planner = planner
+        self.intervals = intervals
+        self.deadline = deadline
+        self.path = []
+        self.visited = set()
+        self.best = []
+        self.best_km = 0.0
+        self.out_of_time = False
+
+    def candidates(self, row, minute):
+        """Catchable (leg km, venue, arrival, start, leave, end) from a matrix row, nearest first"""
+        planner = self.planner
+        intervals = self.intervals
+        found = []
+        for venue_id, leg_km in zip(*row):
+            if venue_id in self.visited:
+                continue
+            schedule = intervals.get(venue_id)
+            if not schedule:
+                continue
+            arrive = minute + walk_minutes(leg_km)
+            window = happy_hour_window(schedule, arrive)
+            if window is None:
+                continue
+            start, end = window
+            found.append((float(leg_km), venue_id, arrive, start, start + planner.dwell, end))
+            if len(found) == planner.branching:
+                break
+        return found
+
+    def extend(self, row, minute, km, matrix):
+        path = self.path
+        stops = self.planner.stops
+        if len(path) > len(self.best) or (path and len(path) == len(self.best) and km < self.best_km):
+            self.best = list(path)
+            self.best_km = km
+        if len(path) == stops:
+            return
+        if time.perf_counter() > self.deadline:
+            self.out_of_time = True
+            return
+
+        for leg_km, venue_id, arrive, start, leave, end in self.candidates(row, minute):
+            if len(self.best) == stops and km + leg_km >= self.best_km:
+                # Candidates are nearest first, so no later one can do better either
+                break
+            path.append((venue_id, leg_km, arrive, start, leave, end))
+            self.visited.add(venue_id)
+            self.extend(matrix.row(venue_id), leave, km + leg_km, matrix)
+            self.visited.discard(venue_id)
+            path.pop()
+            if self.out_of_time:
+                return
@@ -0,0 +1,414 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import backoff
+import requests
+from bs4 import BeautifulSoup
+from fake_useragent import UserAgent
+from requests.adapters import HTTPAdapter
+
+from venue_model import VENUE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = os.path.join(PROJECT_ROOT, 'data', 'happyhourstlv_enriched.json')
+DEFAULT_CACHE_DIR = os.path.join(PROJECT_ROOT, 'data', 'cache')
+
+# Listing page to start from, and where addresses are geocoded
+LISTING_URL = os.getenv("INGEST_LISTING_URL")
+GEOCODER_URL = os.getenv("INGEST_GEOCODER_URL", "https://nominatim.openstreetmap.org/search")
+# Appended to addresses so the geocoder looks in the right city
+GEOCODE_SUFFIX = ", Tel Aviv, Israel"
+# Page requests per second per host; Nominatim's usage policy allows one per second
+FETCH_RATE = float(os.getenv("INGEST_RATE", "4"))
+GEOCODER_RATE = float(os.getenv("INGEST_GEOCODER_RATE", "1"))
+WORKERS = int(os.getenv("INGEST_WORKERS", "8"))
+# Cached pages younger than this are used without asking the server at all
+CACHE_MAX_AGE = float(os.getenv("INGEST_CACHE_MAX_AGE", str(6 * 3600)))
+REQUEST_TIMEOUT = 15
+MAX_TRIES = 5
+# Longest Retry-After we are willing to sleep for before giving up on a request
+MAX_RETRY_AFTER = 60
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# CSS selectors for listing and venue pages, tried in order. Venues marked up with
+# schema.org microdata work out of the box; other sites only need new selectors here.
+SELECTORS = {
+    'item': ['[itemtype$="BarOrPub"]', '[itemtype$="Restaurant"]', '.venue', '[data-venue]'],
+    'name': ['[itemprop="name"]', '.venue-name', 'h2', 'h3'],
+    'address': ['[itemprop="address"]', '.venue-address', 'address'],
+    'deal': ['.venue-deal', '.deal'],
+    'hours': ['[itemprop="openingHours"]', '.venue-hours', '.hours'],
+    'link': ['a.venue-link', 'a[itemprop="url"]', 'a[href]'],
+    'next': ['a[rel="next"]', 'link[rel="next"]', '.pagination .next a'],
+    'phone': ['[itemprop="telephone"]', 'a[href^="tel:"]', '.venue-phone'],
+    'website': ['a[itemprop="sameAs"]', 'a.venue-website', '.venue-website a'],
+    'latitude': ['[itemprop="latitude"]', '[data-lat]'],
+    'longitude': ['[itemprop="longitude"]', '[data-lng]', '[data-lon]'],
+    'vibe_en': ['.venue-vibe[lang="en"]', '.venue-vibe:not([lang])'],
+    'vibe_he': ['.venue-vibe[lang="he"]'],
+}
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+class RetryableHTTPError(requests.HTTPError):
+    """Server answered with a status worth retrying (rate limited or temporarily down)"""
+
+
+def write_atomic(path, data):
+    """Write bytes to path so readers see either the old or the new file, never a partial one"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.ingest-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class HostRateLimiter:
+    """Thread-safe spacing of requests per host, e.g. at most `rate` per second"""
+
+    def __init__(self, rate, overrides=None):
+        self.rate = rate
+        self.overrides = dict(overrides or {})
+        self._lock = threading.Lock()
+        self._next_at = {}
+
+    def wait(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        rate = self.overrides.get(host, self.rate)
+        if rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_at.get(host, now))
+            self._next_at[host] = slot + 1 / rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class DiskCache:
+    """JSON documents on disk keyed by (namespace, key), safe to share between threads"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, namespace, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, namespace, digest[:2], f"{digest}.json")
+
+    def get(self, namespace, key):
+        try:
+            with open(self._path(namespace, key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache entry for {key}: {str(e)}")
+            return None
+
+    def put(self, namespace, key, value):
+        write_atomic(self._path(namespace, key), json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+
+def _is_local(url):
+    return not url.startswith(('http://', 'https://'))
+
+
+def _log_backoff(details):
+    logger.warning(f"Retrying {details['args'][1]} in {details['wait']:.1f}s after: {details['exception']}")
+
+
+class Fetcher:
+    """Pooled, rate-limited HTTP client with retries and an on-disk response cache.
+
+    Cached pages younger than `max_age` are returned without a request; older ones
+    are revalidated with If-None-Match/If-Modified-Since, so a rerun only downloads
+    pages that changed. Local file paths are read directly, for fixtures.
+    """
+
+    def __init__(self, cache, limiter, workers=WORKERS, max_age=CACHE_MAX_AGE, user_agent=None):
+        self.cache = cache
+        self.limiter = limiter
+        self.max_age = max_age
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = user_agent or UserAgent().random
+        self.stats = {'fresh': 0, 'revalidated': 0, 'downloaded': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, outcome):
+        with self._stats_lock:
+            self.stats[outcome] += 1
+
+    @backoff.on_exception(
+        backoff.expo,
+        (requests.ConnectionError, requests.Timeout, RetryableHTTPError),
+        max_tries=MAX_TRIES,
+        jitter=backoff.full_jitter,
+        on_backoff=_log_backoff,
+    )
+    def _request(self, url, params, headers):
+        self.limiter.wait(url)
+        response = self.session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code in RETRYABLE_STATUS:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                time.sleep(min(int(retry_after), MAX_RETRY_AFTER))
+            raise RetryableHTTPError(f"{response.status_code} from {url}", response=response)
+        response.raise_for_status()
+        return response
+
+    def get_text(self, url, params=None, use_cache=True):
+        """Return the body of a page, from the cache when it is still current"""
+        if _is_local(url):
+            with open(url[len('file://'):] if url.startswith('file://') else url, 'r', encoding='utf-8') as f:
+                return f.read()
+
+        key = url if not params else f"{url}?{urllib.parse.urlencode(sorted(params.items()))}"
+        cached = self.cache.get('http', key) if use_cache else None
+        headers = {}
+        if cached is not None:
+            if time.time() - cached['fetched_at'] < self.max_age:
+                self._count('fresh')
+                return cached['body']
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self._request(url, params, headers)
+        if response.status_code == 304 and cached is not None:
+            self._count('revalidated')
+            cached['fetched_at'] = time.time()
+            self.cache.put('http', key, cached)
+            return cached['body']
+
+        self._count('downloaded')
+        body = response.text
+        if use_cache:
+            self.cache.put('http', key, {
+                'url': key,
+                'fetched_at': time.time(),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'body': body,
+            })
+        return body
+
+
+class Geocoder:
+    """Address -> (latitude, longitude) via a Nominatim-style search API, cached forever"""
+
+    def __init__(self, fetcher, url=GEOCODER_URL, suffix=GEOCODE_SUFFIX):
+        self.fetcher = fetcher
+        self.url = url
+        self.suffix = suffix
+
+    def locate(self, address):
+        key = _SPACE_RE.sub(' ', address).strip().casefold()
+        cached = self.fetcher.cache.get('geocode', key)
+        if cached is not None:
+            return tuple(cached['coords']) if cached['coords'] else None
+
+        params = {'q': f"{address}{self.suffix}", 'format': 'json', 'limit': '1'}
+        results = json.loads(self.fetcher.get_text(self.url, params=params, use_cache=False))
+        coords = None
+        if results:
+            coords = (round(float(results[0]['lat']), 7), round(float(results[0]['lon']), 7))
+        # Misses are cached too, so unknown addresses aren't looked up on every run
+        self.fetcher.cache.put('geocode', key, {'address': address, 'coords': coords})
+        return coords
+
+
+def _select(node, field):
+    """Return (element, text) for the first selector of `field` that matches"""
+    for selector in SELECTORS[field]:
+        element = node.select_one(selector)
+        if element is not None:
+            text = element.get('content') or element.get_text(' ', strip=True)
+            return element, _SPACE_RE.sub(' ', text).strip()
+    return None, ''
+
+
+def parse_listing(html, base_url):
+    """Return (venues, next page URL or None) from a listing page"""
+    soup = BeautifulSoup(html, 'html.parser')
+    items = []
+    for selector in SELECTORS['item']:
+        items = soup.select(selector)
+        if items:
+            break
+
+    venues = []
+    for item in items:
+        venue = {}
+        for field in ('name', 'address', 'deal', 'hours'):
+            _, text = _select(item, field)
+            if text:
+                venue[field] = text
+        if not venue.get('name'):
+            continue
+        link, _ = _select(item, 'link')
+        if link is not None and link.get('href'):
+            venue['url'] = urllib.parse.urljoin(base_url, link['href'])
+        venues.append(venue)
+
+    next_link, _ = _select(soup, 'next')
+    next_url = urllib.parse.urljoin(base_url, next_link['href']) if next_link is not None and next_link.get('href') else None
+    return venues, next_url
+
+
+def parse_details(html):
+    """Return the phone, website, coordinates and vibe found on a venue page"""
+    soup = BeautifulSoup(html, 'html.parser')
+    details = {}
+    element, phone = _select(soup, 'phone')
+    if element is not None and element.get('href', '').startswith('tel:'):
+        # The link text is often "Call us"; the number is in the href
+        phone = urllib.parse.unquote(element['href'][len('tel:'):]).strip()
+    if phone:
+        details['phone'] = phone
+    element, _ = _select(soup, 'website')
+    if element is not None and element.get('href'):
+        details['website'] = element['href']
+    for field, attributes in (('latitude', ('data-lat',)), ('longitude', ('data-lng', 'data-lon'))):
+        element, text = _select(soup, field)
+        if element is not None:
+            value = next((element.get(attr) for attr in attributes if element.get(attr)), text)
+            try:
+                details[field] = round(float(value), 7)
+            except ValueError:
+                pass
+    vibe = {}
+    for lang in ('en', 'he'):
+        _, text = _select(soup, f'vibe_{lang}')
+        if text:
+            vibe[lang] = text
+    if vibe:
+        details['vibe'] = vibe
+    return details
+
+
+def enrich_venue(venue, fetcher, geocoder):
+    """Fill in details from the venue's own page and coordinates from its address"""
+    venue = dict(venue)
+    url = venue.pop('url', None)
+    if url:
+        try:
+            for key, value in parse_details(fetcher.get_text(url)).items():
+                venue.setdefault(key, value)
+        except (requests.RequestException, OSError) as e:
+            logger.error(f"Could not fetch details for {venue['name']}: {str(e)}")
+    if not (venue.get('latitude') and venue.get('longitude')) and venue.get('address') and geocoder:
+        try:
+            coords = geocoder.locate(venue['address'])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.error(f"Could not geocode {venue['address']}: {str(e)}")
+            coords = None
+        if coords:
+            venue['latitude'], venue['longitude'] = coords
+    # Same key order as the hand-maintained file, so diffs between runs stay readable
+    ordered = {key: venue.pop(key) for key in VENUE_FIELDS if key in venue}
+    ordered.update(venue)
+    return ordered
+
+
+def crawl_listing(fetcher, listing_url, max_pages=100):
+    """Follow a listing and its next-page links, returning venues in page order"""
+    venues = []
+    seen = set()
+    url = listing_url
+    while url and url not in seen and len(seen) < max_pages:
+        seen.add(url)
+        page_venues, url = parse_listing(fetcher.get_text(url), url)
+        venues.extend(page_venues)
+    # The same venue can appear on several pages; keep the first listing
+    unique = {}
+    for venue in venues:
+        unique.setdefault((venue['name'].casefold(), venue.get('address', '').casefold()), venue)
+    return list(unique.values())
+
+
+def ingest(listing_url, fetcher, geocoder, workers=WORKERS):
+    """Crawl the listing and enrich every venue concurrently, preserving listing order"""
+    venues = crawl_listing(fetcher, listing_url)
+    logger.info(f"Found {len(venues)} venues, enriching with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda venue: enrich_venue(venue, fetcher, geocoder), venues))
+
+
+def write_venues(path, venues):
+    """Atomically write the venues JSON; returns False if the file was already identical"""
+    data = json.dumps(venues, ensure_ascii=False, indent=4).encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    write_atomic(path, data)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape and enrich the happy hour venue listing")
+    parser.add_argument("listing", nargs="?", default=LISTING_URL,
+                        help="listing page URL or local HTML file (default: $INGEST_LISTING_URL)")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="venues JSON to write")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="HTTP and geocoding cache")
+    parser.add_argument("--geocoder-url", default=GEOCODER_URL)
+    parser.add_argument("--no-geocode", action="store_true", help="skip looking up missing coordinates")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--rate", type=float, default=FETCH_RATE, help="page requests per second per host")
+    parser.add_argument("--geocoder-rate", type=float, default=GEOCODER_RATE)
+    parser.add_argument("--max-age", type=float, default=CACHE_MAX_AGE,
+                        help="seconds a cached page is used without revalidating")
+    parser.add_argument("--compile", action="store_true", help="also write the compiled snapshot")
+    args = parser.parse_args()
+    if not args.listing:
+        parser.error("no listing URL given (argument or INGEST_LISTING_URL)")
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    geocoder_host = urllib.parse.urlsplit(args.geocoder_url).netloc
+    limiter = HostRateLimiter(args.rate, overrides={geocoder_host: args.geocoder_rate})
+    fetcher = Fetcher(DiskCache(args.cache_dir), limiter, workers=args.workers, max_age=args.max_age)
+    geocoder = None if args.no_geocode else Geocoder(fetcher, args.geocoder_url)
+
+    started = time.perf_counter()
+    venues = ingest(args.listing, fetcher, geocoder, workers=args.workers)
+    changed = write_venues(args.output, venues)
+    located = sum(1 for venue in venues if venue.get('latitude') and venue.get('longitude'))
+    logger.info(
+        f"{len(venues)} venues ({located} with coordinates) in {time.perf_counter() - started:.1f}s; "
+        f"pages: {fetcher.stats['downloaded']} downloaded, {fetcher.stats['revalidated']} unchanged, "
+        f"{fetcher.stats['fresh']} from cache; {args.output} {'updated' if changed else 'unchanged'}"
+    )
+
+    if args.compile:
+        from compiled_venues import compile_venues, default_output_path
+        compile_venues(args.output, default_output_path(args.output))
+
+
+if __name__ == "__main__":
+    main()
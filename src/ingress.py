@@ -0,0 +1,375 @@
+"""Webhook ingress spreading updates over several bot worker processes.
+
+Telegram posts every update to a single webhook, and one bot process only uses
+one CPU core. In multi-worker mode the main process runs just this ingress: it
+answers Telegram, picks each update's worker by consistent hashing of its chat
+(the user for inline queries) and forwards it over HTTP on localhost. Each
+worker is a full bot process serving its own shard of chats, so a chat's
+updates, ConversationHandler state and user_data always live on one worker, and
+a worker that crashes is restarted while the others carry on.
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import signal
+import time
+
+import httpx
+
+from metrics import INGRESS_FORWARD_SECONDS, INGRESS_QUEUED, INGRESS_UPDATES, REGISTRY, WORKER_RESTARTS
+
+logger = logging.getLogger(__name__)
+
+# Points each worker gets on the hash ring; more points spread chats more evenly
+RING_REPLICAS = 128
+# Updates kept per worker while it is busy or restarting; beyond that Telegram is
+# asked to deliver them again later
+DEFAULT_QUEUE_SIZE = 10000
+# Most updates handed to a worker in one request
+FORWARD_BATCH = 100
+# Seconds between attempts to reach a worker that is down, doubling up to the max
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+# A worker that exits is started again after this many seconds, doubling up to
+# the max while it keeps exiting within STABLE_RUN seconds of its start
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+STABLE_RUN = 60.0
+# Seconds workers get to finish their updates and write their state on shutdown
+STOP_TIMEOUT = 30.0
+
+# Header carrying the ingress' per-run secret, so only it can feed the workers
+WORKER_SECRET_HEADER = 'X-Worker-Secret'
+# Path workers receive forwarded updates on
+WORKER_PATH = '/updates'
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 503: 'Service Unavailable'}
+
+
+def _hash(text):
+    """64-bit hash that stays the same across processes, unlike hash()"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def update_shard_key(update):
+    """The chat (else user) id a raw update is routed on, or None.
+
+    Mirrors update_processor.update_chat_key on the JSON Telegram sends, so a
+    chat's updates reach the worker that serializes them.
+    """
+    for field, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat')
+        if chat is None and isinstance(value.get('message'), dict):
+            # A callback query belongs to the chat of the message its button is on
+            chat = value['message'].get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+    return None
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes, each placed at `replicas` points of a 64-bit ring.
+
+    A key belongs to the first node point at or after its hash. Changing the
+    number of nodes only moves the keys next to the added or removed points, so
+    going from N to N+1 workers reassigns about 1/(N+1) of the chats.
+    """
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = sorted((_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas))
+        if not points:
+            raise ValueError("a hash ring needs at least one node")
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        """The node a key (any value with a stable str()) belongs to"""
+        pos = bisect.bisect_left(self._hashes, _hash(str(key)))
+        return self._nodes[pos % len(self._nodes)]
+
+
+class _HTTPServer:
+    """Minimal HTTP/1.1 server on keep-alive connections, answering each request with a bare status.
+
+    `handle(method, path, headers, body)` returns the status code.
+    """
+
+    def __init__(self, handle):
+        self._handle = handle
+        self._server = None
+        self._connections = set()
+        self._handlers = set()
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._serve, host, port)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        # Idle keep-alive connections would otherwise be cancelled at exit
+        for writer in list(self._connections):
+            writer.close()
+        if self._handlers:
+            await asyncio.wait(list(self._handlers), timeout=1)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader, writer):
+        self._connections.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+
+                status = await self._handle(method, target.split('?')[0], headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+                    f"Content-Length: 0\r\n\r\n".encode('latin-1')
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+
+class UpdateReceiver:
+    """The worker's end: a local HTTP server taking batches of updates from the ingress.
+
+    `deliver` gets the list of update dicts of each request and must return
+    without waiting on their handling, e.g. by putting them on a queue.
+    """
+
+    def __init__(self, host, port, secret, deliver):
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.deliver = deliver
+        self._server = _HTTPServer(self._handle)
+
+    async def start(self):
+        await self._server.start(self.host, self.port)
+        logger.info(f"Receiving updates from the ingress on {self.host}:{self.port}")
+
+    async def stop(self):
+        await self._server.stop()
+
+    async def _handle(self, method, path, headers, body):
+        if method != 'POST' or path != WORKER_PATH:
+            return 404
+        if headers.get(WORKER_SECRET_HEADER.lower()) != self.secret:
+            return 403
+        try:
+            updates = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return 400
+        if not isinstance(updates, list):
+            return 400
+        self.deliver(updates)
+        return 200
+
+
+class Worker:
+    """One worker process, restarted whenever it exits, and the updates on their way to it"""
+
+    def __init__(self, index, command, env, port, secret, queue_size=DEFAULT_QUEUE_SIZE):
+        self.index = index
+        self.command = command
+        self.env = env
+        self.url = f"http://127.0.0.1:{port}{WORKER_PATH}"
+        self.secret = secret
+        self.queue = asyncio.Queue(queue_size)
+        self.process = None
+        self.stopping = False
+
+    def offer(self, update):
+        """Queue an update for the worker; False if its queue is full"""
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def supervise(self):
+        """Run the worker process, starting it again whenever it exits, until stopped"""
+        delay = RESTART_DELAY
+        while not self.stopping:
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(*self.command, env=self.env)
+            logger.info(f"Started worker {self.index} (pid {self.process.pid})")
+            returncode = await self.process.wait()
+            if self.stopping:
+                return
+            if time.monotonic() - started >= STABLE_RUN:
+                delay = RESTART_DELAY
+            logger.error(f"Worker {self.index} exited with code {returncode}, restarting in {delay:.0f} s")
+            WORKER_RESTARTS.inc(worker=self.index)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def _post(self, client, updates):
+        """Hand updates to the worker; True once it accepted them"""
+        try:
+            response = await client.post(self.url, json=updates, headers={WORKER_SECRET_HEADER: self.secret})
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    async def wait_ready(self, client):
+        """Wait until the worker accepts updates"""
+        delay = RETRY_DELAY
+        while not await self._post(client, []):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    async def forward(self, client):
+        """Send queued updates to the worker in batches, in order, forever.
+
+        A batch the worker doesn't take (it's down or restarting) is retried
+        until it does; only this worker's queue backs up meanwhile.
+        """
+        queue = self.queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < FORWARD_BATCH and not queue.empty():
+                batch.append(queue.get_nowait())
+            start = time.perf_counter()
+            delay = RETRY_DELAY
+            while not await self._post(client, batch):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            INGRESS_FORWARD_SECONDS.observe(time.perf_counter() - start, worker=self.index)
+            for _ in batch:
+                queue.task_done()
+
+    async def drain(self):
+        """Wait until every queued update reached the worker, or the worker exited"""
+        process = self.process
+        if process is None or process.returncode is not None:
+            return
+        joined = asyncio.ensure_future(self.queue.join())
+        exited = asyncio.ensure_future(process.wait())
+        try:
+            await asyncio.wait({joined, exited}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            joined.cancel()
+            exited.cancel()
+
+    async def stop(self):
+        """Ask the worker to shut down, killing it if it takes longer than STOP_TIMEOUT"""
+        process = self.process
+        if process is None or process.returncode is not None:
+            return
+        process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Worker {self.index} didn't stop in {STOP_TIMEOUT:.0f} s, killing it")
+            process.kill()
+            await process.wait()
+
+
+class Ingress:
+    """Telegram webhook endpoint routing updates to a fixed set of workers.
+
+    `worker_env(index)` gives each worker's extra environment on top of the
+    ingress' own; worker i is expected to serve UpdateReceiver on
+    127.0.0.1:base_port+i with the secret passed in WORKER_SECRET.
+    """
+
+    def __init__(self, count, command, worker_env, base_port, secret, listen, port, path,
+                 secret_token, queue_size=DEFAULT_QUEUE_SIZE):
+        self.workers = [
+            Worker(index, command, dict(os.environ, WORKER_SECRET=secret, **worker_env(index)),
+                   base_port + index, secret, queue_size)
+            for index in range(count)
+        ]
+        self.ring = HashRing(range(count))
+        self.listen = listen
+        self.port = port
+        self.path = '/' + path.strip('/')
+        self.secret_token = secret_token
+        self._server = _HTTPServer(self._handle)
+        self._tasks = []
+        REGISTRY.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        for worker in self.workers:
+            INGRESS_QUEUED.set(worker.queue.qsize(), worker=worker.index)
+
+    def worker_for(self, update):
+        """The worker serving an update's chat; updates without one are spread by update_id"""
+        key = update_shard_key(update)
+        if key is None:
+            key = f"update:{update.get('update_id')}"
+        return self.workers[self.ring.node(key)]
+
+    async def _handle(self, method, path, headers, body):
+        if method != 'POST' or path != self.path:
+            return 404
+        if headers.get('x-telegram-bot-api-secret-token') != self.secret_token:
+            return 403
+        try:
+            update = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return 400
+        if not isinstance(update, dict):
+            return 400
+        worker = self.worker_for(update)
+        if not worker.offer(update):
+            # Telegram retries a failed delivery, by which time the worker may have caught up
+            INGRESS_UPDATES.inc(worker=worker.index, result='full')
+            return 503
+        INGRESS_UPDATES.inc(worker=worker.index, result='queued')
+        return 200
+
+    async def start(self, client):
+        """Start the workers and wait for all of them before accepting webhook calls"""
+        for worker in self.workers:
+            self._tasks.append(asyncio.create_task(worker.supervise()))
+        await asyncio.gather(*(worker.wait_ready(client) for worker in self.workers))
+        for worker in self.workers:
+            self._tasks.append(asyncio.create_task(worker.forward(client)))
+        await self._server.start(self.listen, self.port)
+        logger.info(f"Routing updates from {self.listen}:{self.port}{self.path} to {len(self.workers)} workers")
+
+    async def stop(self):
+        """Stop taking updates, hand over the queued ones and shut the workers down"""
+        for worker in self.workers:
+            # Workers that got the same signal and exit aren't restarted
+            worker.stopping = True
+        await self._server.stop()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(worker.drain() for worker in self.workers)), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            left = sum(worker.queue.qsize() for worker in self.workers)
+            logger.warning(f"Stopping with {left} updates not handed to workers")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import math
+import time
+
+from metrics import LIVE_LOCATION_REFRESHES, LIVE_LOCATION_SESSIONS, LIVE_LOCATION_UPDATES
+from spatial_index import calculate_distance
+
+logger = logging.getLogger(__name__)
+
+# Movement in km below which a live location update doesn't trigger a new search
+MIN_MOVE_KM = 0.05
+# Shortest time in seconds between two refreshes of the same "near you" message
+MIN_REFRESH_INTERVAL = 10.0
+# Live locations followed at once; expired and then the oldest ones are dropped beyond this
+MAX_SESSIONS = 10000
+# Telegram's live_period value for a location shared "until I turn it off"
+INDEFINITE_LIVE_PERIOD = 0x7FFFFFFF
+
+
+class LiveSession:
+    """One shared live location and the bot message listing venues near it"""
+
+    __slots__ = (
+        'bot', 'chat_id', 'message_id', 'radius', 'lang', 'expires_at',
+        'lat', 'lon', 'cell', 'version', 'pending', 'task', 'last_refresh',
+    )
+
+    def __init__(self, bot, chat_id, message_id, radius, lang, expires_at, lat, lon, cell, version):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.radius = radius
+        self.lang = lang
+        self.expires_at = expires_at
+        # Where the message's results were last computed
+        self.lat = lat
+        self.lon = lon
+        self.cell = cell
+        self.version = version
+        # Newest (lat, lon, cell, version) waiting for the debounce delay
+        self.pending = None
+        self.task = None
+        self.last_refresh = time.monotonic()
+
+
+class LiveLocationTracker:
+    """Keeps "near you" messages current while users share a live location.
+
+    Telegram sends a live location as a stream of edits to the original message.
+    Each edit is checked against where the results were last computed: unless the
+    user moved at least `min_move_km`, entered another spatial-index cell or the
+    venue data changed, it costs nothing. Accepted moves are debounced per session:
+    the newest position is refreshed at most once every `min_interval` seconds, and
+    positions arriving in between replace each other, so a crowd of walking users
+    produces a bounded number of searches and message edits.
+    """
+
+    def __init__(self, refresh, min_move_km=MIN_MOVE_KM, min_interval=MIN_REFRESH_INTERVAL,
+                 max_sessions=MAX_SESSIONS):
+        # async refresh(session): recompute the results and edit the message
+        self._refresh = refresh
+        self.min_move_km = min_move_km
+        self.min_interval = min_interval
+        self.max_sessions = max_sessions
+        self._sessions = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def expiry(sent_at, live_period):
+        """Wall-clock time a live location stops updating"""
+        if live_period >= INDEFINITE_LIVE_PERIOD:
+            return math.inf
+        return sent_at + live_period
+
+    def start(self, key, session):
+        """Follow a live location identified by `key` (chat id, location message id)"""
+        self.stop(key)
+        if len(self._sessions) >= self.max_sessions:
+            self._evict()
+        self._sessions[key] = session
+        LIVE_LOCATION_SESSIONS.set(len(self._sessions))
+
+    def stop(self, key):
+        """Stop following a live location and cancel its pending refresh"""
+        session = self._sessions.pop(key, None)
+        if session is not None and session.task is not None and not session.task.done():
+            session.task.cancel()
+        LIVE_LOCATION_SESSIONS.set(len(self._sessions))
+        return session
+
+    def _evict(self):
+        now = time.time()
+        for key in [key for key, session in self._sessions.items() if session.expires_at <= now]:
+            self.stop(key)
+        while len(self._sessions) >= self.max_sessions:
+            self.stop(next(iter(self._sessions)))
+
+    def _moved(self, session, lat, lon, cell, version):
+        if cell != session.cell or version != session.version:
+            return True
+        return calculate_distance(session.lat, session.lon, lat, lon) >= self.min_move_km
+
+    def move(self, key, lat, lon, cell, version):
+        """Record a new position; returns 'unknown', 'expired', 'unchanged' or 'scheduled'"""
+        outcome = self._move(key, lat, lon, cell, version)
+        LIVE_LOCATION_UPDATES.inc(outcome=outcome)
+        return outcome
+
+    def _move(self, key, lat, lon, cell, version):
+        session = self._sessions.get(key)
+        if session is None:
+            return 'unknown'
+        if time.time() >= session.expires_at:
+            self.stop(key)
+            return 'expired'
+        if not self._moved(session, lat, lon, cell, version):
+            # A pending refresh stays on its newest position; a step back doesn't cancel it
+            return 'unchanged'
+
+        session.pending = (lat, lon, cell, version)
+        if session.task is None or session.task.done():
+            delay = max(0.0, session.last_refresh + self.min_interval - time.monotonic())
+            session.task = asyncio.ensure_future(self._flush(key, session, delay))
+        return 'scheduled'
+
+    async def _flush(self, key, session, delay):
+        """Refresh a session with its newest position once the debounce delay has passed"""
+        while session.pending is not None:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._sessions.get(key) is not session:
+                return
+            session.lat, session.lon, session.cell, session.version = session.pending
+            session.pending = None
+            session.last_refresh = time.monotonic()
+            LIVE_LOCATION_REFRESHES.inc()
+            try:
+                await self._refresh(session)
+            except Exception as e:
+                logger.error(f"Error refreshing live location results: {str(e)}")
+            # Moves that arrived during the refresh wait a full interval
+            delay = self.min_interval
+
+    async def shutdown(self):
+        """Cancel every pending refresh"""
+        for key in list(self._sessions):
+            self.stop(key)
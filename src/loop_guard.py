@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import ACTIVE_HANDLERS, LOOP_STALLS, OFFLOAD_PENDING, OFFLOAD_SECONDS, OFFLOAD_TASKS
+
+logger = logging.getLogger(__name__)
+
+# Worker threads for blocking steps
+DEFAULT_WORKERS = 4
+# Steps queued or running at once before new ones are refused
+DEFAULT_MAX_PENDING = 64
+# Seconds a handler waits for a blocking step before giving up on it
+DEFAULT_TIMEOUT = 5.0
+# The watchdog reports the loop as stalled after this many seconds without a heartbeat
+DEFAULT_STALL_THRESHOLD = 0.5
+# Seconds between heartbeats (and watchdog checks)
+DEFAULT_HEARTBEAT_INTERVAL = 0.1
+
+
+class OffloadRejected(Exception):
+    """The pool's queue is full; the caller should fail fast instead of piling up"""
+
+
+class OffloadTimeout(Exception):
+    """A blocking step didn't finish within the pool's timeout"""
+
+
+class BlockingPool:
+    """Runs the blocking and CPU-heavy steps of handlers off the event loop.
+
+    Steps are plain functions run in a thread pool, so they can read the shared
+    venue snapshot without copying it. At most `max_pending` steps are queued or
+    running; beyond that `run` raises OffloadRejected right away rather than
+    letting a backlog build up behind a slow step. A caller waits at most
+    `timeout` seconds. A step that timed out keeps its slot until its thread
+    finishes, because a thread can't be interrupted, so the bound stays honest.
+    """
+
+    def __init__(self, name, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 timeout=DEFAULT_TIMEOUT):
+        self.name = name
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-pool")
+        self._pending = 0
+
+    def __len__(self):
+        return self._pending
+
+    def _release(self, future):
+        self._pending -= 1
+        OFFLOAD_PENDING.set(self._pending, pool=self.name)
+
+    async def run(self, func, *args):
+        """Run func(*args) in a worker thread and return its result"""
+        if self._pending >= self.max_pending:
+            OFFLOAD_TASKS.inc(pool=self.name, outcome='rejected')
+            raise OffloadRejected(f"{self.name} pool has {self._pending} steps pending")
+        self._pending += 1
+        OFFLOAD_PENDING.set(self._pending, pool=self.name)
+        future = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        future.add_done_callback(self._release)
+
+        start = time.perf_counter()
+        outcome = 'done'
+        try:
+            # shield: a timed-out caller stops waiting but the step still completes
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise OffloadTimeout(f"{getattr(func, '__name__', func)} took over {self.timeout}s") from None
+        except Exception:
+            outcome = 'failed'
+            raise
+        finally:
+            OFFLOAD_SECONDS.observe(time.perf_counter() - start, pool=self.name)
+            OFFLOAD_TASKS.inc(pool=self.name, outcome=outcome)
+
+    def shutdown(self):
+        """Stop accepting steps; running ones finish in the background"""
+        self._executor.shutdown(wait=False)
+
+
+class LoopWatchdog:
+    """Logs what is blocking the event loop while it's blocked.
+
+    A task on the loop records a heartbeat every `interval` seconds and a daemon
+    thread checks it. When the heartbeat is older than `threshold`, the thread
+    logs the loop thread's current stack and the instrumented handler running in
+    the current task, once per stall. Unlike the lag histogram, which only learns
+    about a stall after it ended, this catches the code responsible in the act.
+    """
+
+    def __init__(self, threshold=DEFAULT_STALL_THRESHOLD, interval=DEFAULT_HEARTBEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._loop = None
+        self._loop_thread = None
+        self._heartbeat = time.monotonic()
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start watching the running loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def _beat(self):
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat
+            if stalled < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            self._report(stalled)
+
+    def _report(self, stalled):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(no frame)\n'
+        task = asyncio.current_task(self._loop)
+        handler = ACTIVE_HANDLERS.get(task)
+        where = handler or (task.get_name() if task is not None else 'a loop callback')
+        LOOP_STALLS.inc(handler=handler or 'none')
+        logger.warning(f"Event loop blocked for {stalled:.2f}s in {where}:\n{stack.rstrip()}")
+
+    async def stop(self):
+        """Stop the heartbeat and the watchdog thread"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,317 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond handlers to slow reloads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    body = ','.join(f'{key}="{str(value)}"'.replace('\n', ' ') for key, value in items)
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        """Return the metric in Prometheus text exposition format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            samples = list(self._samples())
+        for suffix, labels, value in samples:
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield '', _format_labels(key), value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a running total kept elsewhere (e.g. a cache's hit count)"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Cumulative bucketed distribution of observations"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def _samples(self):
+        for key, (counts, count, total) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', _format_labels(key, ('le', _format_value(bound))), cumulative
+            yield '_bucket', _format_labels(key, ('le', '+Inf')), count
+            yield '_sum', _format_labels(key), total
+            yield '_count', _format_labels(key), count
+
+
+class Registry:
+    """Collection of metrics plus callbacks that refresh gauges at scrape time"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, buckets))
+
+    def add_collector(self, collector):
+        """Register a zero-arg callable run before every scrape"""
+        self._collectors.append(collector)
+
+    def render(self):
+        """Return every metric in Prometheus text exposition format"""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Error in metrics collector: {str(e)}")
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry shared by the bot's modules
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    'happyhour_handler_latency_seconds', 'Time spent in each update handler')
+HANDLER_ERRORS = REGISTRY.counter(
+    'happyhour_handler_errors_total', 'Exceptions raised by update handlers')
+VENUE_LOAD_SECONDS = REGISTRY.histogram(
+    'happyhour_venue_load_seconds', 'Time to read, parse and index the venues file')
+VENUE_CHANGES = REGISTRY.counter(
+    'happyhour_venue_changes_total', 'Venues added, removed or changed by incremental reloads')
+VENUE_COUNT = REGISTRY.gauge(
+    'happyhour_venues', 'Venues in the current snapshot of each loaded city')
+VENUE_SHARDS_LOADED = REGISTRY.gauge(
+    'happyhour_venue_shards_loaded', 'City shards currently held in memory')
+VENUE_SHARD_BYTES = REGISTRY.gauge(
+    'happyhour_venue_shard_bytes', 'Estimated memory held by the loaded city shards')
+VENUE_SHARD_EVICTIONS = REGISTRY.counter(
+    'happyhour_venue_shard_evictions_total', 'City shards dropped to stay under the memory cap')
+RENDER_CACHE_HITS = REGISTRY.counter(
+    'happyhour_render_cache_hits_total', 'Rendered card/page cache hits')
+RENDER_CACHE_MISSES = REGISTRY.counter(
+    'happyhour_render_cache_misses_total', 'Rendered card/page cache misses')
+RENDER_CACHE_ENTRIES = REGISTRY.gauge(
+    'happyhour_render_cache_entries', 'Rendered cards/pages currently cached')
+LOOP_LAG = REGISTRY.histogram(
+    'happyhour_event_loop_lag_seconds', 'How late the event loop woke up a sleeping task',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+LOOP_LAG_MAX = REGISTRY.gauge(
+    'happyhour_event_loop_lag_max_seconds', 'Largest event loop lag since the last scrape')
+OUTBOUND_WAIT_SECONDS = REGISTRY.histogram(
+    'happyhour_outbound_wait_seconds', 'Time Bot API requests waited for rate limit budget')
+OUTBOUND_RETRIES = REGISTRY.counter(
+    'happyhour_outbound_retries_total', 'Bot API requests retried after flood control')
+OUTBOUND_DROPPED_EDITS = REGISTRY.counter(
+    'happyhour_outbound_dropped_edits_total', 'Message edits answered without calling the Bot API')
+LIVE_LOCATION_UPDATES = REGISTRY.counter(
+    'happyhour_live_location_updates_total', 'Live location updates by outcome (unchanged, scheduled, ...)')
+LIVE_LOCATION_REFRESHES = REGISTRY.counter(
+    'happyhour_live_location_refreshes_total', 'Nearby results recomputed for a moving live location')
+LIVE_LOCATION_SESSIONS = REGISTRY.gauge(
+    'happyhour_live_location_sessions', 'Live locations currently followed')
+NOTIFICATION_SUBSCRIPTIONS = REGISTRY.gauge(
+    'happyhour_notification_subscriptions', 'Happy hour start subscriptions')
+NOTIFICATION_EVENTS = REGISTRY.counter(
+    'happyhour_notification_events_total', 'Happy hour starts processed by the notifier')
+NOTIFICATIONS_SENT = REGISTRY.counter(
+    'happyhour_notifications_total', 'Happy hour start notifications by result (sent, blocked, failed, late)')
+POPULARITY_EVENTS = REGISTRY.counter(
+    'happyhour_popularity_events_total', 'Venue views and clicks counted for the popular list')
+OFFLOAD_TASKS = REGISTRY.counter(
+    'happyhour_offload_tasks_total', 'Blocking steps sent to a worker pool by outcome (done, failed, timeout, rejected)')
+OFFLOAD_SECONDS = REGISTRY.histogram(
+    'happyhour_offload_seconds', 'Time from submitting a blocking step to its result, queueing included')
+OFFLOAD_PENDING = REGISTRY.gauge(
+    'happyhour_offload_pending', 'Blocking steps queued or running in a worker pool')
+CRAWL_PLANS = REGISTRY.counter(
+    'happyhour_crawl_plans_total', 'Crawls planned, by number of stops and whether the search finished in budget')
+CRAWL_SEARCH_SECONDS = REGISTRY.histogram(
+    'happyhour_crawl_search_seconds', 'Time spent searching for a crawl')
+LOOP_STALLS = REGISTRY.counter(
+    'happyhour_event_loop_stalls_total', 'Event loop stalls longer than the watchdog threshold, by handler')
+INGRESS_UPDATES = REGISTRY.counter(
+    'happyhour_ingress_updates_total', 'Webhook updates received by the ingress, by worker and result (queued, full)')
+INGRESS_FORWARD_SECONDS = REGISTRY.histogram(
+    'happyhour_ingress_forward_seconds', 'Time to hand a batch of updates to a worker, retries included')
+INGRESS_QUEUED = REGISTRY.gauge(
+    'happyhour_ingress_queued_updates', 'Updates waiting in the ingress for each worker')
+WORKER_RESTARTS = REGISTRY.counter(
+    'happyhour_worker_restarts_total', 'Worker processes started again after exiting, by worker')
+
+# Handler name of each task currently inside an instrumented handler, so the
+# loop watchdog can name what is blocking the loop
+ACTIVE_HANDLERS = {}
+
+
+def instrumented(handler, branch=None):
+    """Decorator recording latency and errors of an async handler.
+
+    `branch` optionally maps the handler's (update, context) arguments to an extra
+    low-cardinality label, e.g. which menu button was pressed.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            labels = {'handler': handler}
+            if branch is not None:
+                labels['branch'] = branch(update)
+            task = asyncio.current_task()
+            outer = ACTIVE_HANDLERS.get(task)
+            ACTIVE_HANDLERS[task] = handler
+            start = time.perf_counter()
+            try:
+                return await func(update, context, *args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(**labels)
+                raise
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - start, **labels)
+                if outer is None:
+                    ACTIVE_HANDLERS.pop(task, None)
+                else:
+                    ACTIVE_HANDLERS[task] = outer
+        return wrapper
+    return decorator
+
+
+async def monitor_loop_lag(interval=0.25):
+    """Measure how late the event loop resumes a sleeper, forever"""
+    loop = asyncio.get_running_loop()
+    worst = [0.0]
+
+    def publish_max():
+        LOOP_LAG_MAX.set(worst[0])
+        worst[0] = 0.0
+
+    REGISTRY.add_collector(publish_max)
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.observe(lag)
+        worst[0] = max(worst[0], lag)
+
+
+class MetricsServer:
+    """Tiny HTTP server exposing the registry at /metrics"""
+
+    def __init__(self, host, port, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; the body (if any) is ignored
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status, body, content_type = '404 Not Found', b'not found\n', 'text/plain'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"Metrics request failed: {str(e)}")
+        finally:
+            writer.close()
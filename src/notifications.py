@@ -0,0 +1,356 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+
+from apscheduler.jobstores.base import JobLookupError
+from telegram.error import Forbidden, TelegramError
+
+from area_index import area_key
+from metrics import NOTIFICATION_EVENTS, NOTIFICATION_SUBSCRIPTIONS, NOTIFICATIONS_SENT
+from pagination import KIND_CODES
+from rate_limiter import TokenBucket
+from schedule import TIMEZONE
+from spatial_index import SpatialIndex
+
+logger = logging.getLogger(__name__)
+
+# Subscriptions one user may keep
+MAX_SUBSCRIPTIONS = 10
+# Venues listed in one notification; a chat matching more just gets "and more"
+MAX_LISTED = 5
+# Start events are precomputed this many minutes ahead
+HORIZON_MINUTES = 24 * 60
+# Even with nothing due the scheduler wakes up this often to pick up reloaded data
+CHECK_INTERVAL = 300
+# Notifications sent per second; the rest of the global budget stays free for replies
+SEND_RATE = 20
+# Chats handed to the bot at once while fanning out an event
+SEND_BATCH = 100
+# Notifications still unsent this long after the start are dropped
+MAX_DELAY = 15 * 60
+# "Near" subscriptions are rounded to ~100m so nearby users share one lookup
+POINT_DECIMALS = 3
+
+SUBSCRIBE_PREFIX = "sub"
+UNSUBSCRIBE_PREFIX = "unsub"
+_SEPARATOR = "|"
+_CODE_KINDS = {code: kind for kind, code in KIND_CODES.items()}
+
+
+def encode_subscription(prefix, kind, params):
+    """Pack a subscription into callback_data, e.g. sub|a|florentin"""
+    return _SEPARATOR.join((prefix, KIND_CODES[kind]) + tuple(params))
+
+
+def decode_subscription(data):
+    """Return (kind, params) from subscribe/unsubscribe callback_data; raises ValueError if malformed"""
+    fields = data.split(_SEPARATOR)
+    if len(fields) < 3 or fields[0] not in (SUBSCRIBE_PREFIX, UNSUBSCRIBE_PREFIX) or fields[1] not in _CODE_KINDS:
+        raise ValueError(f"not a subscription: {data}")
+    kind = _CODE_KINDS[fields[1]]
+    params = tuple(fields[2:])
+    if kind == "near":
+        if len(params) != 3:
+            raise ValueError(f"bad location subscription: {data}")
+        lat, lon, radius = (float(value) for value in params)
+        params = (f"{lat:.{POINT_DECIMALS}f}", f"{lon:.{POINT_DECIMALS}f}", f"{radius:g}")
+    elif len(params) != 1:
+        raise ValueError(f"bad subscription: {data}")
+    return kind, params
+
+
+def venue_list(venue_lists, limit=MAX_LISTED):
+    """Merge the venue lists matched for one chat into (first `limit` ids, whether there are more)"""
+    seen = set()
+    ids = []
+    for venues in venue_lists:
+        for idx in venues:
+            if idx not in seen:
+                if len(ids) == limit:
+                    return ids, True
+                seen.add(idx)
+                ids.append(idx)
+    return ids, False
+
+
+class SubscriptionIndex:
+    """Subscribers grouped by what they asked for: an area, a vibe or a point and radius.
+
+    Matching works per group rather than per user: the venues starting at a given
+    time are bucketed by area and vibe, and each (point, radius) group does one
+    nearest-venue lookup, so the work grows with the number of distinct groups and
+    the chats notified, not with venues times subscribers.
+    """
+
+    def __init__(self):
+        self._areas = {}
+        self._vibes = {}
+        # (lat, lon, radius km) -> chat ids
+        self._points = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _group(self, kind, params, create=False):
+        if kind == "area":
+            groups, key = self._areas, params[0]
+        elif kind == "vibe":
+            groups, key = self._vibes, params[0]
+        else:
+            groups, key = self._points, tuple(float(value) for value in params)
+        chats = groups.get(key)
+        if chats is None and create:
+            chats = groups[key] = set()
+        return groups, key, chats
+
+    def add(self, chat_id, kind, params):
+        _, _, chats = self._group(kind, params, create=True)
+        if chat_id not in chats:
+            chats.add(chat_id)
+            self._count += 1
+
+    def remove(self, chat_id, kind, params):
+        groups, key, chats = self._group(kind, params)
+        if chats is None or chat_id not in chats:
+            return
+        chats.discard(chat_id)
+        self._count -= 1
+        if not chats:
+            del groups[key]
+
+    def match(self, snapshot, venue_ids):
+        """Return {chat_id: [venue id lists]} for the chats interested in any of the venues.
+
+        Safe to call from a worker thread: groups are copied before iterating, so
+        subscriptions may change meanwhile.
+        """
+        columns = snapshot.columns
+        by_area = {}
+        by_vibe = {}
+        for idx in venue_ids:
+            area_mask = columns.area_mask[idx]
+            vibe_mask = columns.vibe_mask[idx]
+            for bit, name in enumerate(columns.area_names):
+                if area_mask >> bit & 1:
+                    by_area.setdefault(area_key(name), []).append(idx)
+            for bit, name in enumerate(columns.vibe_names):
+                if vibe_mask >> bit & 1:
+                    by_vibe.setdefault(name, []).append(idx)
+
+        groups = []
+        for groups_by_key, venues_by_key in ((self._areas, by_area), (self._vibes, by_vibe)):
+            for key, venues in venues_by_key.items():
+                chats = groups_by_key.get(key)
+                if chats:
+                    groups.append((tuple(chats), venues))
+        if self._points:
+            # Only the venues starting now are searched, not the whole dataset
+            starting = SpatialIndex(
+                (idx, columns.latitude[idx], columns.longitude[idx])
+                for idx in venue_ids
+                if not math.isnan(columns.latitude[idx]) and not math.isnan(columns.longitude[idx])
+            )
+            if len(starting):
+                for (lat, lon, radius), chats in list(self._points.items()):
+                    hits = starting.nearest(lat, lon, MAX_LISTED + 1, max_km=radius)
+                    if hits:
+                        groups.append((tuple(chats), [idx for _, idx in hits]))
+
+        targets = {}
+        for chats, venues in groups:
+            for chat_id in chats:
+                targets.setdefault(chat_id, []).append(venues)
+        return targets
+
+
+class StartNotifier:
+    """Tells subscribers when a happy hour they care about starts.
+
+    Upcoming starts are precomputed from the snapshot's schedule index into one
+    global min-heap of (timestamp, venue id) covering the next HORIZON_MINUTES.
+    A single job on the Application's job queue sleeps until the earliest start;
+    when it fires it pops everything due, matches those venues against the
+    SubscriptionIndex and sends one message per chat. Sends run in the
+    background, SEND_BATCH chats at a time, paced to SEND_RATE so the bot keeps
+    room to answer users. Subscriptions live in each user's user_data, so they
+    are persisted with it and the index is rebuilt from it on startup.
+    """
+
+    def __init__(self, get_snapshot, render, send_rate=SEND_RATE):
+        # get_snapshot() -> current snapshot; render(snapshot, venue_ids, more, lang) -> text
+        self._get_snapshot = get_snapshot
+        self._render = render
+        self._bucket = TokenBucket(send_rate, send_rate)
+        self.subscriptions = SubscriptionIndex()
+        self._heap = []
+        self._version = None
+        self._horizon_end = None
+        self._application = None
+        self._job = None
+        self._tasks = set()
+
+    # Subscriptions are keyed by user id, which is also the chat id of the user's private chat
+
+    def subscribe(self, user_data, user_id, kind, params):
+        """Add a subscription; returns 'added', 'exists' or 'full'"""
+        entry = [kind, *params]
+        subscriptions = user_data.setdefault('subscriptions', [])
+        if entry in subscriptions:
+            return 'exists'
+        if len(subscriptions) >= MAX_SUBSCRIPTIONS:
+            return 'full'
+        subscriptions.append(entry)
+        self.subscriptions.add(user_id, kind, params)
+        NOTIFICATION_SUBSCRIPTIONS.set(len(self.subscriptions))
+        return 'added'
+
+    def unsubscribe(self, user_data, user_id, kind, params):
+        """Remove a subscription; returns False if there was no such subscription"""
+        entry = [kind, *params]
+        subscriptions = user_data.get('subscriptions', [])
+        if entry not in subscriptions:
+            return False
+        subscriptions.remove(entry)
+        self.subscriptions.remove(user_id, kind, params)
+        NOTIFICATION_SUBSCRIPTIONS.set(len(self.subscriptions))
+        return True
+
+    def _drop_user(self, user_id):
+        """Forget every subscription of a user who blocked the bot"""
+        user_data = self._application.user_data.get(user_id)
+        if not user_data:
+            return
+        for kind, *params in user_data.pop('subscriptions', []):
+            self.subscriptions.remove(user_id, kind, tuple(params))
+        self._application.mark_data_for_update_persistence(user_ids=user_id)
+        NOTIFICATION_SUBSCRIPTIONS.set(len(self.subscriptions))
+
+    def start(self, application):
+        """Index the persisted subscriptions and schedule the first wake-up"""
+        self._application = application
+        for user_id, user_data in application.user_data.items():
+            for kind, *params in user_data.get('subscriptions', []):
+                self.subscriptions.add(user_id, kind, tuple(params))
+        NOTIFICATION_SUBSCRIPTIONS.set(len(self.subscriptions))
+        logger.info(f"Loaded {len(self.subscriptions)} happy hour subscriptions")
+        if application.job_queue is None:
+            logger.warning("No job queue available (install python-telegram-bot[job-queue]), notifications are off")
+            return
+        now = time.time()
+        snapshot = self._get_snapshot()
+        if snapshot is not None:
+            self._fill(snapshot, now)
+        self._schedule(now)
+
+    async def shutdown(self):
+        """Stop the wake-up job and any sends still in progress"""
+        if self._job is not None:
+            try:
+                self._job.schedule_removal()
+            except JobLookupError:
+                # The Application already stopped the job queue, dropping its jobs
+                pass
+            self._job = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _fill(self, snapshot, now):
+        """Extend the heap so it covers at least the next HORIZON_MINUTES / 2 of starts"""
+        if snapshot.version != self._version:
+            # New data: forget the old events and start over from this minute
+            self._version = snapshot.version
+            self._heap = []
+            self._horizon_end = datetime.fromtimestamp(now, TIMEZONE).replace(second=0, microsecond=0)
+        # Top up a whole window at a time, once less than half of one is left
+        limit = datetime.fromtimestamp(now, TIMEZONE) + timedelta(minutes=HORIZON_MINUTES // 2)
+        if self._horizon_end >= limit:
+            return
+        while self._horizon_end < limit:
+            window_start = self._horizon_end
+            # Many venues share a start minute: convert each offset to a timestamp once
+            timestamps = {}
+            for offset, venue_id in snapshot.schedule.starting_within(HORIZON_MINUTES, window_start):
+                # Offset 0 was the last minute of the previous window
+                if offset:
+                    when = timestamps.get(offset)
+                    if when is None:
+                        when = timestamps[offset] = (window_start + timedelta(minutes=offset)).timestamp()
+                    self._heap.append((when, venue_id))
+            self._horizon_end = window_start + timedelta(minutes=HORIZON_MINUTES)
+        heapq.heapify(self._heap)
+
+    def _schedule(self, now=None):
+        """Run the job at the next start, or after CHECK_INTERVAL if that's sooner"""
+        now = time.time() if now is None else now
+        wake_at = now + CHECK_INTERVAL
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        self._job = self._application.job_queue.run_once(
+            self._run, when=max(0.0, wake_at - now), name="happy_hour_starts"
+        )
+
+    async def _run(self, context):
+        """Job callback: send notifications for every start that is due"""
+        now = time.time()
+        due = []
+        try:
+            snapshot = self._get_snapshot()
+            if snapshot is not None:
+                self._fill(snapshot, now)
+                while self._heap and self._heap[0][0] <= now:
+                    when, venue_id = heapq.heappop(self._heap)
+                    if now - when <= MAX_DELAY:
+                        due.append(venue_id)
+        except Exception as e:
+            logger.error(f"Error preparing happy hour notifications: {str(e)}")
+        finally:
+            self._schedule(now)
+
+        if due:
+            NOTIFICATION_EVENTS.inc(len(due))
+            task = asyncio.create_task(self._notify(context.bot, snapshot, due, now))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _notify(self, bot, snapshot, venue_ids, started):
+        """Fan a batch of starts out to the matching chats"""
+        try:
+            # A busy start minute can take a while to match: keep it off the event loop
+            targets = await asyncio.to_thread(self.subscriptions.match, snapshot, venue_ids)
+            targets = list(targets.items())
+            for start in range(0, len(targets), SEND_BATCH):
+                if time.time() - started > MAX_DELAY:
+                    NOTIFICATIONS_SENT.inc(len(targets) - start, result='late')
+                    logger.warning(f"Dropped {len(targets) - start} happy hour notifications sent too late")
+                    return
+                batch = targets[start:start + SEND_BATCH]
+                await asyncio.gather(*(
+                    self._send(bot, snapshot, chat_id, venue_lists) for chat_id, venue_lists in batch
+                ))
+        except Exception as e:
+            logger.error(f"Error sending happy hour notifications: {str(e)}")
+
+    async def _send(self, bot, snapshot, chat_id, venue_lists):
+        venue_ids, more = venue_list(venue_lists)
+        lang = self._application.user_data.get(chat_id, {}).get('lang', 'en')
+        text = self._render(snapshot, venue_ids, more, lang)
+        delay = self._bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            await bot.send_message(chat_id, text, parse_mode='Markdown', disable_web_page_preview=True)
+        except Forbidden:
+            # Blocked the bot or deleted the account: stop notifying them
+            NOTIFICATIONS_SENT.inc(result='blocked')
+            self._drop_user(chat_id)
+        except TelegramError as e:
+            NOTIFICATIONS_SENT.inc(result='failed')
+            logger.warning(f"Could not notify chat {chat_id}: {str(e)}")
+        else:
+            NOTIFICATIONS_SENT.inc(result='sent')
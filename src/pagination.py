@@ -0,0 +1,53 @@
+# Venues shown per result page
+PAGE_SIZE = 5
+# Telegram rejects callback_data longer than this many bytes
+MAX_CALLBACK_DATA = 64
+# Leading characters of the dataset version kept in a cursor; enough to notice a reload
+VERSION_CHARS = 8
+
+CURSOR_PREFIX = "pg"
+_SEPARATOR = "|"
+
+# Result kinds that can be paged, with the short codes used inside cursors
+KIND_CODES = {"area": "a", "vibe": "v", "near": "n"}
+_CODE_KINDS = {code: kind for kind, code in KIND_CODES.items()}
+
+
+def encode_cursor(kind, params, version, offset):
+    """Pack a page of a result list into callback_data.
+
+    `params` are the query's own arguments as strings (area key, vibe, or rounded
+    coordinates and radius), so the list can be rebuilt from the cursor alone.
+    """
+    fields = [CURSOR_PREFIX, KIND_CODES[kind], version[:VERSION_CHARS], str(offset)]
+    fields.extend(params)
+    if any(_SEPARATOR in field for field in params):
+        raise ValueError(f"cursor parameters must not contain {_SEPARATOR!r}")
+    data = _SEPARATOR.join(fields)
+    if len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+        raise ValueError(f"cursor longer than {MAX_CALLBACK_DATA} bytes: {data}")
+    return data
+
+
+def decode_cursor(data):
+    """Return (kind, params, version prefix, offset); raises ValueError if malformed"""
+    fields = data.split(_SEPARATOR)
+    if len(fields) < 4 or fields[0] != CURSOR_PREFIX or fields[1] not in _CODE_KINDS:
+        raise ValueError(f"not a page cursor: {data}")
+    offset = int(fields[3])
+    if offset < 0:
+        raise ValueError(f"negative offset in cursor: {data}")
+    return _CODE_KINDS[fields[1]], tuple(fields[4:]), fields[2], offset
+
+
+def is_current(version_prefix, version):
+    """True if a cursor was issued for the given dataset version"""
+    return version.startswith(version_prefix)
+
+
+def clamp_offset(offset, total):
+    """Snap an offset to the start of an existing page"""
+    if total <= 0:
+        return 0
+    last_page = (total - 1) // PAGE_SIZE * PAGE_SIZE
+    return min(offset - offset % PAGE_SIZE, last_page)
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the Application's persistence runs
+DEFAULT_UPDATE_INTERVAL = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+)
+"""
+
+# Marker for staged deletes
+_DELETED = object()
+
+
+class SQLitePersistence(BasePersistence):
+    """SQLite-backed persistence for user data and ConversationHandler state.
+
+    Everything is read in one query on boot and then served from memory. The
+    Application hands over changed entries every `update_interval` seconds; they
+    are staged in memory, coalesced per key, and written in a single transaction
+    in a worker thread, so handlers never wait on disk I/O.
+    Values are stored as JSON, so only JSON-serializable data is persisted.
+
+    Several processes can share one file when each handles its own chats: `owns`
+    (a predicate on a chat or user id) limits what is loaded to those chats, and
+    every process only ever writes the entries it loaded or created.
+    """
+
+    def __init__(self, filepath, store_data=None, update_interval=DEFAULT_UPDATE_INTERVAL, owns=None):
+        if store_data is None:
+            store_data = PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False)
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        self.owns = owns
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._loaded = None
+        self._pending = {}
+        self._commit_task = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filepath, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(_SCHEMA)
+            self._conn.commit()
+        return self._conn
+
+    def _load_all(self):
+        """Read every stored entry into {kind: {key: value}}"""
+        with self._db_lock:
+            rows = self._connect().execute("SELECT kind, key, value FROM entries").fetchall()
+        loaded = {}
+        count = 0
+        for kind, key, value in rows:
+            if self.owns is not None and not self._owned(kind, key):
+                continue
+            loaded.setdefault(kind, {})[key] = json.loads(value)
+            count += 1
+        logger.info(f"Loaded {count} persisted entries from {self.filepath}")
+        return loaded
+
+    def _owned(self, kind, key):
+        """Whether an entry belongs to this process' chats; conversations go by their chat"""
+        if kind in ('user', 'chat'):
+            return self.owns(int(key))
+        if kind.startswith('conversation:'):
+            return self.owns(json.loads(key)[0])
+        return True
+
+    async def _entries(self, kind):
+        """Return the stored entries of one kind, loading the database on first use"""
+        if self._loaded is None:
+            self._loaded = await asyncio.to_thread(self._load_all)
+        return self._loaded.get(kind, {})
+
+    def _stage(self, kind, key, value):
+        """Queue a write (or delete) and make sure a commit is scheduled"""
+        self._pending[(kind, key)] = value
+        if self._commit_task is None or self._commit_task.done():
+            # Runs after the rest of this persistence batch has been staged
+            self._commit_task = asyncio.ensure_future(self._commit())
+
+    def _write(self, batch):
+        """Write a batch of staged entries in one transaction"""
+        upserts = [(kind, key, json.dumps(value)) for (kind, key), value in batch.items() if value is not _DELETED]
+        deletes = [(kind, key) for (kind, key), value in batch.items() if value is _DELETED]
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                if upserts:
+                    conn.executemany(
+                        "INSERT INTO entries (kind, key, value) VALUES (?, ?, ?) "
+                        "ON CONFLICT(kind, key) DO UPDATE SET value = excluded.value",
+                        upserts
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM entries WHERE kind = ? AND key = ?", deletes)
+
+    async def _commit(self):
+        """Flush everything staged so far to disk off the event loop"""
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.error(f"Error writing persistence batch: {str(e)}")
+                # Keep the entries for the next run, unless they were overwritten since
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+                return
+
+    async def get_user_data(self):
+        return {int(key): data for key, data in (await self._entries('user')).items()}
+
+    async def get_chat_data(self):
+        return {int(key): data for key, data in (await self._entries('chat')).items()}
+
+    async def get_bot_data(self):
+        return (await self._entries('bot')).get('bot', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        entries = await self._entries(f'conversation:{name}')
+        return {tuple(json.loads(key)): state for key, state in entries.items()}
+
+    async def update_user_data(self, user_id, data):
+        self._stage('user', str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage('chat', str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        self._stage('bot', 'bot', data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        kind = f'conversation:{name}'
+        self._stage(kind, json.dumps(list(key)), _DELETED if new_state is None else new_state)
+
+    async def drop_user_data(self, user_id):
+        self._stage('user', str(user_id), _DELETED)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage('chat', str(chat_id), _DELETED)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Write any staged entries and close the database"""
+        if self._commit_task is not None:
+            await self._commit_task
+        await self._commit()
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.close()
+                self._conn = None
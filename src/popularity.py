@@ -0,0 +1,369 @@
+import asyncio
+import base64
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+from array import array
+from functools import lru_cache
+
+from metrics import POPULARITY_EVENTS
+
+logger = logging.getLogger(__name__)
+
+# Counts halve every this many seconds, so the ranking follows recent activity
+DEFAULT_HALF_LIFE = 3 * 24 * 3600
+# Count-min sketch size: estimates overshoot by about total/width with high probability
+SKETCH_WIDTH = 8192
+SKETCH_DEPTH = 4
+# Venues kept per ranking
+TOP_K = 20
+# Forward-decay weights are rebased before they get this large
+MAX_WEIGHT = 2.0 ** 40
+# Seconds between writes of the counts to disk
+DEFAULT_FLUSH_INTERVAL = 60
+# Seconds recorded events wait, summed per venue and scopes, before reaching the sketch
+APPLY_INTERVAL = 1.0
+
+# Event weights: a venue shown in a result list vs. one the user picked
+VIEW_WEIGHT = 1.0
+CLICK_WEIGHT = 3.0
+
+FILE_VERSION = 1
+
+
+def venue_key(venue):
+    """Stable identity of a venue across data reloads"""
+    return f"{venue.get('name', '')}\x1f{venue.get('address', '')}"
+
+
+@lru_cache(maxsize=65536)
+def _hash(text):
+    """64-bit hash that stays the same across processes, unlike hash()"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.popularity-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class CountMinSketch:
+    """Approximate counters for an unbounded set of keys in fixed memory.
+
+    Each key adds to one cell per row, picked by double hashing of a 64-bit
+    hash; its estimate is the smallest of those cells, which can only overshoot.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, counts=None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array('d', bytes(8 * width * depth))
+
+    def _cells(self, key_hash):
+        h1 = key_hash & 0xFFFFFFFF
+        h2 = (key_hash >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, key_hash, amount):
+        """Add to a key's count and return its new estimate"""
+        counts = self.counts
+        estimate = math.inf
+        for cell in self._cells(key_hash):
+            counts[cell] += amount
+            if counts[cell] < estimate:
+                estimate = counts[cell]
+        return estimate
+
+    def estimate(self, key_hash):
+        counts = self.counts
+        return min(counts[cell] for cell in self._cells(key_hash))
+
+    def scale(self, factor):
+        counts = self.counts
+        for cell in range(len(counts)):
+            counts[cell] *= factor
+
+
+class TopK:
+    """The k keys with the highest scores seen so far.
+
+    Scores live in a dict; a min-heap of (score, key) finds the entry to evict.
+    Entries outdated by a later update stay in the heap until they surface and
+    the heap is rebuilt when they pile up, so updates stay O(log k).
+    """
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.scores = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def _push(self, key, score):
+        self.scores[key] = score
+        heapq.heappush(self._heap, (score, key))
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(value, name) for name, value in self.scores.items()]
+            heapq.heapify(self._heap)
+
+    def _min(self):
+        heap = self._heap
+        while heap and self.scores.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def offer(self, key, score):
+        """Record a key's current score, evicting the lowest entry if it's full"""
+        if key in self.scores or len(self.scores) < self.k:
+            self._push(key, score)
+            return
+        low_score, low_key = self._min()
+        if score > low_score:
+            del self.scores[low_key]
+            heapq.heappop(self._heap)
+            self._push(key, score)
+
+    def top(self, n=None):
+        """Return (key, score) pairs, highest first"""
+        items = sorted(self.scores.items(), key=lambda item: item[1], reverse=True)
+        return items if n is None else items[:n]
+
+    def scale(self, factor):
+        self.scores = {key: score * factor for key, score in self.scores.items()}
+        self._heap = [(score, key) for key, score in self.scores.items()]
+        heapq.heapify(self._heap)
+
+
+class PopularityTracker:
+    """Time-decayed venue popularity per area and language, kept in memory.
+
+    Views and clicks go into one count-min sketch keyed by (scope, venue), where
+    a scope is an area (or a whole city) in one language, and each scope keeps
+    a TopK of its best estimates. Decay uses forward weighting: an event at time t
+    adds 2^((t - landmark) / half_life), so older counts never need touching
+    until the weights are rebased. Reading a ranking only sorts its k entries.
+
+    Recording only adds to a pending total per (venue, scopes); the totals reach
+    the sketch once a second or before a ranking is read, so request handlers
+    don't pay for hashing and the sketch update of every venue they show.
+    The state is written to `path` every flush interval when it changed.
+
+    Processes sharing the load each count into their own file and list the
+    others' as `peers`: those are re-read at every flush and added to this
+    tracker's estimates, so all of them rank venues by everyone's activity.
+    """
+
+    def __init__(self, path=None, half_life=DEFAULT_HALF_LIFE, k=TOP_K,
+                 width=SKETCH_WIDTH, depth=SKETCH_DEPTH, peers=()):
+        self.path = path
+        self.peers = tuple(peers)
+        self.half_life = half_life
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.rankings = {}
+        self.landmark = time.time()
+        self._pending = {}
+        self._dirty = False
+        # Peers' summed sketch counts and their ranked venue keys per scope
+        self._peer_counts = None
+        self._peer_keys = {}
+
+    @staticmethod
+    def scope(area, lang, city=None):
+        """Scope name of an area (None for the whole city) of a city in a language"""
+        if city is None:
+            return f"{area or ''}|{lang}"
+        return f"{city}/{area or ''}|{lang}"
+
+    def _weight(self, now):
+        weight = 2.0 ** ((now - self.landmark) / self.half_life)
+        if weight > MAX_WEIGHT:
+            self._rebase(now)
+            weight = 1.0
+        return weight
+
+    def _rebase(self, now):
+        """Move the landmark to now, shrinking every count by the same factor"""
+        factor = 2.0 ** (-(now - self.landmark) / self.half_life)
+        self.sketch.scale(factor)
+        for ranking in self.rankings.values():
+            ranking.scale(factor)
+        if self._peer_counts is not None:
+            peer_counts = self._peer_counts
+            for cell in range(len(peer_counts)):
+                peer_counts[cell] *= factor
+        self.landmark = now
+
+    def record(self, key, scopes, weight=VIEW_WEIGHT):
+        """Count one view or click of a venue in each of the given scopes (a tuple)"""
+        pending = self._pending
+        pending[key, scopes] = pending.get((key, scopes), 0.0) + weight
+        POPULARITY_EVENTS.inc(kind='click' if weight > VIEW_WEIGHT else 'view')
+
+    def apply(self, now=None):
+        """Add the pending totals to the sketch and rankings"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        decay = self._weight(time.time() if now is None else now)
+        sketch = self.sketch
+        rankings = self.rankings
+        for (key, scopes), total in pending.items():
+            amount = total * decay
+            key_hash = _hash(key)
+            for scope in scopes:
+                estimate = sketch.add(key_hash ^ _hash(scope), amount)
+                ranking = rankings.get(scope)
+                if ranking is None:
+                    ranking = rankings[scope] = TopK(self.k)
+                ranking.offer(key, estimate)
+        self._dirty = True
+
+    def top(self, scope, n):
+        """The n most popular venue keys of a scope, most popular first"""
+        self.apply()
+        ranking = self.rankings.get(scope)
+        peer_keys = self._peer_keys.get(scope)
+        if not peer_keys:
+            if ranking is None:
+                return []
+            return [key for key, _ in ranking.top(n)]
+
+        # Re-estimate every candidate from both sketches, cell by cell
+        counts = self.sketch.counts
+        peer_counts = self._peer_counts
+        scope_hash = _hash(scope)
+        scores = {}
+        for key in peer_keys.union(ranking.scores if ranking is not None else ()):
+            cells = self.sketch._cells(_hash(key) ^ scope_hash)
+            scores[key] = min(counts[cell] + peer_counts[cell] for cell in cells)
+        return sorted(scores, key=scores.get, reverse=True)[:n]
+
+    def to_bytes(self):
+        """Serialize the sketch and rankings"""
+        self.apply()
+        state = {
+            'version': FILE_VERSION,
+            'landmark': self.landmark,
+            'half_life': self.half_life,
+            'width': self.sketch.width,
+            'depth': self.sketch.depth,
+            'byteorder': sys.byteorder,
+            'sketch': base64.b64encode(self.sketch.counts.tobytes()).decode('ascii'),
+            'rankings': {scope: ranking.top() for scope, ranking in self.rankings.items()},
+        }
+        return json.dumps(state, ensure_ascii=False).encode('utf-8')
+
+    def _read_state(self, path):
+        """Parse a popularity file into (state, sketch counts); raises on anything unusable"""
+        with open(path, 'rb') as f:
+            state = json.loads(f.read().decode('utf-8'))
+        if state.get('version') != FILE_VERSION:
+            raise ValueError(f"unsupported popularity file version {state.get('version')}")
+        counts = array('d')
+        counts.frombytes(base64.b64decode(state['sketch']))
+        if state['byteorder'] != sys.byteorder:
+            counts.byteswap()
+        if len(counts) != state['width'] * state['depth']:
+            raise ValueError("sketch size doesn't match its dimensions")
+        return state, counts
+
+    def load(self):
+        """Restore the counts written by an earlier run, if any"""
+        if not self.path:
+            return
+        try:
+            state, counts = self._read_state(self.path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Ignoring popularity data at {self.path}: {str(e)}")
+            return
+
+        self.sketch = CountMinSketch(state['width'], state['depth'], counts)
+        self.landmark = state['landmark']
+        self.rankings = {}
+        for scope, entries in state['rankings'].items():
+            ranking = self.rankings[scope] = TopK(self.k)
+            for key, score in entries:
+                ranking.offer(key, score)
+        if state['half_life'] != self.half_life:
+            # Keep the counts comparable: rebase them to now under the old half-life
+            half_life, self.half_life = self.half_life, state['half_life']
+            self._rebase(time.time())
+            self.half_life = half_life
+        logger.info(f"Loaded popularity for {len(self.rankings)} scopes from {self.path}")
+
+    def _read_peers(self, landmark):
+        """Sum the peers' sketches, rescaled to `landmark`, and collect their ranked keys per scope"""
+        width, depth = self.sketch.width, self.sketch.depth
+        total = array('d', bytes(8 * width * depth))
+        keys = {}
+        for path in self.peers:
+            try:
+                state, counts = self._read_state(path)
+                if (state['width'], state['depth']) != (width, depth):
+                    raise ValueError("sketch dimensions differ from this tracker's")
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.error(f"Ignoring peer popularity data at {path}: {str(e)}")
+                continue
+            # Forward-decay weights relative to the peer's landmark, moved to ours
+            factor = 2.0 ** ((state['landmark'] - landmark) / self.half_life)
+            for cell, count in enumerate(counts):
+                total[cell] += count * factor
+            for scope, entries in state['rankings'].items():
+                keys.setdefault(scope, set()).update(key for key, _ in entries)
+        return total, keys
+
+    async def load_peers(self):
+        """Re-read the peers' files in a worker thread so rankings include their counts"""
+        if not self.peers:
+            return
+        landmark = self.landmark
+        total, keys = await asyncio.to_thread(self._read_peers, landmark)
+        if self.landmark != landmark:
+            factor = 2.0 ** ((landmark - self.landmark) / self.half_life)
+            total = array('d', (count * factor for count in total))
+        self._peer_counts = total
+        self._peer_keys = keys
+
+    async def flush(self):
+        """Write the state to disk in a worker thread if it changed since the last write"""
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        data = self.to_bytes()
+        try:
+            await asyncio.to_thread(_write_atomic, self.path, data)
+        except OSError as e:
+            self._dirty = True
+            logger.error(f"Error writing popularity data: {str(e)}")
+
+    async def run_flusher(self, interval=DEFAULT_FLUSH_INTERVAL):
+        """Apply pending events every second; flush and re-read peers every `interval` seconds until cancelled"""
+        next_flush = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(APPLY_INTERVAL)
+            self.apply()
+            if time.monotonic() >= next_flush:
+                next_flush = time.monotonic() + interval
+                await self.flush()
+                await self.load_peers()
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import logging
+import random
+import time
+
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import OUTBOUND_DROPPED_EDITS, OUTBOUND_RETRIES, OUTBOUND_WAIT_SECONDS
+from render_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Telegram's documented limits: ~30 messages/s overall, about one per second in a
+# private chat (short bursts are tolerated) and 20 per minute in a group
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60
+GROUP_BURST = 5
+# Per-chat buckets are pruned once there are more than this many
+MAX_IDLE_BUCKETS = 1024
+# Last content sent to each message, used to drop edits that change nothing
+MAX_TRACKED_MESSAGES = 4096
+
+EDIT_ENDPOINTS = {"editMessageText", "editMessageReplyMarkup"}
+SEND_ENDPOINTS = {"sendMessage"}
+
+
+class TokenBucket:
+    """Token bucket handing out send slots in FIFO order.
+
+    reserve() always takes a token, letting the balance go negative, and returns how
+    long the caller must wait for it; later callers queue up behind earlier ones.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, now=None):
+        """Take one token and return the delay in seconds before it may be used"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+    def pause(self, seconds, now=None):
+        """Make the next token available no sooner than `seconds` from now"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+    def is_full(self, now=None):
+        self._refill(time.monotonic() if now is None else now)
+        return self._tokens >= self.burst
+
+
+def message_key(data):
+    """Identify the message an edit request targets"""
+    if data.get('inline_message_id'):
+        return ('inline', data['inline_message_id'])
+    if data.get('chat_id') is not None and data.get('message_id') is not None:
+        return (str(data['chat_id']), int(data['message_id']))
+    return None
+
+
+def _markup_key(markup):
+    if markup is None:
+        return None
+    if hasattr(markup, 'to_json'):
+        return markup.to_json()
+    if isinstance(markup, str):
+        return markup
+    return json.dumps(markup, sort_keys=True)
+
+
+def _content(data):
+    """(text, formatting, markup) as sent, for comparing successive edits"""
+    return (
+        data.get('text'),
+        (data.get('parse_mode'), data.get('disable_web_page_preview')),
+        _markup_key(data.get('reply_markup')),
+    )
+
+
+class _PendingEdit:
+    """An edit waiting for its send slot; newer edits of the same message replace it"""
+
+    def __init__(self, callback, args, kwargs, endpoint, data):
+        self.replace(callback, args, kwargs, endpoint, data)
+        self.started = False
+        self.waiters = 0
+        self.future = asyncio.get_running_loop().create_future()
+
+    def replace(self, callback, args, kwargs, endpoint, data):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.endpoint = endpoint
+        self.data = data
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Rate limiter for outgoing Bot API requests.
+
+    Every request takes a token from a global bucket and, when it targets a chat,
+    from that chat's bucket, so bursts are smoothed instead of hitting flood control.
+    A RetryAfter from Telegram pauses the affected bucket and the request is retried.
+    Edits whose text and keyboard match what the message already shows are answered
+    locally, and edits of a message that is still waiting for its slot are folded
+    into one request carrying the newest content.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, max_retries=3):
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, max(GLOBAL_BURST, global_rate))
+        self._chat_rate = chat_rate
+        self._chats = {}
+        self._sent = LRUCache(MAX_TRACKED_MESSAGES)
+        self._pending = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._chats.clear()
+        self._sent.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                self._chats = {key: b for key, b in self._chats.items() if not b.is_full(now)}
+            # Negative ids and @usernames are groups and channels
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+            else:
+                bucket = TokenBucket(self._chat_rate, max(CHAT_BURST, self._chat_rate))
+            self._chats[chat_id] = bucket
+        return bucket
+
+    @staticmethod
+    def _chat_id(data):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return None
+        try:
+            return int(chat_id)
+        except (TypeError, ValueError):
+            return str(chat_id)
+
+    async def _acquire(self, endpoint, chat_id):
+        """Wait until both the global and the chat budget allow another request"""
+        now = time.monotonic()
+        delay = self._global.reserve(now)
+        if chat_id is not None:
+            delay = max(delay, self._chat_bucket(chat_id).reserve(now))
+        if delay > 0:
+            OUTBOUND_WAIT_SECONDS.observe(delay, endpoint=endpoint)
+            await asyncio.sleep(delay)
+
+    async def _call(self, callback, args, kwargs, endpoint, data, max_retries, acquired=False):
+        """Send a request within budget, backing off and retrying on RetryAfter"""
+        chat_id = self._chat_id(data)
+        for attempt in range(max_retries + 1):
+            if not acquired:
+                await self._acquire(endpoint, chat_id)
+            acquired = False
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    logger.error(f"Flood control on {endpoint} after {max_retries} retries: {str(e)}")
+                    raise
+                # Small jitter so requests released together don't collide again
+                delay = e.retry_after + random.uniform(0.05, 0.25)
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+                bucket.pause(delay)
+                OUTBOUND_RETRIES.inc(endpoint=endpoint)
+                logger.warning(f"Flood control on {endpoint}, retrying in {delay:.1f}s")
+
+    def _is_unchanged(self, key, endpoint, data):
+        sent = self._sent.get(key)
+        if sent is None:
+            return False
+        text, formatting, markup = _content(data)
+        if endpoint == "editMessageReplyMarkup":
+            return markup == sent[2]
+        return (text, formatting, markup) == sent
+
+    def _remember(self, key, endpoint, data):
+        if endpoint == "editMessageReplyMarkup":
+            sent = self._sent.get(key)
+            if sent is not None:
+                self._sent.put(key, sent[:2] + (_markup_key(data.get('reply_markup')),))
+            return
+        self._sent.put(key, _content(data))
+
+    async def _edit(self, key, callback, args, kwargs, endpoint, data, max_retries):
+        if self._is_unchanged(key, endpoint, data):
+            OUTBOUND_DROPPED_EDITS.inc(reason='unchanged')
+            return True
+
+        pending = self._pending.get(key)
+        if pending is not None and not pending.started and pending.endpoint == endpoint:
+            # The message hasn't been edited yet: send only the newest content
+            pending.replace(callback, args, kwargs, endpoint, data)
+            pending.waiters += 1
+            OUTBOUND_DROPPED_EDITS.inc(reason='coalesced')
+            return await asyncio.shield(pending.future)
+
+        previous = pending
+        pending = _PendingEdit(callback, args, kwargs, endpoint, data)
+        self._pending[key] = pending
+        try:
+            if previous is not None:
+                # Keep edits of one message in order: wait for the one being sent
+                previous.waiters += 1
+                await asyncio.wait([previous.future])
+                if not previous.future.cancelled():
+                    previous.future.exception()
+            await self._acquire(endpoint, self._chat_id(data))
+            pending.started = True
+            if self._is_unchanged(key, pending.endpoint, pending.data):
+                OUTBOUND_DROPPED_EDITS.inc(reason='unchanged')
+                result = True
+            else:
+                try:
+                    result = await self._call(
+                        pending.callback, pending.args, pending.kwargs, pending.endpoint,
+                        pending.data, max_retries, acquired=True,
+                    )
+                except BadRequest as e:
+                    # The message already shows this content (e.g. sent before a restart)
+                    if 'not modified' not in str(e):
+                        raise
+                    result = True
+            self._remember(key, pending.endpoint, pending.data)
+        except asyncio.CancelledError:
+            pending.future.cancel()
+            raise
+        except Exception as e:
+            if pending.waiters:
+                pending.future.set_exception(e)
+            raise
+        else:
+            pending.future.set_result(result)
+            return result
+        finally:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        """Send a Bot API request within the rate budgets.
+
+        `rate_limit_args` optionally overrides the number of RetryAfter retries.
+        """
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        if endpoint in EDIT_ENDPOINTS:
+            key = message_key(data)
+            if key is not None:
+                return await self._edit(key, callback, args, kwargs, endpoint, data, max_retries)
+
+        result = await self._call(callback, args, kwargs, endpoint, data, max_retries)
+        if endpoint in SEND_ENDPOINTS and isinstance(result, dict) and 'message_id' in result:
+            # Remember what a new message shows so a first identical edit is dropped too
+            self._remember((str(result.get('chat', {}).get('id', data.get('chat_id'))), result['message_id']),
+                           endpoint, data)
+        return result
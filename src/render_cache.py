@@ -0,0 +1,123 @@
+from collections import OrderedDict
+
+# Default number of rendered cards/pages kept per process
+DEFAULT_MAXSIZE = 2048
+
+
+class LRUCache:
+    """Small bounded mapping that evicts the least recently used entry"""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the cached value and mark it as recently used"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store a value, evicting the oldest entry when full"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def keys(self):
+        """Cached keys, least recently used first"""
+        return list(self._data)
+
+    def items(self):
+        """Cached (key, value) pairs, least recently used first"""
+        return list(self._data.items())
+
+    def rekey(self, rename):
+        """Replace every key by rename(key), dropping entries it maps to None, in LRU order"""
+        renamed = OrderedDict()
+        for key, value in self._data.items():
+            key = rename(key)
+            if key is not None:
+                renamed[key] = value
+        self._data = renamed
+
+    def pop(self, key, default=None):
+        """Remove and return an entry"""
+        return self._data.pop(key, default)
+
+    def clear(self):
+        """Drop every entry"""
+        self._data.clear()
+
+
+class RenderCache:
+    """LRU cache of rendered venue cards and result pages across dataset versions.
+
+    Keys are whatever the caller uses to describe a query (kind, parameters, lang).
+    Entries are tied to the dataset version they were rendered from, so several
+    city shards can share one cache. Retiring a version, when its data is reloaded
+    or unloaded, drops everything rendered from it right away. When a version was
+    only updated by a small diff, its renderings are carried over to the new one
+    except those the diff affects.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self._entries = LRUCache(maxsize)
+
+    @property
+    def stats(self):
+        """(hits, misses, size) counters for monitoring"""
+        return self._entries.hits, self._entries.misses, len(self._entries)
+
+    def retire(self, version):
+        """Drop every rendering of a dataset version that is no longer served"""
+        for entry in self._entries.keys():
+            if entry[0] == version:
+                self._entries.pop(entry)
+
+    def entries(self, version):
+        """(key, value) of every rendering of a dataset version"""
+        return [(entry[1], value) for entry, value in self._entries.items() if entry[0] == version]
+
+    def carry(self, version, new_version, stale=()):
+        """Serve a version's renderings for its successor, dropping the `stale` keys"""
+        stale = set(stale)
+
+        def rename(entry):
+            if entry[0] != version:
+                return entry
+            return None if entry[1] in stale else (new_version, entry[1])
+        self._entries.rekey(rename)
+
+    def clear(self):
+        """Drop every rendering"""
+        self._entries.clear()
+
+    def get(self, version, key):
+        """Return a cached rendering, or None"""
+        return self._entries.get((version, key))
+
+    def put(self, version, key, value):
+        """Store a rendering for the given dataset version"""
+        self._entries.put((version, key), value)
+
+    def get_or_render(self, version, key, render):
+        """Return the cached rendering for key, calling render() on a miss"""
+        value = self.get(version, key)
+        if value is None:
+            value = render()
+            self.put(version, key, value)
+        return value
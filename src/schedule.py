@@ -0,0 +1,370 @@
+import bisect
+import functools
+import re
+from array import array
+from collections.abc import Mapping
+from datetime import datetime
+
+from zoneinfo import ZoneInfo
+
+# All happy hour times are local Tel Aviv time
+TIMEZONE = ZoneInfo("Asia/Jerusalem")
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+HOURS_PER_WEEK = 7 * 24
+
+# Day numbers follow the Israeli week: Sunday is day 0
+DAY_NAMES = {
+    'sun': 0, 'sunday': 0, 'ראשון': 0,
+    'mon': 1, 'monday': 1, 'שני': 1,
+    'tue': 2, 'tues': 2, 'tuesday': 2, 'שלישי': 2,
+    'wed': 3, 'wednesday': 3, 'רביעי': 3,
+    'thu': 4, 'thur': 4, 'thurs': 4, 'thursday': 4, 'חמישי': 4,
+    'fri': 5, 'friday': 5, 'שישי': 5,
+    'sat': 6, 'saturday': 6, 'שבת': 6,
+}
+# Hebrew day letters, as in "א-ה" or "ו'" (a lone letter needs its geresh)
+DAY_LETTERS = {'א': 0, 'ב': 1, 'ג': 2, 'ד': 3, 'ה': 4, 'ו': 5, 'ש': 6}
+ALL_DAYS = tuple(range(7))
+
+_DAY_PATTERN = '|'.join(sorted((re.escape(name) for name in DAY_NAMES), key=len, reverse=True))
+_LETTER_PATTERN = f"[{''.join(DAY_LETTERS)}]"
+_RANGE_END = rf"(?:{_DAY_PATTERN}|{_LETTER_PATTERN})['׳]?"
+_TOKEN_RE = re.compile(
+    rf"(?<![a-zא-ת])(?P<range>(?P<from>{_RANGE_END})\s*[-–]\s*(?P<to>{_RANGE_END}))(?![a-zא-ת])"
+    rf"|(?<![a-zא-ת])(?P<day>{_DAY_PATTERN}|{_LETTER_PATTERN}['׳])(?![a-zא-ת])"
+    r"|(?P<time>(?P<h1>\d{1,2})[:.](?P<m1>\d{2})\s*[-–]\s*(?P<h2>\d{1,2})[:.](?P<m2>\d{2}))"
+    r"|(?P<allday>all\s+day|24/7)"
+    r"|(?P<daily>daily|every\s*day|כל\s+יום)",
+    re.IGNORECASE,
+)
+# A range of short words that reads like days in a format we don't know ("Mo-Fr")
+_UNKNOWN_RANGE_RE = re.compile(r"(?<!\w)[^\W\d_]{1,3}['׳.]?\s*[-–]\s*[^\W\d_]{1,3}['׳.]?(?!\w)")
+
+
+def minute_of_week(dt=None):
+    """Return the minute of the (Sunday-first) week for a datetime in local time"""
+    if dt is None:
+        dt = datetime.now(TIMEZONE)
+    elif dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TIMEZONE)
+    else:
+        dt = dt.astimezone(TIMEZONE)
+    day = (dt.weekday() + 1) % 7
+    return day * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
+
+
+def format_minute(minute):
+    """Format a minute of the day/week as HH:MM"""
+    minute %= MINUTES_PER_DAY
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def _day_span(start, end):
+    """Days from start to end inclusive, wrapping past Saturday"""
+    return tuple((start + offset) % 7 for offset in range((end - start) % 7 + 1))
+
+
+def _day_number(token):
+    """Day number of a day name or Hebrew day letter, with or without a geresh"""
+    token = token.rstrip("'׳").lower()
+    return DAY_LETTERS[token] if token in DAY_LETTERS else DAY_NAMES[token]
+
+
+def parse_hours(text):
+    """Parse a free-text schedule into weekly (start, end) minute intervals.
+
+    Understands strings like "Sun-Thu, 18:00-20:00, Fri 19:00-21:00",
+    "Sun, 12:00-23:00", "Daily 17:00-19:00", "א-ה 17:00-19:00" and "All day
+    happy hour Sunday". Days apply to the time range that follows them; a time
+    range with no days applies to the previous days, or to every day. When the
+    text starts with a time, as in "17:00-19:00 Sun-Thu", days apply to the time
+    range before them instead. Overnight ranges such as 22:00-02:00 run into the
+    next day. Days written in a way this doesn't recognise ("Mo-Fr") give no
+    intervals rather than every day.
+    """
+    if not text:
+        return []
+    return list(_parse_hours_cached(text))
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_hours_cached(text):
+    """parse_hours() body; venues often share identical schedule strings"""
+    matches = list(_TOKEN_RE.finditer(text))
+    ranges = [match.span() for match in matches if match.group('range')]
+    for unknown in _UNKNOWN_RANGE_RE.finditer(text):
+        start, end = unknown.span()
+        if not any(first <= start and end <= last for first, last in ranges):
+            return ()
+    dated = [match for match in matches if not match.group('allday')]
+    if dated and dated[0].group('time'):
+        # Days written after their times: reading backwards puts them in front
+        matches.reverse()
+
+    windows = []
+    pending_days = []
+    last_days = ALL_DAYS
+    all_day = False
+
+    for match in matches:
+        if match.group('range'):
+            pending_days.extend(_day_span(_day_number(match.group('from')), _day_number(match.group('to'))))
+        elif match.group('day'):
+            pending_days.append(_day_number(match.group('day')))
+        elif match.group('daily'):
+            pending_days.extend(ALL_DAYS)
+        elif match.group('allday'):
+            all_day = True
+        elif match.group('time'):
+            start = int(match.group('h1')) * 60 + int(match.group('m1'))
+            end = int(match.group('h2')) * 60 + int(match.group('m2'))
+            if start >= MINUTES_PER_DAY or end > MINUTES_PER_DAY or start == end:
+                continue
+            days = tuple(pending_days) or last_days
+            windows.extend((day, start, end) for day in days)
+            last_days = days
+            pending_days = []
+
+    if all_day and not windows:
+        for day in (pending_days or ALL_DAYS):
+            windows.append((day, 0, MINUTES_PER_DAY))
+
+    intervals = []
+    for day, start, end in windows:
+        week_start = day * MINUTES_PER_DAY + start
+        length = (end - start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+        intervals.append((week_start, week_start + length))
+    return tuple(_merge(intervals))
+
+
+def venue_intervals(venue):
+    """Weekly intervals of a venue's `hours` text or, failing that, its `deal` text"""
+    return parse_hours(venue.get('hours', '')) or parse_hours(venue.get('deal', ''))
+
+
+def _merge(intervals):
+    """Sort and merge overlapping weekly intervals"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class _CompiledIntervals(Mapping):
+    """Read-only {venue_id: [(start, end)]} view over flat interval arrays"""
+
+    def __init__(self, venue_ids, offsets, starts, ends):
+        self._venue_ids = venue_ids
+        self._offsets = offsets
+        self._starts = starts
+        self._ends = ends
+
+    def __getitem__(self, venue_id):
+        # Venue ids are stored in ascending order
+        pos = bisect.bisect_left(self._venue_ids, venue_id)
+        if pos == len(self._venue_ids) or self._venue_ids[pos] != venue_id:
+            raise KeyError(venue_id)
+        start, end = self._offsets[pos], self._offsets[pos + 1]
+        return list(zip(self._starts[start:end], self._ends[start:end]))
+
+    def __iter__(self):
+        return iter(self._venue_ids)
+
+    def __len__(self):
+        return len(self._venue_ids)
+
+
+def _column():
+    return array('i')
+
+
+class ScheduleIndex:
+    """Weekly happy hour schedule for every venue, compiled once per snapshot.
+
+    Each venue's intervals are registered in a 168-slot hour-of-week table, so
+    "what's on now" only checks the intervals touching the current hour. Start
+    times are kept sorted to answer "starting within N minutes" with a bisect.
+    Intervals that run past the end of the week wrap around to Sunday. Every
+    table is stored as flat integer columns, so a compiled index can be used
+    straight from a mapped file.
+    """
+
+    def __init__(self, schedules):
+        """Build the index from an iterable of (venue_id, intervals)"""
+        self.intervals = {}
+        # Per hour: (segment starts, segment ends, interval ends, venue ids)
+        self._hours = [tuple(_column() for _ in range(4)) for _ in range(HOURS_PER_WEEK)]
+        starts = []
+        for venue_id, intervals in schedules:
+            self._register(venue_id, intervals)
+            starts.extend((start, venue_id) for start, _ in intervals)
+        starts.sort()
+        self._start_minutes = array('i', (start for start, _ in starts))
+        self._start_venues = array('i', (venue_id for _, venue_id in starts))
+
+    @classmethod
+    def from_venues(cls, venues):
+        """Parse the `hours` (or, failing that, `deal`) text of every venue"""
+        def schedules():
+            for idx, venue in enumerate(venues):
+                intervals = venue_intervals(venue)
+                if intervals:
+                    yield idx, intervals
+        return cls(schedules())
+
+    def to_arrays(self):
+        """Flatten the index into typed arrays (see from_arrays)"""
+        arrays = {name: _column() for name in (
+            'venue_ids', 'interval_starts', 'interval_ends',
+            'segment_starts', 'segment_ends', 'segment_ends_at', 'segment_venues',
+        )}
+        arrays['interval_offsets'] = array('q', [0])
+        arrays['hour_offsets'] = array('q', [0])
+        for venue_id in sorted(self.intervals):
+            arrays['venue_ids'].append(venue_id)
+            for start, end in self.intervals[venue_id]:
+                arrays['interval_starts'].append(start)
+                arrays['interval_ends'].append(end)
+            arrays['interval_offsets'].append(len(arrays['interval_starts']))
+        names = ('segment_starts', 'segment_ends', 'segment_ends_at', 'segment_venues')
+        for columns in self._hours:
+            for name, column in zip(names, columns):
+                arrays[name].extend(column)
+            arrays['hour_offsets'].append(len(arrays['segment_venues']))
+        arrays['start_minutes'] = array('i', self._start_minutes)
+        arrays['start_venues'] = array('i', self._start_venues)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Wrap to_arrays() output, e.g. memoryviews over a mapped file, without copying"""
+        index = cls(())
+        index.intervals = _CompiledIntervals(
+            arrays['venue_ids'], arrays['interval_offsets'], arrays['interval_starts'], arrays['interval_ends']
+        )
+        offsets = arrays['hour_offsets']
+        columns = (arrays['segment_starts'], arrays['segment_ends'], arrays['segment_ends_at'], arrays['segment_venues'])
+        index._hours = [
+            tuple(column[offsets[hour]:offsets[hour + 1]] for column in columns)
+            for hour in range(HOURS_PER_WEEK)
+        ]
+        index._start_minutes = arrays['start_minutes']
+        index._start_venues = arrays['start_venues']
+        return index
+
+    def add(self, venue_id, intervals):
+        """Register a venue's weekly intervals, keeping start times sorted"""
+        if not isinstance(self.intervals, dict):
+            # Compiled indexes are read-only views: copy them before the first change
+            self.intervals = dict(self.intervals.items())
+            self._hours = [tuple(array('i', column) for column in columns) for columns in self._hours]
+            self._start_minutes = array('i', self._start_minutes)
+            self._start_venues = array('i', self._start_venues)
+        self._register(venue_id, intervals)
+        for start, _ in intervals:
+            pos = bisect.bisect_right(self._start_minutes, start)
+            self._start_minutes.insert(pos, start)
+            self._start_venues.insert(pos, venue_id)
+
+    def updated(self, removed, added):
+        """A copy without the `removed` venue ids and with `added` (venue_id, intervals).
+
+        Only the hour slots those venues touch are copied; the rest are shared
+        with this index, which stays unchanged for readers still using it.
+        """
+        index = ScheduleIndex.__new__(ScheduleIndex)
+        index.intervals = self.intervals.copy() if isinstance(self.intervals, dict) else dict(self.intervals.items())
+        index._hours = list(self._hours)
+        index._start_minutes = array('i', self._start_minutes)
+        index._start_venues = array('i', self._start_venues)
+        copied = {}
+
+        def own(hour):
+            if hour not in copied:
+                copied[hour] = index._hours[hour] = tuple(array('i', column) for column in self._hours[hour])
+            return copied[hour]
+
+        for venue_id in removed:
+            for start, end in index.intervals.pop(venue_id, ()):
+                # Each interval has one segment in every hour it touches
+                for hour in self._hours_of(start, end):
+                    columns = own(hour)
+                    pos = columns[3].index(venue_id)
+                    for column in columns:
+                        del column[pos]
+                pos = bisect.bisect_left(index._start_minutes, start)
+                while index._start_venues[pos] != venue_id:
+                    pos += 1
+                del index._start_minutes[pos]
+                del index._start_venues[pos]
+        added = list(added)
+        for _, intervals in added:
+            for start, end in intervals:
+                for hour in self._hours_of(start, end):
+                    own(hour)
+        for venue_id, intervals in added:
+            index.add(venue_id, intervals)
+        return index
+
+    def _hours_of(self, start, end):
+        """Hour slots an interval is registered in"""
+        for segment_start, segment_end, _ in self._segments(start, end):
+            yield from range(segment_start // 60, (segment_end - 1) // 60 + 1)
+
+    def _register(self, venue_id, intervals):
+        """Record a venue's intervals in the hour table"""
+        self.intervals[venue_id] = list(intervals)
+        for start, end in intervals:
+            for segment_start, segment_end, ends_at in self._segments(start, end):
+                for hour in range(segment_start // 60, (segment_end - 1) // 60 + 1):
+                    starts, ends, ends_ats, venue_ids = self._hours[hour]
+                    starts.append(segment_start)
+                    ends.append(segment_end)
+                    ends_ats.append(ends_at)
+                    venue_ids.append(venue_id)
+
+    @staticmethod
+    def _segments(start, end):
+        """Split an interval at the week boundary into (start, end, ends_at) segments"""
+        if end <= MINUTES_PER_WEEK:
+            return [(start, end, end)]
+        wrapped_end = end - MINUTES_PER_WEEK
+        return [(start, MINUTES_PER_WEEK, end), (0, wrapped_end, wrapped_end)]
+
+    def active_at(self, dt=None):
+        """Return {venue_id: minutes_left} for venues in happy hour at dt"""
+        minute = minute_of_week(dt)
+        active = {}
+        for start, end, ends_at, venue_id in zip(*self._hours[minute // 60]):
+            if start <= minute < end:
+                active[venue_id] = max(active.get(venue_id, 0), ends_at - minute)
+        return active
+
+    def is_active(self, venue_id, dt=None):
+        """Return True if the venue is in happy hour at dt"""
+        minute = minute_of_week(dt)
+        for start, end in self.intervals.get(venue_id, ()):
+            if start <= minute < end or start <= minute + MINUTES_PER_WEEK < end:
+                return True
+        return False
+
+    def starting_within(self, minutes, dt=None):
+        """Return (minutes_until_start, venue_id) pairs for happy hours starting soon"""
+        now = minute_of_week(dt)
+        upcoming = []
+        windows = [(now, now + minutes)]
+        if now + minutes > MINUTES_PER_WEEK:
+            windows = [(now, MINUTES_PER_WEEK), (0, now + minutes - MINUTES_PER_WEEK)]
+        start_minutes = self._start_minutes
+        for low, high in windows:
+            pos = bisect.bisect_left(start_minutes, low)
+            while pos < len(start_minutes) and start_minutes[pos] <= high:
+                upcoming.append(((start_minutes[pos] - now) % MINUTES_PER_WEEK, self._start_venues[pos]))
+                pos += 1
+        upcoming.sort()
+        return upcoming
@@ -0,0 +1,295 @@
+import heapq
+from array import array
+import math
+
+try:
+    import numpy as np
+except ImportError:  # optional: batch distances fall back to a Python loop
+    np = None
+
+EARTH_RADIUS_KM = 6371
+# Kilometres per degree of latitude
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+# Bounds for the automatically chosen grid cell size, in degrees
+MIN_CELL_SIZE = 0.001
+MAX_CELL_SIZE = 0.05
+# Average number of points per cell the automatic cell size aims for
+TARGET_POINTS_PER_CELL = 8
+# Below this many points NumPy's per-call overhead outweighs vectorizing
+NUMPY_MIN_BATCH = 64
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate the distance between two points in kilometers"""
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+    return EARTH_RADIUS_KM * c
+
+
+def _as_numpy(values):
+    """View a float array/memoryview as a NumPy array without copying"""
+    if isinstance(values, (array, memoryview)):
+        return np.frombuffer(values, dtype=np.float64)
+    return np.asarray(values, dtype=np.float64)
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distances in km from one point to many, given parallel latitude/longitude sequences.
+
+    Uses NumPy when it is installed and the batch is large enough, and returns a
+    float sequence either way (NaN where a coordinate is NaN).
+    """
+    if np is not None and len(lats) >= NUMPY_MIN_BATCH:
+        lat1 = math.radians(lat)
+        lats2 = np.radians(_as_numpy(lats))
+        lons2 = np.radians(_as_numpy(lons))
+        a = np.sin((lats2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lats2) * np.sin((lons2 - math.radians(lon)) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+    lat1 = math.radians(lat)
+    lon1 = math.radians(lon)
+    cos_lat1 = math.cos(lat1)
+    radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+    distances = array('d')
+    for lat2, lon2 in zip(lats, lons):
+        lat2 = radians(lat2)
+        a = sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos(lat2) * sin((radians(lon2) - lon1) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * asin(sqrt(min(1.0, a))) if a == a else math.nan)
+    return distances
+
+
+def auto_cell_size(points, target=TARGET_POINTS_PER_CELL):
+    """Pick a cell size giving roughly `target` points per cell over the points' extent"""
+    if len(points) < 2:
+        return MAX_CELL_SIZE
+    lats = [lat for _, lat, _ in points]
+    lons = [lon for _, _, lon in points]
+    area = max(max(lats) - min(lats), MIN_CELL_SIZE) * max(max(lons) - min(lons), MIN_CELL_SIZE)
+    size = math.sqrt(area * target / len(points))
+    return min(MAX_CELL_SIZE, max(MIN_CELL_SIZE, size))
+
+
+class SpatialIndex:
+    """Uniform lat/lon grid over points, answering radius and k-nearest queries.
+
+    Points are bucketed into square cells of `cell_size` degrees; by default the
+    size is derived from the point density. Queries only visit the cells that can
+    contain a match, expanding ring by ring around the query cell, and keep at
+    most k candidates in a bounded heap. Cells store their coordinates in flat
+    arrays so each ring's distances are computed in one batch.
+    """
+
+    def __init__(self, points, cell_size=None):
+        """Build the index from an iterable of (item_id, latitude, longitude)"""
+        points = list(points)
+        self.cell_size = cell_size or auto_cell_size(points)
+        self._cells = {}
+        self._size = 0
+        self._bounds = None
+        for item_id, lat, lon in points:
+            self.add(item_id, lat, lon)
+
+    def __len__(self):
+        return self._size
+
+    def to_arrays(self):
+        """Flatten the grid into typed arrays, cell by cell (see from_arrays)"""
+        cells = sorted(self._cells)
+        arrays = {
+            'cell_rows': array('q', (row for row, _ in cells)),
+            'cell_cols': array('q', (col for _, col in cells)),
+            'cell_offsets': array('q', [0]),
+            'ids': array('q'),
+            'lats': array('d'),
+            'lons': array('d'),
+        }
+        for cell in cells:
+            ids, lats, lons = self._cells[cell]
+            arrays['ids'].extend(ids)
+            arrays['lats'].extend(lats)
+            arrays['lons'].extend(lons)
+            arrays['cell_offsets'].append(len(arrays['ids']))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, cell_size, arrays):
+        """Rebuild an index of integer ids from to_arrays() output (arrays or memoryviews)"""
+        index = cls((), cell_size=cell_size)
+        offsets = arrays['cell_offsets']
+        ids = arrays['ids']
+        lats = memoryview(arrays['lats']).cast('B')
+        lons = memoryview(arrays['lons']).cast('B')
+        width = array('d').itemsize
+        for pos, cell in enumerate(zip(arrays['cell_rows'], arrays['cell_cols'])):
+            start, end = offsets[pos], offsets[pos + 1]
+            bucket = (list(ids[start:end]), array('d'), array('d'))
+            bucket[1].frombytes(lats[start * width:end * width])
+            bucket[2].frombytes(lons[start * width:end * width])
+            index._cells[cell] = bucket
+        if index._cells:
+            rows = [row for row, _ in index._cells]
+            cols = [col for _, col in index._cells]
+            index._bounds = [min(rows), max(rows), min(cols), max(cols)]
+        index._size = len(ids)
+        return index
+
+    def cell_of(self, lat, lon):
+        """Return the (row, col) grid cell containing a point"""
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def add(self, item_id, lat, lon):
+        """Insert a point into the index"""
+        cell = self.cell_of(lat, lon)
+        bucket = self._cells.get(cell)
+        if bucket is None:
+            # Columnar bucket: ids plus contiguous coordinate arrays
+            bucket = self._cells[cell] = ([], array('d'), array('d'))
+        bucket[0].append(item_id)
+        bucket[1].append(lat)
+        bucket[2].append(lon)
+        self._size += 1
+        row, col = cell
+        if self._bounds is None:
+            self._bounds = [row, row, col, col]
+        else:
+            bounds = self._bounds
+            bounds[0] = min(bounds[0], row)
+            bounds[1] = max(bounds[1], row)
+            bounds[2] = min(bounds[2], col)
+            bounds[3] = max(bounds[3], col)
+
+    def updated(self, removed=(), added=()):
+        """A copy without the `removed` and with the `added` (item_id, latitude, longitude) points.
+
+        Cells neither touches are shared with this index, which stays unchanged.
+        """
+        index = SpatialIndex.__new__(SpatialIndex)
+        index.cell_size = self.cell_size
+        index._cells = dict(self._cells)
+        index._size = self._size
+        index._bounds = list(self._bounds) if self._bounds is not None else None
+        emptied = False
+        for item_id, lat, lon in removed:
+            cell = self.cell_of(lat, lon)
+            ids, lats, lons = index._cells[cell]
+            pos = ids.index(item_id)
+            bucket = (ids[:pos] + ids[pos + 1:], array('d', lats), array('d', lons))
+            del bucket[1][pos]
+            del bucket[2][pos]
+            if bucket[0]:
+                index._cells[cell] = bucket
+            else:
+                del index._cells[cell]
+                emptied = True
+            index._size -= 1
+        if emptied:
+            rows = [row for row, _ in index._cells]
+            cols = [col for _, col in index._cells]
+            index._bounds = [min(rows), max(rows), min(cols), max(cols)] if rows else None
+        copied = set()
+        for item_id, lat, lon in added:
+            cell = self.cell_of(lat, lon)
+            if cell in index._cells and cell not in copied:
+                ids, lats, lons = index._cells[cell]
+                index._cells[cell] = (list(ids), array('d', lats), array('d', lons))
+            copied.add(cell)
+            index.add(item_id, lat, lon)
+        return index
+
+    def _ring(self, center, r):
+        """Yield the non-empty cells at Chebyshev distance r from center"""
+        row0, col0 = center
+        cells = self._cells
+        if r == 0:
+            if center in cells:
+                yield cells[center]
+            return
+        for col in range(col0 - r, col0 + r + 1):
+            for row in (row0 - r, row0 + r):
+                bucket = cells.get((row, col))
+                if bucket:
+                    yield bucket
+        for row in range(row0 - r + 1, row0 + r):
+            for col in (col0 - r, col0 + r):
+                bucket = cells.get((row, col))
+                if bucket:
+                    yield bucket
+
+    def _ring_distances(self, lat, lon, center, r):
+        """Return (item ids, distances) for every point in ring r, computed in one batch"""
+        ids = []
+        lats = array('d')
+        lons = array('d')
+        for bucket_ids, bucket_lats, bucket_lons in self._ring(center, r):
+            ids.extend(bucket_ids)
+            lats.extend(bucket_lats)
+            lons.extend(bucket_lons)
+        return ids, haversine_km(lat, lon, lats, lons)
+
+    def _max_ring(self, center):
+        """Smallest ring radius that covers every occupied cell"""
+        if self._bounds is None:
+            return -1
+        row0, col0 = center
+        min_row, max_row, min_col, max_col = self._bounds
+        return max(abs(row0 - min_row), abs(row0 - max_row), abs(col0 - min_col), abs(col0 - max_col))
+
+    def _ring_min_km(self, lat, r):
+        """Lower bound on the distance from a point to anything in ring r"""
+        if r <= 1:
+            return 0.0
+        # Use the widest latitude the ring can reach so the bound stays conservative
+        edge_lat = min(89.0, abs(lat) + r * self.cell_size)
+        km_per_cell = self.cell_size * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+        return (r - 1) * km_per_cell * 0.99
+
+    def radius(self, lat, lon, radius_km, limit=None):
+        """Return (distance_km, item_id) pairs within radius_km, closest first"""
+        if limit is not None:
+            return self.nearest(lat, lon, limit, max_km=radius_km)
+        center = self.cell_of(lat, lon)
+        max_ring = self._max_ring(center)
+        matches = []
+        r = 0
+        while r <= max_ring and self._ring_min_km(lat, r) <= radius_km:
+            ids, distances = self._ring_distances(lat, lon, center, r)
+            matches.extend(
+                (float(distance), item_id)
+                for distance, item_id in zip(distances, ids)
+                if distance <= radius_km
+            )
+            r += 1
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def nearest(self, lat, lon, k, max_km=None):
+        """Return up to k (distance_km, item_id) pairs closest to a point, closest first"""
+        if k <= 0:
+            return []
+        center = self.cell_of(lat, lon)
+        max_ring = self._max_ring(center)
+        # Max-heap of the best k so far, stored as (-distance, seq, item_id)
+        heap = []
+        seq = 0
+        r = 0
+        while r <= max_ring:
+            ring_min = self._ring_min_km(lat, r)
+            if max_km is not None and ring_min > max_km:
+                break
+            if len(heap) == k and ring_min > -heap[0][0]:
+                break
+            ids, distances = self._ring_distances(lat, lon, center, r)
+            for item_id, distance in zip(ids, distances):
+                if max_km is not None and distance > max_km:
+                    continue
+                seq += 1
+                if len(heap) < k:
+                    heapq.heappush(heap, (-float(distance), seq, item_id))
+                elif distance < -heap[0][0]:
+                    heapq.heapreplace(heap, (-float(distance), seq, item_id))
+            r += 1
+        return [(-neg_distance, item_id) for neg_distance, _, item_id in sorted(heap, reverse=True)]
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_key(update):
+    """Return the key updates are serialized on: the chat, else the user, else None"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats concurrently, but one at a time per chat.
+
+    ConversationHandler state and user_data assume a user's taps are handled in the
+    order they were sent. Each chat gets a FIFO lock for as long as it has updates in
+    flight, so a burst from one user is serialized while other chats proceed in
+    parallel up to `max_concurrent_updates`. Only updates whose chat's turn has come
+    count against that limit; the rest of a burst waits without taking a slot.
+    """
+
+    __slots__ = ("_chat_locks",)
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # chat key -> [lock, number of updates holding or waiting for it]
+        self._chat_locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        """Await the update's coroutine while holding its chat's lock"""
+        key = update_chat_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        lock = entry[0]
+        # process_update already holds one of the global slots. Waiting for the
+        # chat's turn with it would let one chat's burst starve every other chat,
+        # so queue behind the chat without a slot and take one back once it's our turn
+        waiting = entry[1] > 1
+        if waiting:
+            self._semaphore.release()
+        try:
+            async with lock:
+                if waiting:
+                    await self._semaphore.acquire()
+                    waiting = False
+                await coroutine
+        finally:
+            if waiting:
+                # Cancelled while queued: process_update still releases a slot on the way out
+                await self._semaphore.acquire()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+
+    async def initialize(self):
+        """Nothing to set up"""
+
+    async def shutdown(self):
+        """Forget the per-chat locks"""
+        if self._chat_locks:
+            logger.warning(f"Shutting down with {len(self._chat_locks)} chats still in flight")
+        self._chat_locks.clear()
@@ -0,0 +1,114 @@
+from popularity import venue_key
+from schedule import venue_intervals
+from venue_model import make_venues, same_venue
+
+
+def venue_keys(venues):
+    """Map each venue's identity to its id: (venue_key, n) for the n-th venue sharing a key.
+
+    Removed venues (None) are skipped.
+    """
+    keys = {}
+    seen = {}
+    for idx, venue in enumerate(venues):
+        if venue is None:
+            continue
+        key = venue_key(venue)
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        keys[(key, count)] = idx
+    return keys
+
+
+class VenueDiff:
+    """Venues added, removed and changed between two versions of a dataset.
+
+    Venue ids stay stable: a changed venue keeps its id, a removed one leaves an
+    empty slot and new ones are appended. `removed` holds the previous record of
+    every removed or changed id and `added` the new record of every added or
+    changed id, so indexes can drop the old entries and insert the new ones.
+    """
+
+    __slots__ = ('base_version', 'removed', 'added', 'keys', 'length')
+
+    def __init__(self, base_version, removed, added, keys, length):
+        self.base_version = base_version
+        self.removed = removed
+        self.added = added
+        # Venue identities of the new version, for the next diff
+        self.keys = keys
+        # Number of venue ids (slots) in the new version
+        self.length = length
+
+    def __len__(self):
+        """Number of venue ids the diff touches"""
+        return len(self.touched)
+
+    @property
+    def touched(self):
+        return self.removed.keys() | self.added.keys()
+
+    @property
+    def changed(self):
+        return self.removed.keys() & self.added.keys()
+
+    def names_touched(self):
+        """True if any venue's name or address is new, gone or different"""
+        for idx in self.touched:
+            old, new = self.removed.get(idx), self.added.get(idx)
+            if old is None or new is None or (old.name, old.address) != (new.name, new.address):
+                return True
+        return False
+
+    def schedules_touched(self):
+        """True if any touched venue has happy hours before or after the change"""
+        return any(venue_intervals(venue) for venue in (*self.removed.values(), *self.added.values()))
+
+    def points(self, moved_only=False):
+        """Old and new (lat, lon) of the touched venues, or with `moved_only` of those
+        that were added, removed or moved"""
+        points = set()
+        for idx in self.touched:
+            old, new = self.removed.get(idx), self.added.get(idx)
+            if moved_only and old is not None and new is not None and \
+                    (old.latitude, old.longitude) == (new.latitude, new.longitude):
+                continue
+            for venue in (old, new):
+                if venue is not None and venue.latitude and venue.longitude:
+                    points.add((venue.latitude, venue.longitude))
+        return points
+
+
+def diff_venues(venues, keys, raw_venues, base_version=None):
+    """Compare a snapshot's venues with newly parsed JSON venue objects.
+
+    `keys` is venue_keys(venues), or None to compute it. Venues are matched by
+    name and address, so a renamed venue counts as removed and added again.
+    """
+    if keys is None:
+        keys = venue_keys(venues)
+    removed = {}
+    added = {}
+    new_keys = {}
+    seen = {}
+    length = len(venues)
+    for raw in raw_venues:
+        key = venue_key(raw)
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        idx = keys.get((key, count))
+        if idx is None:
+            idx = length
+            length += 1
+            added[idx] = raw
+        elif not same_venue(venues[idx], raw):
+            removed[idx] = venues[idx]
+            added[idx] = raw
+        new_keys[(key, count)] = idx
+    kept = set(new_keys.values())
+    for idx in keys.values():
+        if idx not in kept:
+            removed[idx] = venues[idx]
+    # Only the new and changed venues need records of their own
+    added = dict(zip(added, make_venues(added.values())))
+    return VenueDiff(base_version, removed, added, new_keys, length)
@@ -0,0 +1,243 @@
+import math
+import sys
+from array import array
+from collections import namedtuple
+from types import MappingProxyType
+
+from spatial_index import haversine_km
+
+# Fields every venue record has, in the order they are stored
+VENUE_FIELDS = ('name', 'address', 'latitude', 'longitude', 'deal', 'hours', 'phone', 'website', 'vibe')
+_FIELD_SET = frozenset(VENUE_FIELDS)
+# Positions of the text fields whose values repeat across venues and are worth sharing
+_SHARED_POSITIONS = tuple(VENUE_FIELDS.index(key) for key in ('address', 'deal', 'hours'))
+# Areas (and vibes) one VenueColumns can track, one bit each of a 64-bit mask
+MAX_TRACKED_NAMES = 64
+
+
+class Venue(namedtuple('Venue', VENUE_FIELDS + ('extra',))):
+    """Immutable venue record.
+
+    Stores the known fields in a tuple instead of a per-venue dict; any other keys
+    from the source data are kept in `extra`. `get` mirrors dict.get so code written
+    against the raw JSON objects keeps working.
+    """
+
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+        elif self.extra is not None:
+            value = self.extra.get(key)
+        else:
+            value = None
+        return default if value is None else value
+
+    def to_dict(self):
+        """Return the venue as the plain dict it was built from"""
+        data = {key: getattr(self, key) for key in VENUE_FIELDS if getattr(self, key) is not None}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+class _Interner:
+    """Shares equal strings and vibe mappings between venue records"""
+
+    def __init__(self):
+        self._vibes = {}
+
+    @staticmethod
+    def text(value):
+        return sys.intern(value) if isinstance(value, str) else value
+
+    def vibe(self, value):
+        if not isinstance(value, dict):
+            return self.text(value)
+        key = tuple(sorted((str(k), str(v)) for k, v in value.items()))
+        shared = self._vibes.get(key)
+        if shared is None:
+            shared = self._vibes[key] = MappingProxyType({sys.intern(k): sys.intern(v) for k, v in key})
+        return shared
+
+
+def make_venues(raw_venues):
+    """Convert parsed JSON venue objects into a tuple of Venue records"""
+    interner = _Interner()
+    venues = []
+    for raw in raw_venues:
+        values = [raw.get(key) for key in VENUE_FIELDS]
+        for pos in _SHARED_POSITIONS:
+            values[pos] = interner.text(values[pos])
+        values[-1] = interner.vibe(values[-1])
+        extra = None
+        if not _FIELD_SET.issuperset(raw):
+            extra = MappingProxyType({key: value for key, value in raw.items() if key not in _FIELD_SET})
+        venues.append(Venue(*values, extra))
+    return tuple(venues)
+
+
+def same_venue(venue, raw):
+    """True if a record holds exactly what a parsed JSON venue object says"""
+    for key, value in zip(VENUE_FIELDS, venue):
+        if raw.get(key) != value:
+            return False
+    if _FIELD_SET.issuperset(raw):
+        return not venue.extra
+    return venue.extra == {key: value for key, value in raw.items() if key not in _FIELD_SET}
+
+
+class PatchedVenues:
+    """Read-only sequence of venues: a base sequence with some ids replaced or appended.
+
+    Used for snapshots updated in place of a full reload, so the unchanged records
+    (possibly a mapped compiled file) are shared with the previous snapshot.
+    Removed venues read as None.
+    """
+
+    __slots__ = ('_base', '_changes', '_length')
+
+    def __init__(self, base, changes, length):
+        if isinstance(base, PatchedVenues):
+            # Flatten, so repeated updates don't build a chain of lookups
+            changes = {**base._changes, **changes}
+            base = base._base
+        self._base = base
+        self._changes = changes
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return tuple(self[pos] for pos in range(*idx.indices(len(self))))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("venue index out of range")
+        try:
+            return self._changes[idx]
+        except KeyError:
+            return self._base[idx]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class VenueColumns:
+    """Column-oriented view of a venue tuple for bulk computations.
+
+    Coordinates live in contiguous float arrays (NaN when missing), and area and
+    vibe membership in 64-bit masks indexing `area_names`/`vibe_names`,
+    so a whole dataset can be filtered or measured without touching the records.
+    """
+
+    __slots__ = ('latitude', 'longitude', 'area_mask', 'vibe_mask', 'area_names', 'vibe_names')
+
+    def __init__(self, venues, area_names=(), vibe_names=()):
+        if len(area_names) > MAX_TRACKED_NAMES or len(vibe_names) > MAX_TRACKED_NAMES:
+            raise ValueError(f"at most {MAX_TRACKED_NAMES} area and {MAX_TRACKED_NAMES} vibe names can be tracked")
+        nan = math.nan
+        self.latitude = array('d', (nan if v.latitude is None else v.latitude for v in venues))
+        self.longitude = array('d', (nan if v.longitude is None else v.longitude for v in venues))
+        self.area_names = tuple(area_names)
+        self.vibe_names = tuple(vibe_names)
+        self.area_mask = array('Q', bytes(8 * len(venues)))
+        self.vibe_mask = array('Q', bytes(8 * len(venues)))
+
+    def __len__(self):
+        return len(self.latitude)
+
+    @classmethod
+    def from_indexes(cls, venues, areas, vibes, area_names, vibe_names):
+        """Build the columns, taking area/vibe membership from prebuilt indexes"""
+        columns = cls(venues, area_names, vibe_names)
+        for mask, index, names in ((columns.area_mask, areas, area_names), (columns.vibe_mask, vibes, vibe_names)):
+            for bit, name in enumerate(names):
+                for idx in index.lookup(name):
+                    mask[idx] |= 1 << bit
+        return columns
+
+    def updated(self, changes, length, areas, vibes):
+        """A copy with the venues in `changes` ({venue_id: venue or None}) replaced.
+
+        Membership of the changed venues is taken from the area and vibe indexes'
+        rules; a None venue is cleared. Ids up to `length` are appended as needed.
+        """
+        columns = VenueColumns.__new__(VenueColumns)
+        columns.area_names = self.area_names
+        columns.vibe_names = self.vibe_names
+        for name, typecode, blank in (('latitude', 'd', math.nan), ('longitude', 'd', math.nan),
+                                      ('area_mask', 'Q', 0), ('vibe_mask', 'Q', 0)):
+            source = getattr(self, name)
+            column = array(typecode)
+            if getattr(source, 'typecode', getattr(source, 'format', None)) == typecode:
+                column.frombytes(memoryview(source).cast('B'))
+            else:
+                # Masks mapped from a snapshot compiled with narrower columns
+                column.extend(source)
+            column.extend([blank] * (length - len(column)))
+            setattr(columns, name, column)
+        for idx, venue in changes.items():
+            if venue is None:
+                lat = lon = math.nan
+                area_mask = vibe_mask = 0
+            else:
+                lat = math.nan if venue.latitude is None else venue.latitude
+                lon = math.nan if venue.longitude is None else venue.longitude
+                found = areas.areas_of(venue)
+                tags = set(vibes.tags_of(venue))
+                area_mask = sum(1 << bit for bit, name in enumerate(self.area_names) if name in found)
+                vibe_mask = sum(1 << bit for bit, name in enumerate(self.vibe_names) if name in tags)
+            columns.latitude[idx] = lat
+            columns.longitude[idx] = lon
+            columns.area_mask[idx] = area_mask
+            columns.vibe_mask[idx] = vibe_mask
+        return columns
+
+    def to_arrays(self):
+        """Typed arrays for the compiled snapshot (see from_arrays)"""
+        return {
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'area_mask': self.area_mask,
+            'vibe_mask': self.vibe_mask,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, area_names, vibe_names):
+        """Wrap to_arrays() output, e.g. memoryviews over a mapped file, without copying"""
+        columns = cls.__new__(cls)
+        for name in ('latitude', 'longitude', 'area_mask', 'vibe_mask'):
+            setattr(columns, name, arrays[name])
+        columns.area_names = tuple(area_names)
+        columns.vibe_names = tuple(vibe_names)
+        return columns
+
+    def _bit(self, names, name):
+        try:
+            return 1 << names.index(name)
+        except ValueError:
+            return None
+
+    def select(self, area=None, vibe=None):
+        """Ids of venues in an area and/or with a vibe (canonical names), in order"""
+        wanted = []
+        if area is not None:
+            wanted.append((self.area_mask, self._bit(self.area_names, area)))
+        if vibe is not None:
+            wanted.append((self.vibe_mask, self._bit(self.vibe_names, vibe)))
+        if any(bit is None for _, bit in wanted):
+            return []
+        return [idx for idx in range(len(self)) if all(mask[idx] & bit for mask, bit in wanted)]
+
+    def distances_from(self, lat, lon, ids=None):
+        """Distances in km from a point to the given venues (all by default), NaN when unknown"""
+        if ids is None:
+            return haversine_km(lat, lon, self.latitude, self.longitude)
+        lats = array('d', (self.latitude[idx] for idx in ids))
+        lons = array('d', (self.longitude[idx] for idx in ids))
+        return haversine_km(lat, lon, lats, lons)
@@ -0,0 +1,353 @@
+import bisect
+import heapq
+from array import array
+
+from area_index import tokenize
+
+# Most venues a single search returns; inline results are paged through these
+MAX_RESULTS = 200
+# How many vocabulary terms one typed prefix may expand to
+MAX_PREFIX_TERMS = 64
+# Minimum share of a token's trigrams a vocabulary term must contain to count as a typo match
+MIN_TRIGRAM_SIMILARITY = 0.5
+
+# Match scores: how well a query token matched, and where
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+SOUND_SCORE = 0.7
+FUZZY_SCORE = 0.6
+ADDRESS_WEIGHT = 0.6
+
+# Street-type words nearly every address contains; ignored unless they're all that was typed
+STOP_WORDS = frozenset((
+    'st', 'street', 'rd', 'road', 'ave', 'avenue', 'blvd', 'boulevard',
+    'רחוב', 'רח', 'שד', 'שדרות', 'דרך',
+))
+
+NAME_FIELD = 0
+ADDRESS_FIELD = 1
+
+# How Hebrew letters are usually romanized in Tel Aviv names; ו and י read as vowels
+_HEBREW_SOUNDS = {
+    'א': '', 'ב': 'v', 'ג': 'g', 'ד': 'd', 'ה': 'h', 'ו': 'u', 'ז': 'z', 'ח': 'h', 'ט': 't',
+    'י': 'i', 'כ': 'k', 'ך': 'k', 'ל': 'l', 'מ': 'm', 'ם': 'm', 'נ': 'n', 'ן': 'n', 'ס': 's',
+    'ע': '', 'פ': 'f', 'ף': 'f', 'צ': 'ts', 'ץ': 'ts', 'ק': 'k', 'ר': 'r', 'ש': 'sh', 'ת': 't',
+}
+# Latin spellings that sound alike, folded before vowels are dropped (order matters)
+_LATIN_FOLDS = (
+    ('sch', 'sh'), ('tz', 'ts'), ('ph', 'f'), ('th', 't'), ('ch', 'h'), ('kh', 'h'),
+    ('ck', 'k'), ('c', 'k'), ('q', 'k'), ('w', 'v'), ('b', 'v'), ('p', 'f'),
+)
+_VOWELS = frozenset('aeiouy')
+
+
+def _is_hebrew(token):
+    return any('א' <= ch <= 'ת' for ch in token)
+
+
+def sound_key(token):
+    """Script-independent consonant skeleton of a normalized token.
+
+    Hebrew is romanized letter by letter and Latin spellings that sound alike are
+    folded, then vowels and doubled letters are dropped, so "דיזנגוף", "dizengoff"
+    and "dizengof" all become "dzngf". Returns '' for tokens too short to compare.
+    """
+    if _is_hebrew(token):
+        # A final ה is usually silent ("תחנה" -> "tahana")
+        if len(token) > 2 and token.endswith('ה'):
+            token = token[:-1]
+        token = ''.join(_HEBREW_SOUNDS.get(ch, ch) for ch in token)
+    elif not token.isalpha():
+        return ''
+    for spelling, sound in _LATIN_FOLDS:
+        token = token.replace(spelling, sound)
+    key = []
+    for ch in token:
+        if ch in _VOWELS or (key and key[-1] == ch):
+            continue
+        key.append(ch)
+    return ''.join(key) if len(key) >= 2 else ''
+
+
+def trigrams(term):
+    """Distinct trigrams of a term, padded so its start weighs like the rest"""
+    padded = f"  {term} "
+    return {padded[pos:pos + 3] for pos in range(len(padded) - 2)}
+
+
+class _TermIndex:
+    """Sorted terms with an int posting list each, kept flat like the compiled snapshot.
+
+    Prefix lookups are a bisect range over the sorted terms, i.e. a trie flattened
+    into an array: all completions of a prefix are adjacent.
+    """
+
+    def __init__(self, terms, offsets, postings, fields=None):
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        # Per term: bit 0 if it occurs in a name, bit 1 if in an address
+        self.fields = fields
+
+    @classmethod
+    def build(cls, posting_lists, with_fields=False):
+        """Build from {term: array of ints}"""
+        terms = sorted(posting_lists)
+        offsets = array('q', [0])
+        postings = array('i')
+        fields = array('B') if with_fields else None
+        for term in terms:
+            entries = posting_lists[term]
+            postings.extend(entries)
+            offsets.append(len(postings))
+            if with_fields:
+                fields.append(sum({1 << (entry & 1) for entry in entries}))
+        return cls(terms, offsets, postings, fields)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def find(self, term):
+        """Position of an exact term, or -1"""
+        pos = bisect.bisect_left(self.terms, term)
+        return pos if pos < len(self.terms) and self.terms[pos] == term else -1
+
+    def prefix_range(self, prefix):
+        """Positions [start, stop) of the terms starting with prefix"""
+        start = bisect.bisect_left(self.terms, prefix)
+        stop = bisect.bisect_left(self.terms, prefix + '\U0010ffff', start)
+        return start, stop
+
+    def postings_at(self, pos):
+        return self.postings[self.offsets[pos]:self.offsets[pos + 1]]
+
+    def best_weight(self, pos):
+        """Largest field weight any posting of a term carries"""
+        return ADDRESS_WEIGHT if self.fields[pos] == 1 << ADDRESS_FIELD else 1.0
+
+    def to_arrays(self, prefix):
+        arrays = {
+            f'{prefix}_terms': list(self.terms),
+            f'{prefix}_offsets': self.offsets,
+            f'{prefix}_postings': self.postings,
+        }
+        if self.fields is not None:
+            arrays[f'{prefix}_fields'] = self.fields
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(
+            arrays[f'{prefix}_terms'], arrays[f'{prefix}_offsets'], arrays[f'{prefix}_postings'],
+            arrays.get(f'{prefix}_fields'),
+        )
+
+
+def _append(posting_lists, term, entry):
+    entries = posting_lists.get(term)
+    if entries is None:
+        posting_lists[term] = array('i', [entry])
+    elif entries[-1] != entry:
+        entries.append(entry)
+
+
+class SearchIndex:
+    """Ranked, typo-tolerant search over venue names and addresses in Hebrew and English.
+
+    Three term indexes are built once per snapshot: the normalized words themselves,
+    their sound keys (so Hebrew queries find romanized names and vice versa), and the
+    trigrams of every word for typo tolerance. Postings hold `venue_id << 1 | field`
+    so a name match can outrank an address match without a second lookup.
+    """
+
+    def __init__(self, venues, ids=None):
+        """Index venues by position, or by the ascending `ids` given alongside them"""
+        words = {}
+        sounds = {}
+        # Names and addresses share most of their words, so each is keyed once
+        sound_of = {}
+        for idx, venue in zip(ids, venues) if ids is not None else enumerate(venues):
+            for field, text in ((NAME_FIELD, venue.get('name')), (ADDRESS_FIELD, venue.get('address'))):
+                if not text:
+                    continue
+                entry = idx << 1 | field
+                for token in tokenize(text):
+                    _append(words, token, entry)
+                    key = sound_of.get(token)
+                    if key is None:
+                        key = sound_of[token] = sound_key(token)
+                    if key:
+                        _append(sounds, key, entry)
+        self._words = _TermIndex.build(words, with_fields=True)
+        self._sounds = _TermIndex.build(sounds, with_fields=True)
+        grams = {}
+        for pos, term in enumerate(self._words.terms):
+            if len(term) >= 3 and not term.isdigit():
+                for gram in trigrams(term):
+                    _append(grams, gram, pos)
+        self._trigrams = _TermIndex.build(grams)
+        self._hidden = frozenset()
+        self._overlay = None
+
+    def to_arrays(self):
+        """Flatten the term indexes into typed arrays (see from_arrays)"""
+        arrays = self._words.to_arrays('words')
+        arrays.update(self._sounds.to_arrays('sounds'))
+        arrays.update(self._trigrams.to_arrays('trigrams'))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild an index from to_arrays() output, e.g. views over a mapped file"""
+        index = cls.__new__(cls)
+        index._words = _TermIndex.from_arrays(arrays, 'words')
+        index._sounds = _TermIndex.from_arrays(arrays, 'sounds')
+        index._trigrams = _TermIndex.from_arrays(arrays, 'trigrams')
+        index._hidden = frozenset()
+        index._overlay = None
+        return index
+
+    def updated(self, removed, added):
+        """A copy without the `removed` venue ids and with the `added` {venue_id: venue}.
+
+        The flat term indexes can't take insertions, so they are shared as they
+        are: removed and changed ids are hidden from their results, and changed or
+        new venues go into a small overlay index searched alongside them.
+        """
+        index = SearchIndex.__new__(SearchIndex)
+        index._words = self._words
+        index._sounds = self._sounds
+        index._trigrams = self._trigrams
+        index._hidden = self._hidden | frozenset(removed)
+        overlay = {}
+        if self._overlay is not None:
+            overlay.update((idx, venue) for idx, venue in self._overlay_venues.items() if idx not in removed)
+        overlay.update(added)
+        index._overlay = None
+        if overlay:
+            ids = sorted(overlay)
+            index._overlay = SearchIndex([overlay[idx] for idx in ids], ids)
+            index._overlay_venues = overlay
+        return index
+
+    @staticmethod
+    def _score_postings(scores, postings, score, candidates=None):
+        """Raise each venue's score to what this posting list gives it.
+
+        With `candidates`, only those venues are scored: each is looked up by bisect
+        in the id-sorted postings, so a rare word can filter a common one cheaply.
+        """
+        if candidates is not None and len(postings) > 4 * len(candidates):
+            for idx in candidates:
+                for entry, value in ((idx << 1, score), (idx << 1 | 1, score * ADDRESS_WEIGHT)):
+                    pos = bisect.bisect_left(postings, entry)
+                    if pos < len(postings) and postings[pos] == entry and value > scores.get(idx, 0.0):
+                        scores[idx] = value
+            return
+        for entry in postings:
+            idx = entry >> 1
+            if candidates is not None and idx not in candidates:
+                continue
+            value = score if not entry & 1 else score * ADDRESS_WEIGHT
+            if value > scores.get(idx, 0.0):
+                scores[idx] = value
+
+    def _similar_terms(self, token):
+        """Word positions sharing most of the token's trigrams, with their similarity"""
+        wanted = trigrams(token)
+        shared = {}
+        for gram in wanted:
+            pos = self._trigrams.find(gram)
+            if pos >= 0:
+                for term_pos in self._trigrams.postings_at(pos):
+                    shared[term_pos] = shared.get(term_pos, 0) + 1
+        similar = []
+        for term_pos, count in shared.items():
+            # Containment rather than Jaccard, so a half-typed word still matches;
+            # a little penalty for length differences keeps short exact-ish terms first
+            similarity = count / len(wanted) - 0.02 * abs(len(self._words.terms[term_pos]) - len(token))
+            if similarity >= MIN_TRIGRAM_SIMILARITY:
+                similar.append((similarity, term_pos))
+        return heapq.nlargest(MAX_PREFIX_TERMS, similar)
+
+    def _sources(self, token, skip_stop_words=False):
+        """(best value, score, postings) for every term the token matches, best first.
+
+        Falls back to similar-looking words when the spelling and sound match nothing.
+        """
+        sources = []
+        for index, key, exact, partial in (
+            (self._words, token, EXACT_SCORE, None),
+            (self._sounds, sound_key(token), SOUND_SCORE, SOUND_SCORE * 0.8),
+        ):
+            if not key:
+                continue
+            start, stop = index.prefix_range(key)
+            for pos in range(start, min(stop, start + MAX_PREFIX_TERMS)):
+                term = index.terms[pos]
+                if skip_stop_words and term in STOP_WORDS:
+                    continue
+                if term == key:
+                    score = exact
+                elif partial is None:
+                    # Prefer completions that need fewer extra letters
+                    score = PREFIX_SCORE * (0.75 + 0.25 * len(key) / len(term))
+                else:
+                    score = partial
+                sources.append((score * index.best_weight(pos), score, index.postings_at(pos)))
+
+        # Typo tolerance only when the spelling found nothing, keeping the common path cheap
+        if not sources and len(token) >= 3 and not token.isdigit():
+            for similarity, pos in self._similar_terms(token):
+                score = FUZZY_SCORE * min(1.0, similarity)
+                sources.append((score * self._words.best_weight(pos), score, self._words.postings_at(pos)))
+        sources.sort(key=lambda source: -source[0])
+        return sources
+
+    def _token_scores(self, sources, limit=None, candidates=None):
+        """Best score per venue id for one query token's sources.
+
+        With a `limit`, stops once that many venues score strictly higher than any
+        remaining term could give, so one-letter prefixes don't scan the whole index.
+        """
+        scores = {}
+        checked = None
+        for best, score, postings in sources:
+            if limit is not None and len(scores) >= limit and best != checked:
+                checked = best
+                if sum(1 for value in scores.values() if value > best) >= limit:
+                    break
+            self._score_postings(scores, postings, score, candidates)
+        return scores
+
+    def search(self, query, limit=MAX_RESULTS):
+        """Venue ids matching every word of the query, best match first"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        tokens = [token for token in tokens if token not in STOP_WORDS] or tokens
+        totals = self._totals(tokens, limit + len(self._hidden))
+        if self._hidden:
+            totals = {idx: total for idx, total in totals.items() if idx not in self._hidden}
+        if self._overlay is not None:
+            totals.update(self._overlay._totals(tokens, limit))
+        ranked = heapq.nsmallest(limit, totals.items(), key=lambda item: (-item[1], item[0]))
+        return [idx for idx, _ in ranked]
+
+    def _totals(self, tokens, limit):
+        """Total score per venue id matching every token, at least the best `limit` of them"""
+        if len(tokens) == 1:
+            totals = self._token_scores(self._sources(tokens[0]), limit)
+        else:
+            # Rarest word first; the others only score the venues still in the running
+            per_token = sorted(
+                (self._sources(token, skip_stop_words=True) for token in tokens),
+                key=lambda sources: sum(len(postings) for _, _, postings in sources),
+            )
+            totals = self._token_scores(per_token[0])
+            for sources in per_token[1:]:
+                if not totals:
+                    break
+                scores = self._token_scores(sources, candidates=totals)
+                totals = {idx: total + scores[idx] for idx, total in totals.items() if idx in scores}
+        return totals
@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from area_index import AREA_ALIASES, NEIGHBORHOODS, VIBE_ALIASES, AreaIndex, VibeIndex
+from compiled_venues import read_snapshot
+from metrics import VENUE_CHANGES, VENUE_COUNT, VENUE_LOAD_SECONDS
+from schedule import ScheduleIndex, venue_intervals
+from spatial_index import SpatialIndex
+from venue_diff import diff_venues
+from venue_model import PatchedVenues, VenueColumns, make_venues
+from venue_search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# How often (in seconds) handlers may trigger a check of the venues file
+DEFAULT_CHECK_INTERVAL = 5.0
+# Rough memory cost of a snapshot parsed from JSON, per byte of the file (measured
+# on synthetic data); a mapped compiled snapshot costs about its file size
+PARSED_BYTES_PER_SOURCE_BYTE = 5
+# Share of the venues that may differ from the last full build before a reload
+# rebuilds every index instead of updating them; updates leave empty slots and
+# grow the search overlay, so they stay cheap only while they are small
+MAX_PATCHED_SHARE = 0.1
+
+
+class VenueSnapshot:
+    """Immutable, fully parsed view of the venues file"""
+
+    __slots__ = (
+        'venues', 'version', 'mtime', 'loaded_at', 'city', 'footprint',
+        'spatial', 'schedule', 'areas', 'vibes', 'columns', 'search',
+        'keys', 'diff', 'drift',
+    )
+
+    def __init__(self, venues, version, mtime, neighborhoods=NEIGHBORHOODS, aliases=AREA_ALIASES):
+        # Compact immutable records; they still answer venue.get(...) like the JSON dicts
+        self.venues = make_venues(venues)
+        self.version = version
+        self.mtime = mtime
+        self.loaded_at = time.time()
+        # Set by the store: the city shard this snapshot belongs to and its estimated size
+        self.city = None
+        self.footprint = 0
+        # Venue identities (see venue_diff.venue_keys), computed by the first diff;
+        # the diff this snapshot was updated with, and venues touched since a full build
+        self.keys = None
+        self.diff = None
+        self.drift = 0
+        # Venues are indexed by their position in self.venues
+        self.spatial = SpatialIndex(
+            (idx, venue.latitude, venue.longitude)
+            for idx, venue in enumerate(self.venues)
+            if venue.latitude and venue.longitude
+        )
+        self.schedule = ScheduleIndex.from_venues(self.venues)
+        self.areas = AreaIndex(self.venues, neighborhoods, aliases)
+        self.vibes = VibeIndex(self.venues)
+        # Coordinates and area/vibe membership as flat columns for bulk work
+        self.columns = VenueColumns.from_indexes(
+            self.venues, self.areas, self.vibes, tuple(neighborhoods), tuple(VIBE_ALIASES)
+        )
+        # Name/address search for inline queries
+        self.search = SearchIndex(self.venues)
+
+    @classmethod
+    def from_compiled(cls, compiled, mtime, neighborhoods=NEIGHBORHOODS, aliases=AREA_ALIASES):
+        """Build a snapshot from a mapped compiled file without re-deriving any index"""
+        snapshot = cls.__new__(cls)
+        meta = compiled.meta
+        snapshot.venues = compiled.venues()
+        snapshot.version = compiled.source_version
+        snapshot.mtime = mtime
+        snapshot.loaded_at = time.time()
+        snapshot.city = None
+        snapshot.footprint = 0
+        snapshot.keys = None
+        snapshot.diff = None
+        snapshot.drift = 0
+        snapshot.spatial = SpatialIndex.from_arrays(meta['cell_size'], compiled.group('spatial'))
+        snapshot.schedule = ScheduleIndex.from_arrays(compiled.group('schedule'))
+        snapshot.areas = AreaIndex.from_arrays(compiled.group('areas'), neighborhoods, aliases)
+        snapshot.vibes = VibeIndex.from_arrays(compiled.group('vibes'))
+        snapshot.columns = VenueColumns.from_arrays(
+            compiled.group('columns'), meta['area_names'], meta['vibe_names']
+        )
+        snapshot.search = SearchIndex.from_arrays(compiled.group('search'))
+        return snapshot
+
+    @classmethod
+    def patched(cls, base, diff, version, mtime):
+        """Apply a VenueDiff to a snapshot, updating each index only where the diff touches it.
+
+        Venue ids keep their meaning across the update, so anything cached by id
+        for venues outside the diff stays valid. `base` is left unchanged.
+        """
+        snapshot = cls.__new__(cls)
+        changes = dict.fromkeys(diff.removed)
+        changes.update(diff.added)
+        snapshot.venues = PatchedVenues(base.venues, changes, diff.length)
+        snapshot.version = version
+        snapshot.mtime = mtime
+        snapshot.loaded_at = time.time()
+        snapshot.city = base.city
+        snapshot.footprint = base.footprint
+        snapshot.keys = diff.keys
+        snapshot.diff = diff
+        snapshot.drift = base.drift + len(diff)
+        snapshot.spatial = base.spatial.updated(
+            [(idx, venue.latitude, venue.longitude) for idx, venue in diff.removed.items()
+             if venue.latitude and venue.longitude],
+            [(idx, venue.latitude, venue.longitude) for idx, venue in diff.added.items()
+             if venue.latitude and venue.longitude],
+        )
+        snapshot.schedule = base.schedule.updated(
+            diff.removed,
+            [(idx, intervals) for idx, intervals in
+             ((idx, venue_intervals(venue)) for idx, venue in diff.added.items()) if intervals],
+        )
+        snapshot.areas = base.areas.updated(diff.removed, diff.added)
+        snapshot.vibes = base.vibes.updated(diff.removed, diff.added)
+        snapshot.columns = base.columns.updated(changes, diff.length, snapshot.areas, snapshot.vibes)
+        snapshot.search = base.search.updated(diff.removed, diff.added)
+        return snapshot
+
+    def __len__(self):
+        return len(self.venues)
+
+
+def _read_file(path):
+    """Read the venues file and return (stat, raw bytes)"""
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        return stat, f.read()
+
+
+def source_version(raw):
+    """Content version of a venues file: a short sha256 of its bytes"""
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def _parse_venues(raw):
+    """Parse and validate raw JSON bytes into a list of venue dicts"""
+    venues = json.loads(raw.decode('utf-8'))
+    if not isinstance(venues, list):
+        raise ValueError("venues file must contain a JSON list")
+    for idx, venue in enumerate(venues):
+        if not isinstance(venue, dict):
+            raise ValueError(f"venue #{idx} is not a JSON object")
+    return venues
+
+
+def _decode_venues(raw):
+    """Parse raw JSON bytes, logging and returning None if they're invalid"""
+    try:
+        return _parse_venues(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        # A bad edit must never take the bot down: keep serving the last good data
+        logger.error(f"Error decoding venues file, keeping previous data: {str(e)}")
+        return None
+
+
+class VenueStore:
+    """Process-wide venue store that parses the file once and hot-reloads it on change.
+
+    Handlers get the current immutable snapshot without touching the disk. The file's
+    mtime is checked at most every `check_interval` seconds in a worker thread, and a
+    new snapshot is swapped in only if the contents actually changed and parse cleanly.
+    A small change is diffed against the current snapshot and applied to copies of
+    its indexes (see VenueSnapshot.patched) instead of rebuilding them.
+    If `compiled_path` holds a snapshot compiled from the current file, it is mapped
+    instead of parsing the JSON and rebuilding the indexes.
+
+    `city` names the shard the file holds and `neighborhoods` / `aliases` are that
+    city's areas; they default to Tel Aviv's.
+    """
+
+    def __init__(self, path, check_interval=DEFAULT_CHECK_INTERVAL, compiled_path=None,
+                 city=None, neighborhoods=NEIGHBORHOODS, aliases=AREA_ALIASES):
+        self.path = path
+        self.check_interval = check_interval
+        self.compiled_path = compiled_path
+        self.city = city
+        self.neighborhoods = neighborhoods
+        self.aliases = aliases
+        self._snapshot = None
+        self._stat_key = None
+        self._last_check = 0.0
+        self._refresh_task = None
+
+    @property
+    def snapshot(self):
+        """The current snapshot, or None if nothing could be loaded yet"""
+        return self._snapshot
+
+    def load(self):
+        """Synchronously (re)load the venues file, keeping the old snapshot on failure"""
+        started = time.perf_counter()
+        result = 'error'
+        try:
+            result = self._load()
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            # Data that parses but can't be indexed is a failed load like any other
+            logger.error(f"Error indexing venues from {self.path}: {str(e)}")
+        finally:
+            VENUE_LOAD_SECONDS.observe(time.perf_counter() - started, result=result)
+        return self._snapshot
+
+    def _open_compiled(self, stat=None, version=None):
+        """Map the compiled snapshot if it matches the venues file, else return None"""
+        if not self.compiled_path:
+            return None
+        try:
+            compiled = read_snapshot(self.compiled_path, source_stat=stat, source_version=version)
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring compiled venues at {self.compiled_path}: {str(e)}")
+            return None
+        if compiled is None and version is not None and os.path.exists(self.compiled_path):
+            logger.warning(f"Compiled venues at {self.compiled_path} are stale, loading JSON instead")
+        if compiled is not None and list(compiled.meta['area_names']) != list(self.neighborhoods):
+            logger.warning(f"Compiled venues at {self.compiled_path} have other areas, loading JSON instead")
+            return None
+        return compiled
+
+    def _load(self):
+        """Body of load(); returns 'compiled', 'loaded', 'patched', 'unchanged' or 'error'"""
+        self._last_check = time.monotonic()
+        try:
+            stat = os.stat(self.path)
+            # A snapshot compiled from this very file spares even reading the JSON. Once
+            # data is loaded, a reload tries a patch first, which keeps the caches warm
+            compiled = self._open_compiled(stat=stat) if self._snapshot is None else None
+            if compiled is not None:
+                version = compiled.source_version
+            else:
+                stat, raw = _read_file(self.path)
+                version = source_version(raw)
+        except FileNotFoundError:
+            logger.error(f"Venues file not found at: {self.path}")
+            return 'error'
+        except OSError as e:
+            logger.error(f"Error reading venues file: {str(e)}")
+            return 'error'
+
+        self._stat_key = (stat.st_mtime_ns, stat.st_size)
+        if self._snapshot is not None and self._snapshot.version == version:
+            return 'unchanged'
+
+        venues = None
+        if self._snapshot is not None:
+            venues = _decode_venues(raw)
+            if venues is None:
+                return 'error'
+            snapshot = self._patched(venues, version, stat.st_mtime)
+            if snapshot is not None:
+                self._snapshot = snapshot
+                self._log_patch(snapshot)
+                return 'patched'
+
+        if compiled is None:
+            compiled = self._open_compiled(version=version)
+        if compiled is not None:
+            snapshot = VenueSnapshot.from_compiled(compiled, stat.st_mtime, self.neighborhoods, self.aliases)
+            snapshot.city = self.city
+            snapshot.footprint = os.path.getsize(self.compiled_path)
+            self._snapshot = snapshot
+            VENUE_COUNT.set(len(snapshot), city=self.city or '')
+            logger.info(f"Mapped {len(snapshot)} compiled venues from {self.compiled_path} (version {version})")
+            return 'compiled'
+
+        if venues is None:
+            venues = _decode_venues(raw)
+            if venues is None:
+                return 'error'
+        snapshot = VenueSnapshot(venues, version, stat.st_mtime, self.neighborhoods, self.aliases)
+        snapshot.city = self.city
+        snapshot.footprint = len(raw) * PARSED_BYTES_PER_SOURCE_BYTE
+        self._snapshot = snapshot
+        VENUE_COUNT.set(len(snapshot), city=self.city or '')
+        logger.info(f"Loaded {len(snapshot)} venues from {self.path} (version {version})")
+        return 'loaded'
+
+    def _patched(self, venues, version, mtime):
+        """The current snapshot updated to the parsed venues, or None if a full build is due"""
+        base = self._snapshot
+        if base is None:
+            return None
+        diff = diff_venues(base.venues, base.keys, venues, base.version)
+        if base.drift + len(diff) > MAX_PATCHED_SHARE * len(venues):
+            return None
+        return VenueSnapshot.patched(base, diff, version, mtime)
+
+    def _log_patch(self, snapshot):
+        diff = snapshot.diff
+        changed = len(diff.changed)
+        counts = {'added': len(diff.added) - changed, 'removed': len(diff.removed) - changed, 'changed': changed}
+        for kind, count in counts.items():
+            VENUE_CHANGES.inc(count, kind=kind)
+        VENUE_COUNT.set(len(diff.keys), city=self.city or '')
+        logger.info(
+            f"Updated venues from {self.path} (version {snapshot.version}): "
+            f"{counts['added']} added, {counts['removed']} removed, {changed} changed"
+        )
+
+    def _changed_on_disk(self):
+        """Return True if the file's mtime/size differ from the loaded snapshot"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) != self._stat_key
+
+    def _refresh_if_changed(self):
+        """Blocking check-and-reload, meant to run in a worker thread"""
+        if self._changed_on_disk():
+            return self.load()
+        self._last_check = time.monotonic()
+        return self._snapshot
+
+    async def refresh(self):
+        """Check the file off the event loop and swap in a new snapshot if it changed"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(asyncio.to_thread(self._refresh_if_changed))
+        return await asyncio.shield(self._refresh_task)
+
+    async def get(self):
+        """Return the current snapshot, scheduling a background change check when due"""
+        if self._snapshot is None:
+            return await self.refresh()
+        if time.monotonic() - self._last_check >= self.check_interval:
+            if self._refresh_task is None or self._refresh_task.done():
+                self._last_check = time.monotonic()
+                self._refresh_task = asyncio.ensure_future(asyncio.to_thread(self._refresh_if_changed))
+        return self._snapshot
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from telegram import Update  # noqa: E402
+
+from update_processor import ChatOrderedUpdateProcessor  # noqa: E402
+
+
+def message_update(update_id, chat_id):
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'text': 'tap',
+        },
+    }, None)
+
+
+def test_burst_from_one_chat_does_not_delay_another():
+    async def run():
+        processor = ChatOrderedUpdateProcessor(4)
+        release = asyncio.Event()
+        handled = []
+
+        async def slow(n):
+            await release.wait()
+            handled.append(n)
+
+        async def quick():
+            handled.append('other')
+
+        # Far more updates from chat 1 than there are slots, all stuck behind its first one
+        burst = [
+            asyncio.create_task(processor.process_update(message_update(n, 1), slow(n)))
+            for n in range(20)
+        ]
+        await asyncio.sleep(0)
+        other = asyncio.create_task(processor.process_update(message_update(100, 2), quick()))
+        await asyncio.wait_for(other, timeout=1)
+        assert handled == ['other']
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*burst), timeout=1)
+        assert handled == ['other'] + list(range(20))
+        # Every slot was given back
+        assert processor._semaphore._value == 4
+        assert not processor._chat_locks
+
+    asyncio.run(run())
+
+
+def test_updates_of_one_chat_run_one_at_a_time_in_order():
+    async def run():
+        processor = ChatOrderedUpdateProcessor(8)
+        running = []
+        order = []
+
+        async def handle(n):
+            running.append(n)
+            assert len(running) == 1
+            await asyncio.sleep(0.001)
+            order.append(n)
+            running.remove(n)
+
+        await asyncio.gather(*(
+            processor.process_update(message_update(n, 1), handle(n)) for n in range(10)
+        ))
+        assert order == list(range(10))
+
+    asyncio.run(run())